@@ -701,7 +701,7 @@ class Ui_MainWindow(object):
         self.label_7.setText(_translate("MainWindow", "Select a collection to edit its settings"))
         self.groupBox.setTitle(_translate("MainWindow", "File output and yt-dlp options"))
         self.settings_path_browse.setText(_translate("MainWindow", "Browse..."))
-        self.label_25.setStatusTip(_translate("MainWindow", "Comma-separated list of yt-dlp info-dict fields which are not saved in the metadata table. They are still saved temporarily so that they can be accessed in metadata selection right after downloading, but are deleted when MusicSync is closed."))
+        self.label_25.setStatusTip(_translate("MainWindow", "Comma-separated list of yt-dlp info-dict fields which are not saved in the metadata table. They are removed from the metadata of every track as soon as it has been downloaded, so they can\'t be accessed in metadata selection either."))
         self.label_25.setText(_translate("MainWindow", "Exclude these yt-dlp fields from the metadata table:"))
         self.label_2.setStatusTip(_translate("MainWindow", "The base folder where the files of all tracks in this collection will be saved."))
         self.label_2.setText(_translate("MainWindow", "Folder path:"))
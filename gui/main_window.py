@@ -9,6 +9,7 @@ from PySide6.QtGui import QAction, QCloseEvent, QIcon
 from PySide6.QtWidgets import (
     QDialogButtonBox,
     QFileDialog,
+    QInputDialog,
     QMainWindow,
     QMenu,
     QMessageBox,
@@ -17,7 +18,7 @@ from PySide6.QtWidgets import (
     QTreeWidgetItem, QHeaderView, )
 
 from musicsync.music_sync_library import TrackSyncAction, TrackSyncStatus, Script, PathComponent, \
-    ScriptReference
+    ScriptReference, CollectionUrl, MusicSyncLibrary
 from musicsync.scripting.script_types import MetadataSuggestionsScript, DownloadScript
 from .bookmark_dialog import BookmarkDialog
 from .main_gui import Ui_MainWindow
@@ -25,7 +26,7 @@ from .models.file_sync_model import ActionComboboxDelegate, FileSyncModel, FileS
 from .models.gui_combobox_model import ActionComboboxItemModel, DownloadScriptComboboxItemModel
 from .models.library_model import CollectionItem, CollectionUrlItem, FolderItem, LibraryModel
 from .models.scripts_model import ScriptsModel, ScriptItem
-from .threads import ThreadingWorker
+from .threads import ThreadingWorker, StreamingThreadingWorker
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
@@ -39,6 +40,29 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.action_save_library.triggered.connect(self.save_library)
         self.action_save_library_as.triggered.connect(self.save_library_as)
 
+        self.action_max_download_rate = QAction('Maximum download rate', self)
+        self.action_max_download_rate.setStatusTip('Limits the total download rate of all collections of the library')
+        self.action_max_download_rate.triggered.connect(self.set_max_download_rate)
+        self.action_download_priority = QAction('Download order', self)
+        self.action_download_priority.setStatusTip('Sets the criteria the downloads of all collections are ordered by')
+        self.action_download_priority.triggered.connect(self.set_download_priority)
+        self.action_metadata_retention = QAction('Metadata retention', self)
+        self.action_metadata_retention.setStatusTip('Deletes the downloaded metadata of old syncs after some days')
+        self.action_metadata_retention.triggered.connect(self.set_metadata_retention)
+        self.action_compare_library = QAction('Compare All Collections', self)
+        self.action_compare_library.setStatusTip('Compares all collections of the library at once')
+        self.action_compare_library.triggered.connect(lambda: self.compare_library())
+        self.action_refresh_library = QAction('Compare All Collections Without Cache', self)
+        self.action_refresh_library.setStatusTip('Compares all collections of the library at once and downloads the '
+                                                 'infos of all URLs again, even if they have just been compared')
+        self.action_refresh_library.triggered.connect(lambda: self.compare_library(force_refresh=True))
+        self.menuFile.addSeparator()
+        self.menuFile.addAction(self.action_compare_library)
+        self.menuFile.addAction(self.action_refresh_library)
+        self.menuFile.addAction(self.action_max_download_rate)
+        self.menuFile.addAction(self.action_download_priority)
+        self.menuFile.addAction(self.action_metadata_retention)
+
         # Library Tree View
         self.library_tree_view.setModel(LibraryModel())
         self.library_tree_view.expandAll()
@@ -53,8 +77,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.sync_status_table.setItemDelegateForColumn(FileSyncModelColumn.ACTION, ActionComboboxDelegate(
             update_callback=self.update_sync_buttons, window=self, view=self.sync_status_table))
 
-        self.compare_button.pressed.connect(self.compare_collection)
-        self.sync_button.pressed.connect(self.sync_collection)
+        self.compare_button.pressed.connect(lambda: self.compare_collection())
+        self.sync_button.pressed.connect(lambda: self.sync_collection())
 
         self.update_sync_buttons()
 
@@ -135,7 +159,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             elif answer == QMessageBox.StandardButton.Cancel:
                 return
 
-        filename, ok = QFileDialog.getOpenFileName(self, 'Select a file to load', filter="Pickle files (*.pkl) (*.pkl)")
+        filename, ok = QFileDialog.getOpenFileName(self, 'Select a file to load',
+                                                   filter="Libraries (*.sqlite *.pkl *.xml);;SQLite libraries (*.sqlite);;Pickle files (*.pkl) (*.pkl)")
         if filename:
             self.library_tree_view.setModel(LibraryModel(filename))
             self.library_tree_view.selectionModel().selectionChanged.connect(self.tree_selection_changed)
@@ -148,14 +173,24 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.save_settings()
         if self.library_tree_view.model().path:
             # self.library_tree_view.model().to_pickle()
-            self.library_tree_view.model().to_xml()
+            if self.library_tree_view.model().path.endswith('.sqlite'):
+                self.library_tree_view.model().to_sqlite()
+            else:
+                self.library_tree_view.model().to_xml()
             return True
 
         return self.save_library_as()
 
     def save_library_as(self):
-        filename, ok = QFileDialog.getSaveFileName(self, 'Select a file to save to', filter="Pickle files (*.pkl) (*.pkl)")
+        # saving an XML library as an SQLite library migrates it
+        filename, ok = QFileDialog.getSaveFileName(self, 'Select a file to save to',
+                                                   filter="Pickle files (*.pkl) (*.pkl);;SQLite libraries (*.sqlite)")
         if filename:
+            if filename.endswith('.sqlite'):
+                self.library_tree_view.model().to_sqlite(filename)
+                self.library_tree_view.model().path = filename
+                return True
+
             if not filename.endswith('.pkl'):
                 filename += '.pkl'
 
@@ -165,6 +200,37 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             return True
         return False
 
+    def set_max_download_rate(self):
+        model = self.library_tree_view.model()
+        rate, ok = QInputDialog.getInt(self, 'Maximum download rate',
+                                       'Maximum total download rate of all collections in KiB/s (0 for no limit):',
+                                       model.max_download_rate // 1024, 0, 2 ** 31 - 1)
+        if ok:
+            model.max_download_rate = rate * 1024
+
+    def set_download_priority(self):
+        model = self.library_tree_view.model()
+        criteria = ', '.join(MusicSyncLibrary.DOWNLOAD_PRIORITY_CRITERIA)
+        value, ok = QInputDialog.getText(self, 'Download order',
+                                         f'Comma-separated criteria the downloads are ordered by ({criteria}):',
+                                         text=model.download_priority)
+        if not ok:
+            return
+        try:
+            MusicSyncLibrary.parse_download_priority(value)
+        except ValueError as e:
+            QMessageBox.warning(self, 'Error', str(e))
+            return
+        model.download_priority = value
+
+    def set_metadata_retention(self):
+        model = self.library_tree_view.model()
+        days, ok = QInputDialog.getInt(self, 'Metadata retention',
+                                       'Days the downloaded metadata of old syncs is kept (0 to keep it forever):',
+                                       model.metadata_retention_days, 0, 2 ** 31 - 1)
+        if ok:
+            model.metadata_retention_days = days
+
     def tab_changed(self, *_):
         self.save_settings(self.get_selected_collection())
 
@@ -298,15 +364,32 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     # -------------
     # File sync tab
     # -------------
-    def compare_collection(self):
-        selected_collection = self.get_selected_collection()
+    def compare_collection(self, selected_collection: CollectionItem | None = None, incremental: bool = False,
+                           selected_urls: list[CollectionUrl] | None = None, force_refresh: bool = False):
+        """
+        :param incremental: If true, only new, selected and outdated URLs are compared and the result is merged into the
+            current compare result of the collection
+        :param force_refresh: If true, the infos of all URLs are downloaded again instead of being reused from the
+            extraction cache
+        """
+        if selected_collection is None:
+            selected_collection = self.get_selected_collection()
         assert selected_collection is not None
 
         selected_collection.comparing = True
 
         thread = QThread()
-        worker = ThreadingWorker(selected_collection.compare,
-                                 extra={'selected_collection': selected_collection})
+        if incremental:
+            worker = ThreadingWorker(selected_collection.compare_incremental,
+                                     selected_collection.compare_result,
+                                     selected_urls=selected_urls,
+                                     extra={'selected_collection': selected_collection})
+        else:
+            # the results of the urls are shown as soon as they are available
+            selected_collection.compare_result = None
+            worker = StreamingThreadingWorker(selected_collection.compare, force_refresh=force_refresh,
+                                              extra={'selected_collection': selected_collection, 'streaming': True})
+            worker.chunk.connect(self.compare_chunk_received)
         worker.moveToThread(thread)
         thread.started.connect(worker.run)
         worker.result.connect(thread.quit)
@@ -325,14 +408,40 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.update_sync_buttons()
         self.update_sync_progress()
 
+    def compare_chunk_received(self, chunk: pd.DataFrame, extra):
+        selected_collection: CollectionItem = extra['selected_collection']
+
+        if selected_collection.compare_result is None:
+            selected_collection.compare_result = chunk
+            if selected_collection is self.get_selected_collection():
+                self.update_tables()
+        else:
+            selected_collection.compare_result = pd.concat([selected_collection.compare_result, chunk], ignore_index=True)
+
+            model = self.sync_status_table.model()
+            if isinstance(model, FileSyncModel) and model.collection_item is selected_collection:
+                model.append_compare_result(chunk)
+
+        self.update_sync_progress(collection=selected_collection)
+
     def compare_finished(self, result, extra):
         selected_collection: CollectionItem = extra['selected_collection']
 
         if not isinstance(result, Exception):
+            streamed = extra.get('streaming') and selected_collection.compare_result is not None
             selected_collection.compare_result = result
 
-            self.update_tables()
+            # when the result was streamed, the table already contains all rows and possibly changed actions
+            model = self.sync_status_table.model()
+            if not (streamed and isinstance(model, FileSyncModel) and model.collection_item is selected_collection):
+                self.update_tables()
         else:
+            if extra.get('streaming'):
+                # discard the partial result
+                selected_collection.compare_result = None
+                if selected_collection is self.get_selected_collection():
+                    self.update_tables()
+
             if isinstance(result, pd.errors.DatabaseError):
                 QMessageBox.warning(self, 'Error',
                                     'Bookmark sync could not be performed because the database is locked. Close your browser and try again.')
@@ -345,16 +454,107 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.update_sync_buttons()
         self.update_sync_progress()
 
-    def sync_collection(self):
-        selected_collection = self.get_selected_collection()
+    def compare_library(self, force_refresh: bool = False):
+        """
+        Compares all collections of the library at once, see ``MusicSyncLibrary.compare``.
+
+        :param force_refresh: See ``compare_collection``
+        """
+        model: LibraryModel = self.library_tree_view.model()
+        collections = list(model.iter_collection_items())
+        if any(collection.comparing or collection.syncing for collection in collections):
+            QMessageBox.warning(self, 'Error', 'Wait until all collections have finished comparing and syncing.')
+            return
+
+        for collection in collections:
+            collection.comparing = True
+            # the results of the urls are shown as soon as they are available
+            collection.compare_result = None
+
+        thread = QThread()
+        worker = StreamingThreadingWorker(model.compare, force_refresh=force_refresh, extra={'collections': collections})
+        worker.chunk.connect(self.library_compare_chunk_received)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.result.connect(thread.quit)
+        worker.result.connect(worker.deleteLater)
+        worker.result.connect(self.library_compare_finished)
+        worker.progress.connect(functools.partial(self.update_library_compare_progress, collections=collections))
+        thread.finished.connect(thread.deleteLater)
+        worker.result.connect(lambda *_, w=worker: self.workers.remove(w))
+        thread.finished.connect(lambda *_, t=thread: self.threads.remove(t))
+
+        thread.start()
+
+        self.threads.append(thread)
+        self.workers.append(worker)
+
+        self.update_sync_buttons()
+        self.update_sync_progress()
+
+    def library_compare_chunk_received(self, chunk: tuple[CollectionItem, pd.DataFrame], extra):
+        collection, status_df = chunk
+        self.compare_chunk_received(status_df, {'selected_collection': collection})
+
+    def update_library_compare_progress(self, progress: float, text: str, collections: list[CollectionItem]):
+        for collection in collections:
+            collection.sync_progress = progress
+            collection.sync_text = text
+        self.update_sync_progress()
+
+    def library_compare_finished(self, results, extra):
+        collections: list[CollectionItem] = extra['collections']
+        if isinstance(results, Exception):
+            results = [results] * len(collections)
+
+        errors = []
+        for collection, result in zip(collections, results):
+            if isinstance(result, Exception):
+                # discard the partial result
+                collection.compare_result = None
+                if not isinstance(result, InterruptedError):
+                    errors.append(f'{collection.name}: {result}')
+            else:
+                collection.compare_result = result
+            collection.comparing = False
+
+        self.update_tables()
+        self.update_sync_buttons()
+        self.update_sync_progress()
+
+        if errors:
+            QMessageBox.warning(self, 'Error', 'There were errors while comparing these collections:\n' + '\n'.join(errors))
+
+    def sync_collection(self, selected_collection: CollectionItem | None = None, resume: bool = False,
+                        retranscode: bool = False, compare_and_sync: bool = False):
+        """
+        :param resume: If true, the remaining actions of the interrupted syncs of the collection are performed instead
+            of the actions in the file sync table
+        :param retranscode: If true, the files of the collection are transcoded again from the source media cache
+            instead
+        :param compare_and_sync: If true, the collection is compared and synced with its default sync actions, without
+            reviewing the actions in the file sync table
+        """
+        if selected_collection is None:
+            selected_collection = self.get_selected_collection()
         assert selected_collection is not None  # make ide happy
 
         selected_collection.syncing = True
 
         thread = QThread()
-        worker = ThreadingWorker(selected_collection.sync,
-                                 self.sync_status_table.model().df,
-                                 extra={'selected_collection': selected_collection})
+        if resume:
+            worker = ThreadingWorker(selected_collection.resume_sync,
+                                     extra={'selected_collection': selected_collection})
+        elif retranscode:
+            worker = ThreadingWorker(selected_collection.retranscode,
+                                     extra={'selected_collection': selected_collection})
+        elif compare_and_sync:
+            worker = ThreadingWorker(selected_collection.compare_and_sync,
+                                     extra={'selected_collection': selected_collection})
+        else:
+            worker = ThreadingWorker(selected_collection.sync,
+                                     self.sync_status_table.model().df,
+                                     extra={'selected_collection': selected_collection})
         worker.moveToThread(thread)
         thread.started.connect(worker.run)
         worker.result.connect(thread.quit)
@@ -703,6 +903,45 @@ class TreeContextMenu(QMenu):
                     'This collection is synchronized with a bookmarks folder, so manually adding URLs is not possible')
                 import_urls_from_bookmarks_action.setEnabled(False)
             self.addAction(import_urls_from_bookmarks_action)
+
+            compare_action = QAction('Compare New And Outdated URLs')
+            compare_action.triggered.connect(self.compare_incremental)
+            compare_action.setEnabled(not (self.item.comparing or self.item.syncing))
+            self.addAction(compare_action)
+
+            refresh_action = QAction('Compare Without Cache')
+            refresh_action.setToolTip('Downloads the infos of all URLs again, even if they have just been compared')
+            refresh_action.triggered.connect(self.compare_without_cache)
+            refresh_action.setEnabled(not (self.item.comparing or self.item.syncing))
+            self.addAction(refresh_action)
+
+            compare_and_sync_action = QAction('Compare And Sync Without Review')
+            compare_and_sync_action.setToolTip('Downloads new tracks while comparing and performs the default sync '
+                                               'actions of the collection')
+            compare_and_sync_action.triggered.connect(self.compare_and_sync)
+            compare_and_sync_action.setEnabled(not (self.item.comparing or self.item.syncing))
+            self.addAction(compare_and_sync_action)
+
+            resume_sync_action = QAction('Resume Interrupted Sync')
+            resume_sync_action.triggered.connect(self.resume_sync)
+            resume_sync_action.setEnabled(not (self.item.comparing or self.item.syncing) and self.item.has_unfinished_sync())
+            self.addAction(resume_sync_action)
+
+            pinned_action = QAction('Download before other collections', checkable=True, checked=self.item.pinned)
+            pinned_action.triggered.connect(self.toggle_pinned)
+            self.addAction(pinned_action)
+
+            cache_action = QAction('Keep original downloads in cache', checkable=True,
+                                   checked=self.item.cache_source_media)
+            cache_action.triggered.connect(self.toggle_cache_source_media)
+            self.addAction(cache_action)
+
+            retranscode_action = QAction('Transcode Files From Cache')
+            retranscode_action.setToolTip('Converts the files to the current file extension without downloading them '
+                                          'again, if their original downloads are in the cache')
+            retranscode_action.triggered.connect(self.retranscode)
+            retranscode_action.setEnabled(not (self.item.comparing or self.item.syncing))
+            self.addAction(retranscode_action)
         elif isinstance(self.item, CollectionUrlItem):
             subfolder_action = QAction('Save playlist in subfolder', checkable=True, checked=self.item.save_to_subfolder)
             subfolder_action.triggered.connect(self.toggle_subfolder)
@@ -716,6 +955,11 @@ class TreeContextMenu(QMenu):
             concat_action.triggered.connect(self.toggle_concat)
             self.addAction(concat_action)
 
+            compare_action = QAction('Compare URL')
+            compare_action.triggered.connect(self.compare_incremental)
+            compare_action.setEnabled(not (self.item.excluded or self.item.parent.comparing or self.item.parent.syncing))
+            self.addAction(compare_action)
+
         if self.item is not None:
             delete_action = QAction('Delete')
             delete_action.setIcon(QIcon.fromTheme(QIcon.ThemeIcon.EditDelete))
@@ -781,6 +1025,26 @@ class TreeContextMenu(QMenu):
             for data in urls:
                 self.model.add_url(self.item, **data)
 
+    def compare_incremental(self):
+        window = cast(MainWindow, self.parent.window())
+
+        if isinstance(self.item, CollectionUrlItem):
+            window.compare_collection(self.item.parent, incremental=True, selected_urls=[self.item.xml_object])
+        else:
+            window.compare_collection(self.item, incremental=True)
+
+    def compare_without_cache(self):
+        cast(MainWindow, self.parent.window()).compare_collection(self.item, force_refresh=True)
+
+    def resume_sync(self):
+        cast(MainWindow, self.parent.window()).sync_collection(self.item, resume=True)
+
+    def retranscode(self):
+        cast(MainWindow, self.parent.window()).sync_collection(self.item, retranscode=True)
+
+    def compare_and_sync(self):
+        cast(MainWindow, self.parent.window()).sync_collection(self.item, compare_and_sync=True)
+
     def toggle_excluded(self):
         assert isinstance(self.item, CollectionUrlItem)
 
@@ -793,6 +1057,14 @@ class TreeContextMenu(QMenu):
         assert isinstance(self.item, CollectionUrlItem)
         self.item.concat = not self.item.concat
 
+    def toggle_pinned(self):
+        assert isinstance(self.item, CollectionItem)
+        self.item.pinned = not self.item.pinned
+
+    def toggle_cache_source_media(self):
+        assert isinstance(self.item, CollectionItem)
+        self.item.cache_source_media = not self.item.cache_source_media
+
     def toggle_subfolder(self):
         assert isinstance(self.item, CollectionUrlItem)
         self.item.save_to_subfolder = not self.item.save_to_subfolder
@@ -67,6 +67,8 @@ class FileSyncModelColumn(IntEnum):
 
 class FileSyncModel(DataFrameTableModel):
     def __init__(self, collection_item: CollectionItem, parent):
+        self.collection_item = collection_item
+
         if collection_item.compare_result is None:
             df = FileSyncModel.urls_to_df(collection_item)
             df.sort_values(by='status',
@@ -108,7 +110,7 @@ class FileSyncModel(DataFrameTableModel):
         for url in collection_item.urls:
             url_df = pd.DataFrame.from_records([dict(zip(columns, [
                 url.name,
-                track.playlist_index,
+                track.playlist_index if pd.notna(track.playlist_index) else '',
                 track.title,
                 track.filename,
                 track.status,
@@ -122,16 +124,29 @@ class FileSyncModel(DataFrameTableModel):
 
         return df
 
+    def append_compare_result(self, compare_result: pd.DataFrame):
+        """
+        Appends the rows of a partial compare result to the table.
+        """
+        df = FileSyncModel.compare_result_to_df(self.collection_item, compare_result)
+        if df.empty:
+            return
+
+        self.beginInsertRows(QModelIndex(), len(self.df), len(self.df) + len(df) - 1)
+        self.df = pd.concat([self.df, df], ignore_index=True)
+        self.endInsertRows()
+
     @staticmethod
-    def compare_result_to_df(collection_item: CollectionItem) -> pd.DataFrame:
-        compare_result = collection_item.compare_result
+    def compare_result_to_df(collection_item: CollectionItem, compare_result: pd.DataFrame | None = None) -> pd.DataFrame:
+        if compare_result is None:
+            compare_result = collection_item.compare_result
         assert compare_result is not None  # make ide happy
 
         columns = [c.df_column_name for c in FileSyncModelColumn.__members__.values()]
 
         return pd.DataFrame(dict(zip(columns, [
             compare_result['collection_url'].apply(lambda x: x.name),
-            compare_result['playlist_index'].fillna(''),
+            compare_result['playlist_index'].astype(object).fillna(''),
             compare_result['title'],
             compare_result['filename'],
             compare_result['status'],
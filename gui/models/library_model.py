@@ -1,4 +1,4 @@
-from typing import cast, Union, Callable
+from typing import cast, Union, Callable, Iterator
 
 import pandas as pd
 from PySide6.QtCore import QModelIndex
@@ -14,13 +14,11 @@ class LibraryModel(XmlObjectModel):
     def __init__(self, path: str=None):
         super(LibraryModel, self).__init__()
 
-        self.saved_library_object: MusicSyncLibrary | None = None
         self.library_object: MusicSyncLibrary | None = None
 
         if path is not None:
             # self.loaded_library_object = MusicSyncLibrary.read_pickle(path)
-            self.saved_library_object = MusicSyncLibrary.read_xml(path)  # only used to determine if library has been changed before saving
-            self.library_object = MusicSyncLibrary.read_xml(path)  # has to be a copy, not the same object as saved_library_object
+            self.library_object = self.read_library(path)
 
             assert self.library_object is not None  # make ide happy
 
@@ -28,6 +26,12 @@ class LibraryModel(XmlObjectModel):
         else:
             self.library_object = MusicSyncLibrary()
 
+    @staticmethod
+    def read_library(path: str) -> MusicSyncLibrary:
+        if path.endswith('.sqlite'):
+            return MusicSyncLibrary.read_sqlite(path)
+        return MusicSyncLibrary.read_xml(path)
+
     @property
     def path(self) -> str:
         assert self.library_object is not None  # make ide happy
@@ -46,6 +50,33 @@ class LibraryModel(XmlObjectModel):
     def scripts(self, value: set['Script']):
         self.library_object.scripts = value
 
+    @property
+    def max_download_rate(self) -> int:
+        assert self.library_object is not None
+        return self.library_object.max_download_rate
+
+    @max_download_rate.setter
+    def max_download_rate(self, value: int):
+        self.library_object.max_download_rate = value
+
+    @property
+    def download_priority(self) -> str:
+        assert self.library_object is not None
+        return self.library_object.download_priority
+
+    @download_priority.setter
+    def download_priority(self, value: str):
+        self.library_object.download_priority = value
+
+    @property
+    def metadata_retention_days(self) -> int:
+        assert self.library_object is not None
+        return self.library_object.metadata_retention_days
+
+    @metadata_retention_days.setter
+    def metadata_retention_days(self, value: int):
+        self.library_object.metadata_retention_days = value
+
     @property
     def metadata_table(self) -> pd.DataFrame:
         assert self.library_object is not None
@@ -78,6 +109,7 @@ class LibraryModel(XmlObjectModel):
             children.append(row.xml_object)
 
         self.library_object.children = children
+        self.library_object.link_collections()
 
     def pull_from_xml_object(self) -> None:
         self.removeRows(0, self.rowCount())
@@ -90,6 +122,39 @@ class LibraryModel(XmlObjectModel):
             elif isinstance(child, Collection):
                 self.insert_item_at_item(CollectionItem(child))
 
+    def iter_collection_items(self, parent: XmlObjectModelItem | None = None) -> Iterator['CollectionItem']:
+        if parent is None:
+            parent = self.root
+
+        for i in range(parent.row_count()):
+            child = parent.child(i)
+            if isinstance(child, FolderItem):
+                yield from self.iter_collection_items(child)
+            elif isinstance(child, CollectionItem):
+                yield child
+
+    def compare(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None,
+                chunk_callback: Callable[[tuple['CollectionItem', pd.DataFrame]], None] | None=None,
+                force_refresh: bool = False) -> list[pd.DataFrame | Exception] | Exception:
+        """
+        Compares all collections of the library concurrently, see ``MusicSyncLibrary.compare``.
+
+        :param chunk_callback: Called with tuples of (collection item, status dataframe of a collection url)
+        :return: The compare result of every collection, in the order of ``iter_collection_items``
+        """
+        assert self.library_object is not None
+
+        self.push_to_xml_object()
+        items = {id(item.xml_object): item for item in self.iter_collection_items()}
+        result = self.library_object.compare(
+            force_refresh=force_refresh, progress_callback=progress_callback, interruption_callback=interruption_callback,
+            chunk_callback=None if chunk_callback is None
+            else lambda collection, chunk: chunk_callback((items[id(collection)], chunk)))
+        for item in items.values():
+            item.pull_from_xml_object()
+
+        return result
+
     def item_is_container(self, item: XmlObjectModelItem) -> bool:
         if isinstance(item, CollectionUrlItem):
             return False
@@ -121,7 +186,14 @@ class LibraryModel(XmlObjectModel):
         assert self.library_object is not None
         self.push_to_xml_object()
         self.library_object.write_xml(filename)
-        self.saved_library_object = MusicSyncLibrary.read_xml(filename)
+
+    def to_sqlite(self, filename: str | None=None):
+        if filename is None:
+            filename: str = self.path
+
+        assert self.library_object is not None
+        self.push_to_xml_object()
+        self.library_object.write_sqlite(filename)
 
     def to_pickle(self, filename: str | None=None):
         if filename is None:
@@ -131,17 +203,18 @@ class LibraryModel(XmlObjectModel):
 
         self.push_to_xml_object()
         self.library_object.write_pickle(filename)
-        self.saved_library_object = MusicSyncLibrary.read_pickle(filename)
 
     def has_changed(self):
         if self.root.row_count() == 0:
             return False
 
-        if self.saved_library_object is None:
+        assert self.library_object is not None  # make ide happy
+        if not self.library_object.path:
+            # the library has never been saved
             return True
 
         self.push_to_xml_object()
-        return self.library_object != self.saved_library_object
+        return self.library_object.has_changed()
 
     def add_folder(self, parent: FolderItem | None):
         new_folder = FolderItem()
@@ -316,6 +389,38 @@ class CollectionItem(XmlObjectModelItem):
     def yt_dlp_options(self, value: str) -> None:
         self.xml_object.yt_dlp_options = value
 
+    @property
+    def max_concurrent_extractions(self) -> int:
+        return self.xml_object.max_concurrent_extractions
+
+    @max_concurrent_extractions.setter
+    def max_concurrent_extractions(self, value: int) -> None:
+        self.xml_object.max_concurrent_extractions = value
+
+    @property
+    def max_concurrent_downloads(self) -> int:
+        return self.xml_object.max_concurrent_downloads
+
+    @max_concurrent_downloads.setter
+    def max_concurrent_downloads(self, value: int) -> None:
+        self.xml_object.max_concurrent_downloads = value
+
+    @property
+    def pinned(self) -> bool:
+        return self.xml_object.pinned
+
+    @pinned.setter
+    def pinned(self, value: bool) -> None:
+        self.xml_object.pinned = value
+
+    @property
+    def cache_source_media(self) -> bool:
+        return self.xml_object.cache_source_media
+
+    @cache_source_media.setter
+    def cache_source_media(self, value: bool) -> None:
+        self.xml_object.cache_source_media = value
+
     @property
     def sync_bookmark_file(self) -> str:
         return self.xml_object.sync_bookmark_file
@@ -403,11 +508,26 @@ class CollectionItem(XmlObjectModelItem):
 
         self.xml_object.urls = children
 
-    def compare(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+    def compare(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None,
+                chunk_callback: Callable[[pd.DataFrame], None] | None=None, force_refresh: bool = False) -> pd.DataFrame | Exception:
+        assert self.xml_object is not None
+
+        self.push_to_xml_object()
+        result = self.xml_object.compare(progress_callback=progress_callback, interruption_callback=interruption_callback,
+                                         chunk_callback=chunk_callback, force_refresh=force_refresh)
+        self.pull_from_xml_object()
+
+        return result
+
+    def compare_incremental(self, previous_result: pd.DataFrame | None, selected_urls: list[CollectionUrl] | None = None,
+                            progress_callback: Callable[[float, str], None] | None=None,
+                            interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
         assert self.xml_object is not None
 
         self.push_to_xml_object()
-        result = self.xml_object.compare(progress_callback=progress_callback, interruption_callback=interruption_callback)
+        result = self.xml_object.compare_incremental(previous_result, selected_urls=selected_urls,
+                                                     progress_callback=progress_callback,
+                                                     interruption_callback=interruption_callback)
         self.pull_from_xml_object()
 
         return result
@@ -421,6 +541,37 @@ class CollectionItem(XmlObjectModelItem):
         self.pull_from_xml_object()
         return result
 
+    def has_unfinished_sync(self) -> bool:
+        assert self.xml_object is not None
+        return self.xml_object.has_unfinished_sync()
+
+    def resume_sync(self, progress_callback: Callable[[float, str], None] | None = None,
+                    interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame | Exception:
+        assert self.xml_object is not None
+
+        self.push_to_xml_object()
+        result = self.xml_object.resume_sync(progress_callback, interruption_callback)
+        self.pull_from_xml_object()
+        return result
+
+    def compare_and_sync(self, progress_callback: Callable[[float, str], None] | None = None,
+                         interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame | Exception:
+        assert self.xml_object is not None
+
+        self.push_to_xml_object()
+        result = self.xml_object.compare_and_sync(progress_callback, interruption_callback)
+        self.pull_from_xml_object()
+        return result
+
+    def retranscode(self, progress_callback: Callable[[float, str], None] | None = None,
+                    interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame | Exception:
+        assert self.xml_object is not None
+
+        self.push_to_xml_object()
+        result = self.xml_object.retranscode(progress_callback, interruption_callback)
+        self.pull_from_xml_object()
+        return result
+
     def get_real_path(self, url: 'CollectionUrl', track=None):
         self.push_to_xml_object()
         return self.xml_object.get_real_path(url, track)
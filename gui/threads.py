@@ -24,4 +24,20 @@ class ThreadingWorker(QObject):
 
     @staticmethod
     def is_interruption_requested() -> bool:
-        return QThread.currentThread().isInterruptionRequested()
\ No newline at end of file
+        return QThread.currentThread().isInterruptionRequested()
+
+
+class StreamingThreadingWorker(ThreadingWorker):
+    """
+    Worker for functions which deliver their result in chunks through a ``chunk_callback`` before returning.
+    """
+    chunk = Signal(Any, Any)
+
+    @Slot()
+    def run(self):
+        result = self.func(*self.args, progress_callback=self.emit_progress, interruption_callback=self.is_interruption_requested,
+                           chunk_callback=self.emit_chunk, **self.kwargs)
+        self.result.emit(result, self.extra)
+
+    def emit_chunk(self, chunk: Any):
+        self.chunk.emit(chunk, self.extra)
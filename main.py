@@ -1,11 +1,40 @@
+import argparse
 import json
 import sys
 import logging.config
 import os
 
-from PySide6.QtWidgets import QApplication
+from musicsync.music_sync_library import MusicSyncLibrary
+from musicsync.utils import Logger
+
+
+def compare_and_sync(library_path: str) -> int:
+    """
+    Compares and syncs all collections of the library without user interaction (see ``Collection.compare_and_sync``)
+    and saves the library afterwards.
+
+    :return: The exit code, 1 if any collection failed
+    """
+    logger = Logger(prefix='compare_and_sync')
+    if library_path.endswith('.sqlite'):
+        library = MusicSyncLibrary.read_sqlite(library_path)
+    else:
+        library = MusicSyncLibrary.read_xml(library_path)
+
+    exit_code = 0
+    for collection in library.iter_collections():
+        logger.info(f'Comparing and syncing collection "{collection.name}"')
+        result = collection.compare_and_sync()
+        if isinstance(result, Exception):
+            logger.error(f'Could not sync collection "{collection.name}": {result}')
+            exit_code = 1
+
+    if library_path.endswith('.sqlite'):
+        library.write_sqlite(library_path)
+    else:
+        library.write_xml(library_path)
+    return exit_code
 
-from gui.main_window import MainWindow
 
 if __name__ == "__main__":
     if not os.path.isdir('logs'):
@@ -14,7 +43,21 @@ if __name__ == "__main__":
         logging_config = json.load(f)
     logging.config.dictConfig(logging_config)
 
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--compare-and-sync', metavar='LIBRARY',
+                        help='Compare and sync all collections of the library without opening the GUI, e.g. for '
+                             'scheduled runs')
+    args, qt_args = parser.parse_known_args()
+
+    if args.compare_and_sync:
+        sys.exit(compare_and_sync(args.compare_and_sync))
+
+    # pyside6 is only needed for the GUI
+    from PySide6.QtWidgets import QApplication
+
+    from gui.main_window import MainWindow
+
+    app = QApplication(sys.argv[:1] + qt_args)
 
     window = MainWindow()
     window.show()
@@ -0,0 +1,69 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, ClassVar
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by all running downloads, which limits their total download rate to ``rate`` bytes per second.
+    Downloads report their progress with ``consume`` and are blocked until the bucket has enough tokens again. If
+    several downloads are waiting, the one with the lowest priority value gets the next tokens, so that important
+    downloads finish first when the bandwidth is scarce.
+    """
+
+    # seconds a download waits at most before checking the rate and the interruption again
+    MAX_WAIT: ClassVar[float] = 0.2
+
+    def __init__(self, rate: int = 0, burst: float = 1.0):
+        """
+        :param rate: Maximum total download rate in bytes per second, 0 for no limit
+        :param burst: Number of seconds of the rate that can be downloaded at once after being idle
+        """
+        self.rate = rate
+        self.burst = burst
+
+        self._condition = threading.Condition()
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._waiting: list[tuple[Any, int]] = []
+        self._counter = itertools.count()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * self.burst)
+        self._updated = now
+
+    def consume(self, amount: int, priority: Any = 0, interrupted: threading.Event | None = None):
+        """
+        Takes ``amount`` bytes from the bucket, waiting until it's the turn of this download and the bucket isn't empty.
+        The bucket may go into debt, so that chunks larger than the bucket are possible; the debt delays the next
+        downloads accordingly.
+
+        :param priority: Downloads with a lower value are served first, must be comparable to the priorities of all
+            other downloads
+        :param interrupted: Event that is set when the download has been interrupted
+        :raise InterruptedError: If ``interrupted`` is set while waiting
+        """
+        if self.rate <= 0 or amount <= 0:
+            return
+
+        with self._condition:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if interrupted is not None and interrupted.is_set():
+                        raise InterruptedError
+                    self._refill()
+                    if self.rate <= 0 or (self._waiting[0] == ticket and self._tokens > 0):
+                        self._tokens -= amount
+                        return
+                    # the rate might have been changed or the download interrupted, so don't wait too long at once
+                    timeout = max(-self._tokens / self.rate, 0.001) if self._waiting[0] == ticket else None
+                    self._condition.wait(min(timeout, self.MAX_WAIT) if timeout is not None else self.MAX_WAIT)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
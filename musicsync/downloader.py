@@ -1,30 +1,72 @@
+import math
 import os.path
+import sqlite3
+import threading
 from collections import namedtuple
-from functools import partial
-from typing import Callable, Any
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor, wait
+from typing import Callable, Any, ClassVar, Iterable, Iterator
 
 import pandas as pd
 import yt_dlp
+from yt_dlp.postprocessor import FFmpegExtractAudioPP
 from yt_dlp.postprocessor.common import PostProcessor
-from yt_dlp.utils import MEDIA_EXTENSIONS
+from yt_dlp.utils import MEDIA_EXTENSIONS, DownloadError, ExtractorError, GeoRestrictedError, UnsupportedError
 
 import musicsync.music_sync_library as lib
+from .bandwidth_limiter import BandwidthLimiter
 from .bookmark_library import BookmarkLibrary
-from .utils import classproperty, Logger, cli_to_api
+from .extraction_cache import ExtractionCache
+from .folder_snapshot import FolderSnapshot
+from .host_limited_executor import HostLimitedExecutor
+from .metadata_sink import MetadataSink
+from .retry_queue import RetryQueue
+from .source_media_cache import SourceMediaCache
+from .sync_journal import SyncJournal
+from .sync_plan import PlannedTrack, SyncPlan
+from .utils import classproperty, Logger, cli_to_api, link_file, occurrence_index, url_domain
 
 RemoteInfo = namedtuple('RemoteInfo', ['url', 'title', 'playlist_index'])
 
 
 class DownloadLogger:
     logger = Logger(prefix='yt-dlp')
+    # seconds between two checks of the interruption callback while waiting for other threads, see as_completed
+    POLL_INTERVAL: ClassVar[float] = 0.2
 
     def __init__(self):
         self.interruption_callback: Callable[[], bool] | None = None
+        # set as soon as any thread has noticed the interruption. The interruption callback (e.g. of a QThread) might
+        # only work in the thread that started the operation, so the worker threads check this event instead.
+        self.interrupted = threading.Event()
+
+    def reset(self, interruption_callback: Callable[[], bool] | None):
+        """
+        Sets the interruption callback for a new operation and clears a previous interruption.
+        """
+        self.interruption_callback = interruption_callback
+        self.interrupted.clear()
 
     def check_interruption_callback(self):
+        if self.interrupted.is_set():
+            raise InterruptedError
         if self.interruption_callback is not None and self.interruption_callback():
+            self.interrupted.set()
             raise InterruptedError
 
+    def as_completed(self, futures: Iterable[Future]) -> Iterator[Future]:
+        """
+        Like ``concurrent.futures.as_completed``, but checks the interruption callback in the calling thread every
+        ``POLL_INTERVAL`` seconds while waiting.
+
+        :raise InterruptedError: As soon as the operation has been interrupted. The worker threads stop at their next
+            check, the pending futures have to be cancelled by the caller.
+        """
+        pending = set(futures)
+        while pending:
+            self.check_interruption_callback()
+            done, pending = wait(pending, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            yield from done
+
     def debug(self, msg: str) -> None:
         self.check_interruption_callback()
         self.logger.debug(msg)
@@ -72,6 +114,12 @@ class MusicSyncPostProcessor(PostProcessor):
 
 
 class MusicSyncDownloader(yt_dlp.YoutubeDL):
+    MAX_DOWNLOADS_PER_HOST: ClassVar[int] = 2
+    # maximum number of URL references followed to refresh the metadata of an entry, see refresh_entry
+    MAX_METADATA_REDIRECTS: ClassVar[int] = 5
+    # seconds for which an explicit compare reuses the infos in the extraction cache, see compare
+    COMPARE_MAX_AGE: ClassVar[float] = 10 * 60
+
     @classproperty
     def DEFAULT_OPTIONS(self) -> dict[str, Any]:
         return {'outtmpl': {
@@ -83,17 +131,47 @@ class MusicSyncDownloader(yt_dlp.YoutubeDL):
                 'noprogress': True
                 }
 
-    def __init__(self, collection: 'lib.Collection'):
+    def __init__(self, collection: 'lib.Collection', extraction_cache: ExtractionCache | None = None,
+                 extraction_workers: threading.local | None = None):
+        """
+        :param extraction_workers: Thread-local storage of the downloaders that extract the infos of collection urls,
+            shared by several downloaders so that every thread only needs one clone for all of them (see
+            ``extraction_worker``). By default, every thread uses the clone of this downloader.
+        """
         super(MusicSyncDownloader, self).__init__(params=self.DEFAULT_OPTIONS)
 
         self.collection: lib.Collection = collection
         self.partial_ie_results: dict = {}
+        self.extraction_cache: ExtractionCache = extraction_cache if extraction_cache is not None else ExtractionCache()
+        # files of the collection folder, taken at the start of compare and kept up to date during sync
+        self.folder_snapshot: FolderSnapshot | None = None
         self.logger = Logger()
+        # shared by the downloads of all collections of the library, see MusicSyncLibrary.bandwidth_limiter
+        self.bandwidth_limiter: BandwidthLimiter = BandwidthLimiter()
 
         self.current_url: lib.CollectionUrl | None = None
+        # priority of the current download (see download_priority) and its number of bytes downloaded so far
+        self.current_priority: tuple = ()
+        self._downloaded_bytes = 0
+        # files of the library that can be linked instead of downloaded again, see index_library_files
+        self.library_files: dict[str, list[tuple[str, str]]] = {}
+        # files that are going to be linked, so that no two entries are linked to the same file, see link_destination
+        self.link_destinations: set[str] = set()
+        # audio codec the downloaded files are converted to in the transcoding stage, None if they are kept as they are
+        self.audio_codec: str | None = None
+        # cache of the original downloads, None if the collection doesn't cache them
+        self.source_cache: SourceMediaCache | None = None
+        # journal of the running sync, see begin_journal
+        self.journal: SyncJournal | None = None
+        self.sync_id: str | None = None
+
+        # every worker thread gets its own clone of this downloader
+        self._workers = threading.local()
+        self.extraction_workers = extraction_workers
 
         self.add_post_processor(MusicSyncPreProcessor(downloader=self), when='playlist')
         self.add_post_processor(MusicSyncPostProcessor(downloader=self), when='post_process')
+        self.add_progress_hook(self.limit_bandwidth)
 
     def pull_params_from_collection(self):
         params = self.params
@@ -108,36 +186,242 @@ class MusicSyncDownloader(yt_dlp.YoutubeDL):
         if collection.filename_format:
             params['outtmpl']['default'] = collection.filename_format
 
+        # audio is extracted in a separate transcoding stage (see transcode) instead of by a postprocessor, so that the
+        # download threads don't have to wait for ffmpeg
         if collection.file_extension == '' or collection.file_extension in MEDIA_EXTENSIONS.audio:
-            if 'postprocessors' not in params or params['postprocessors'] is None:
-                params['postprocessors'] = []
-            params['postprocessors'].append({
-                'key': 'FFmpegExtractAudio',
-                'nopostoverwrites': False,
-                'preferredcodec': collection.file_extension or 'best',
-                'preferredquality': '5'
-            })
-
+            self.audio_codec = collection.file_extension or 'best'
             params['format'] = 'ba/b'
+        else:
+            self.audio_codec = None
+
+        if collection.cache_source_media and self.source_cache is None:
+            self.source_cache = SourceMediaCache()
+        elif not collection.cache_source_media:
+            self.source_cache = None
+
+        if collection.library is not None:
+            self.bandwidth_limiter = collection.library.bandwidth_limiter()
 
         if collection.yt_dlp_options:
             # print(cli_to_api(collection.yt_dlp_options.split()))
             params.update(cli_to_api(collection.yt_dlp_options.split()))
 
+    def clone(self) -> 'MusicSyncDownloader':
+        """
+        Creates a new downloader for the same collection with the same parameters. yt-dlp's ``YoutubeDL`` is not
+        thread-safe, so every thread has to use its own instance.
+        """
+        clone = MusicSyncDownloader(self.collection, extraction_cache=self.extraction_cache)
+        clone.pull_params_from_collection()
+        clone.params['logger'].interruption_callback = self.params['logger'].interruption_callback
+        clone.params['logger'].interrupted = self.params['logger'].interrupted
+        return clone
+
+    def worker(self) -> 'MusicSyncDownloader':
+        """
+        :return: The clone of this downloader belonging to the current thread
+        """
+        worker = getattr(self._workers, 'downloader', None)
+        if worker is None:
+            worker = self._workers.downloader = self.clone()
+        return worker
+
+    def extraction_worker(self) -> 'MusicSyncDownloader':
+        """
+        :return: The downloader of the current thread used to extract infos. If this downloader has shared
+            ``extraction_workers``, it is shared with all other downloaders whose collections have the same yt-dlp
+            options, as only those change the extracted info.
+        """
+        if self.extraction_workers is None:
+            return self.worker()
+
+        workers = getattr(self.extraction_workers, 'downloaders', None)
+        if workers is None:
+            workers = self.extraction_workers.downloaders = {}
+
+        key = self.collection.yt_dlp_options.strip()
+        worker = workers.get(key)
+        if worker is None:
+            worker = workers[key] = self.clone()
+        return worker
+
+    def extractor_key(self, url: str) -> str:
+        """
+        :return: The key of the extractor yt-dlp would use for the given URL
+        """
+        for ie_key, ie in self._ies.items():
+            if ie.suitable(url):
+                return ie_key
+        return 'Generic'
+
+    def source_key(self, url: str) -> tuple[str, str] | None:
+        """
+        :return: The (extractor key, video id) the video at the URL is stored under in the source media cache (see
+            ``SourceMediaCache.key``), or None if the id can't be derived from the URL without extracting it
+        """
+        for ie_key, ie in self._ies.items():
+            if ie.suitable(url):
+                video_id = ie.get_temp_id(url)
+                return (ie_key, str(video_id)) if video_id else None
+        return None
+
+    def extract_flat_info(self, collection_url: 'lib.CollectionUrl', refresh: bool = False,
+                          max_age: float | None = None) -> dict:
+        """
+        Downloads the info of the given collection url (without processing) using the downloader of the current thread.
+        The entries of playlists are fetched completely. Fresh results from the extraction cache are reused.
+
+        :param refresh: If true, the extraction cache is bypassed
+        :param max_age: Maximum age of reused results in seconds, defaults to the TTL of the extraction cache
+        """
+        self.params['logger'].check_interruption_callback()
+
+        extractor = self.extractor_key(collection_url.url)
+        info = None if refresh else self.extraction_cache.get(collection_url.url, extractor, max_age=max_age)
+        if info is not None:
+            self.logger.debug(f'Using cached info for URL {collection_url.url}')
+            return info
 
-    def compare(self, delete_files: bool = False,
+        info = self.extraction_worker().extract_info(collection_url.url, process=False)
+        if info.get('_type') == 'playlist':
+            info['entries'] = list(info['entries'])
+
+        self.extraction_cache.put(collection_url.url, extractor, info)
+        return info
+
+    def iter_flat_infos(self, collection_urls: list['lib.CollectionUrl'],
+                        progress_callback: Callable[[float, str], None] | None = None,
+                        refresh: set['lib.CollectionUrl'] = frozenset(),
+                        max_age: float | None = None) -> Iterator[tuple[int, 'lib.CollectionUrl', dict]]:
+        """
+        Downloads the info of all given collection urls concurrently, using at most
+        ``Collection.max_concurrent_extractions`` threads.
+
+        :param refresh: Collection urls whose info is extracted again even if the extraction cache has a fresh entry
+        :param max_age: See ``extract_flat_info``
+        :return: Iterator over tuples of (index in ``collection_urls``, collection url, info) in order of completion
+        """
+        if not collection_urls:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max(1, self.collection.max_concurrent_extractions),
+                                      thread_name_prefix='extract')
+        try:
+            futures = {executor.submit(self.extract_flat_info, collection_url, collection_url in refresh, max_age): i
+                       for i, collection_url in enumerate(collection_urls)}
+
+            for done, future in enumerate(self.params['logger'].as_completed(futures), start=1):
+                i = futures[future]
+                collection_url = collection_urls[i]
+                info = future.result()
+
+                if progress_callback is not None:
+                    if collection_url.name:
+                        progress_text = f'"{collection_url.name}" ({collection_url.url})'
+                    else:
+                        progress_text = f'{collection_url.url}'
+                    progress_callback(done / len(collection_urls),
+                                      f'Downloaded info for {progress_text} [{done}/{len(collection_urls)}]')
+
+                yield i, collection_url, info
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def record_file(self, collection_url: 'lib.CollectionUrl', filename: str):
+        """
+        Adds a file that has been downloaded to the folder snapshot.
+        """
+        path = os.path.join(self.collection.get_real_path(collection_url), filename)
+        if self.folder_snapshot is not None and os.path.isfile(path):
+            self.folder_snapshot.add(path)
+
+    def compare(self, delete_files: bool = False, force_refresh: bool = False,
                 progress_callback: Callable[[float, str], None] | None = None,
-                interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame:
+                interruption_callback: Callable[[], bool] | None = None,
+                chunk_callback: Callable[[pd.DataFrame], None] | None = None) -> pd.DataFrame:
         """
         Changes the linked collection in-place. It
 
         - Adds, removes and reorders collection urls if bookmark sync is enabled and the bookmark folder has changed. Files are only deleted if delete_files is true
-        - Downloads info of all collection urls (without processing)
+        - Downloads info of all collection urls (without processing). Infos from the extraction cache are only reused
+          if they are younger than ``COMPARE_MAX_AGE``, so that an explicit compare shows the current state of the urls
 
         :param delete_files: If true, automatically deletes files belonging to URLs which have been removed from a bookmark-synced folder. If false, only deletes the CollectionUrl object from the collection
+        :param force_refresh: If true, the infos of all collection urls are downloaded again, even if they are cached
+        :param chunk_callback: Called with the status dataframe of every collection url as soon as it is available, so that the results can be displayed before all urls have been compared
 
         :return: Dataframe containing the updated data (video name, playlist index, sync status, ...) of all tracks in all collection urls
         """
+        self.prepare_compare(delete_files=delete_files, interruption_callback=interruption_callback)
+
+        collection_urls = self.urls_to_compare()
+        return self.compare_urls(collection_urls, progress_callback=progress_callback,
+                                 refresh=set(collection_urls) if force_refresh else frozenset(),
+                                 max_age=self.COMPARE_MAX_AGE, chunk_callback=chunk_callback)
+
+    def compare_incremental(self, previous_result: pd.DataFrame | None, selected_urls: list['lib.CollectionUrl'] | None = None,
+                            max_age: float | None = None, delete_files: bool = False,
+                            progress_callback: Callable[[float, str], None] | None = None,
+                            interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame:
+        """
+        Like ``compare``, but only downloads the info of collection urls which
+
+        - are new, i.e. have never been compared or are not part of ``previous_result``,
+        - are selected in ``selected_urls``, or
+        - whose info in the extraction cache is older than ``max_age`` seconds (or missing).
+
+        The status rows of these urls replace their rows in ``previous_result``. Rows of all other urls are kept, except
+        for urls which have been removed from the collection or excluded.
+
+        :param max_age: Defaults to the TTL of the extraction cache
+        :return: The merged dataframe, ordered like the urls of the collection
+        """
+        self.prepare_compare(delete_files=delete_files, interruption_callback=interruption_callback)
+
+        if max_age is None:
+            max_age = self.extraction_cache.ttl
+        if previous_result is None:
+            previous_result = pd.DataFrame(columns=lib.CollectionUrl.TRACK_COLUMNS)
+
+        collection = self.collection
+        logger = self.logger
+        selected_urls = set(selected_urls or [])
+        previous_urls = set(previous_result['collection_url'])
+        positions = {collection_url: i for i, collection_url in enumerate(collection.urls) if not collection_url.excluded}
+
+        collection_urls = []
+        refresh = set()
+        for collection_url in positions:
+            if collection_url in selected_urls:
+                logger.debug(f'{collection_url.url} is selected.')
+                refresh.add(collection_url)
+            elif collection_url.is_playlist is None or collection_url not in previous_urls:
+                logger.debug(f'{collection_url.url} is new.')
+            else:
+                age = self.extraction_cache.age(collection_url.url, self.extractor_key(collection_url.url))
+                if age is not None and age <= max_age:
+                    continue
+                logger.debug(f'{collection_url.url} is outdated.')
+                refresh.add(collection_url)
+
+            collection_urls.append(collection_url)
+
+        status_df = self.compare_urls(collection_urls, progress_callback=progress_callback, refresh=refresh)
+
+        compared_urls = set(collection_urls)
+        kept = previous_result[previous_result['collection_url'].apply(
+            lambda x: x in positions and x not in compared_urls)]
+
+        merged = pd.concat([df for df in (kept, status_df) if not df.empty], ignore_index=True)
+        if merged.empty:
+            return merged
+        return merged.sort_values('collection_url', kind='mergesort',
+                                  key=lambda col: col.apply(lambda x: positions[x])).reset_index(drop=True)
+
+    def prepare_compare(self, delete_files: bool = False, interruption_callback: Callable[[], bool] | None = None):
+        """
+        Performs bookmark sync (see ``compare``) and takes the folder snapshot.
+        """
         self.pull_params_from_collection()
 
         collection = self.collection
@@ -172,141 +456,945 @@ class MusicSyncDownloader(yt_dlp.YoutubeDL):
                         if os.path.isdir(folder):
                             os.remove(folder)
 
-        # download track info of all collection urls
-        self.params['logger'].interruption_callback = interruption_callback
-        logger.prefix = 'compare'
-
-        df = pd.DataFrame()
-        for i, collection_url in enumerate(collection.urls):
-            logger.reset_indent()
+        self.folder_snapshot = FolderSnapshot.scan(collection.folder_path)
 
-            if progress_callback is not None:
-                if collection_url.name:
-                    progress_text = f'"{collection_url.name}" ({collection_url.url})'
-                else:
-                    progress_text = f'{collection_url.url}'
-                progress_callback(i / len(collection.urls),
-                                  f'Downloading info for {progress_text} [{i + 1}/{len(collection.urls)}]')
+        self.params['logger'].reset(interruption_callback)
+        logger.prefix = 'compare'
 
+    def urls_to_compare(self) -> list['lib.CollectionUrl']:
+        """
+        :return: All collection urls of the collection which aren't excluded
+        """
+        collection_urls = []
+        for collection_url in self.collection.urls:
             if collection_url.excluded:
-                logger.debug(f'{collection_url} is excluded. Skipping...')
+                self.logger.debug(f'{collection_url} is excluded. Skipping...')
                 continue
+            collection_urls.append(collection_url)
+        return collection_urls
+
+    def compare_urls(self, collection_urls: list['lib.CollectionUrl'],
+                     progress_callback: Callable[[float, str], None] | None = None,
+                     refresh: set['lib.CollectionUrl'] = frozenset(), max_age: float | None = None,
+                     chunk_callback: Callable[[pd.DataFrame], None] | None = None) -> pd.DataFrame:
+        """
+        Downloads the info of the given collection urls and determines the sync status of all their tracks.
+        ``prepare_compare`` has to be called first.
+
+        :param refresh: Collection urls whose info is extracted again even if the extraction cache has a fresh entry
+        :param max_age: See ``extract_flat_info``
+        :param chunk_callback: Called with the status dataframe of every collection url as soon as it is available
+        :return: The status dataframes of all collection urls, in the order of ``collection_urls``
+        """
+        status_dfs = {}
+        for i, status_df in self.iter_compare_urls(collection_urls, progress_callback=progress_callback, refresh=refresh,
+                                                   max_age=max_age):
+            if chunk_callback is not None:
+                chunk_callback(status_df)
+            status_dfs[i] = status_df
+
+        status_dfs = [status_dfs[i] for i in sorted(status_dfs)]
+        return pd.concat(status_dfs, ignore_index=True) if status_dfs else pd.DataFrame()
+
+    def iter_compare_urls(self, collection_urls: list['lib.CollectionUrl'],
+                          progress_callback: Callable[[float, str], None] | None = None,
+                          refresh: set['lib.CollectionUrl'] = frozenset(),
+                          max_age: float | None = None) -> Iterator[tuple[int, pd.DataFrame]]:
+        """
+        Like ``compare_urls``, but yields the status dataframe of every collection url as soon as its info has been
+        downloaded.
+
+        :return: Iterator over tuples of (index in ``collection_urls``, status dataframe) in order of completion
+        """
+        # download track info of all collection urls
+        if progress_callback is not None:
+            progress_callback(0, f'Downloading info for {len(collection_urls)} URLs')
+
+        for i, collection_url, info in self.iter_flat_infos(collection_urls, progress_callback=progress_callback,
+                                                            refresh=refresh, max_age=max_age):
+            yield i, self.compare_url(collection_url, info)
+
+    def compare_url(self, collection_url: 'lib.CollectionUrl', info: dict) -> pd.DataFrame:
+        """
+        Determines the sync status of all tracks of a collection url from its downloaded info.
+        """
+        logger = self.logger
+        logger.reset_indent()
+
+        self.update_url_info(collection_url, info)
+        if collection_url.is_playlist:
+            entries = info['entries']
+            videos = pd.DataFrame({
+                'url': [e['url'] for e in entries],
+                'title': [e['title'] for e in entries],
+                'playlist_index': list(range(1, len(entries) + 1)),
+            })
+            videos['occurrence_index'] = occurrence_index(videos['url'])
+        else:
+            videos = pd.DataFrame({
+                'url': info['original_url'],
+                'title': info['title'],
+                'playlist_index': None,
+                'occurrence_index': 1,
+            }, index=[0])
+
+
+        logger.debug(f'Processing URL {collection_url.url} ({collection_url.name})')
+        logger.debug(f'Playlist: {"yes" if collection_url.is_playlist else "no"}')
+
+        self.partial_ie_results[collection_url.url] = info
+
+        url_folder = self.collection.get_real_path(collection_url)
+
+        logger.debug(f'Folder: {url_folder}')
+        logger.indent()
+
+        status_df = collection_url.compare_tracks(videos, self.folder_snapshot.files(url_folder))
+
+        for status, count in status_df['status'].value_counts(sort=False).items():
+            logger.debug(f'{status}: {count} tracks')
+
+        return status_df
+
+    def update_url_info(self, collection_url: 'lib.CollectionUrl', info: dict):
+        """
+        Sets the name (if it is empty) and ``is_playlist`` of the collection url from its downloaded info.
+        """
+        if not collection_url.name:
+            collection_url.name = self.evaluate_outtmpl(
+                self.collection.url_name_format or lib.Collection.DEFAULT_URL_NAME_FORMAT,
+                info)
+
+        collection_url.is_playlist = info.get('_type') == 'playlist'
+
+    def compare_and_sync(self, delete_files: bool = False,
+                         progress_callback: Callable[[float, str], None] | None = None,
+                         interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame:
+        """
+        Compares and syncs the collection without user interaction, using the actions from ``Collection.sync_actions``.
+
+        Tracks that are added to the source or not downloaded, and whose action is ``DOWNLOAD``, are downloaded while the
+        rest of their playlist is still being enumerated. All other actions are performed by ``sync`` afterwards. Tracks
+        with an action of ``DECIDE_INDIVIDUALLY`` are skipped.
+
+        :return: A dataframe containing all metadata from all downloaded tracks and the errors of all failed
+            downloads, like ``sync``
+        """
+        self.prepare_compare(delete_files=delete_files, interruption_callback=interruption_callback)
+
+        collection = self.collection
+        logger = self.logger
+        collection_urls = self.urls_to_compare()
+
+        infos: list[dict] = []
+        downloads: dict[Future, tuple[lib.CollectionUrl, str, int, int | None, str]] = {}
+        metadata_sink = collection.metadata_sink()
+        retry_queue = RetryQueue(self.is_retryable_error)
+        attempted: set[tuple[lib.CollectionUrl, str, int]] = set()
+        num_downloads = 0
+
+        def apply_downloads(futures):
+            nonlocal num_downloads
+            for future in futures:
+                collection_url, url, occurrence, playlist_index, title = downloads.pop(future)
+                num_downloads += 1
+                try:
+                    entry = future.result()
+                except (InterruptedError, CancelledError):
+                    raise
+                except Exception as e:
+                    logger.error(f'Could not download {url}: {e}')
+                    metadata_sink.add_error(url, e, attempts=retry_queue.attempts(future), title=title,
+                                            playlist_index=playlist_index)
+                    continue
+
+                self.apply_download(collection_url, url, occurrence, entry, lib.TrackSyncAction.DOWNLOAD, metadata_sink)
+
+                if progress_callback is not None:
+                    progress_callback(len(infos) / len(collection_urls),
+                                      f'Downloaded "{entry["title"]}" [{num_downloads}/{num_downloads + len(downloads)}]')
+
+        # the pipelined downloads aren't known in advance, so their plan is empty
+        self.begin_journal(SyncPlan(collection, []))
+        self.library_files = self.index_library_files()
+        self.link_destinations = set()
+
+        executor = HostLimitedExecutor(max_workers=collection.max_concurrent_downloads,
+                                       max_per_host=self.MAX_DOWNLOADS_PER_HOST, thread_name_prefix='download')
+        transcoder = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='transcode')
+        try:
+            for collection_url in collection_urls:
+                if progress_callback is not None:
+                    progress_callback(len(infos) / len(collection_urls), f'Downloading info for {collection_url.url}')
+
+                for entry, url, occurrence, playlist_index, status, info in self.iter_entries(collection_url):
+                    attempted.add((collection_url, url, occurrence))
+                    future = self.submit_with_retries(retry_queue, executor, transcoder, url, collection_url, info,
+                                                      entry, playlist_index,
+                                                      priority=self.download_priority(entry, status))
+                    downloads[future] = collection_url, url, occurrence, playlist_index, entry.get('title') or ''
+
+                    apply_downloads([future for future in downloads if future.done()])
+
+                infos.append(info)
+
+            apply_downloads(self.params['logger'].as_completed(list(downloads)))
+        except BaseException:
+            apply_downloads(self.shutdown_downloads(executor, transcoder, retry_queue, downloads))
+            raise
+        finally:
+            retry_queue.close()
+            executor.shutdown(cancel_futures=True)
+            transcoder.shutdown(cancel_futures=True)
+            metadata_sink.flush()
+
+        self.end_journal()
+
+        status_df = pd.concat([self.compare_url(collection_url, info) for collection_url, info in zip(collection_urls, infos)],
+                              ignore_index=True) if infos else pd.DataFrame(columns=lib.CollectionUrl.TRACK_COLUMNS)
+        status_df['action'] = status_df['status'].map(collection.sync_actions)
+
+        # failed downloads have already been retried by the retry queue
+        was_attempted = pd.Series([(row.collection_url, row.url, row.occurrence_index) in attempted
+                                   for row in status_df.itertuples()], index=status_df.index, dtype=bool)
+        info_df = status_df[~was_attempted & ~status_df['action'].isin([lib.TrackSyncAction.DO_NOTHING,
+                                                                        lib.TrackSyncAction.DECIDE_INDIVIDUALLY])]
+
+        if not info_df.empty:
+            self.sync(info_df, interruption_callback=interruption_callback, metadata_sink=metadata_sink)
+
+        metadata_sink.close()
+        return metadata_sink.to_df()
+
+    def iter_entries(self, collection_url: 'lib.CollectionUrl') -> Iterator[tuple[dict, str, int, int | None, 'lib.TrackSyncStatus', dict]]:
+        """
+        Enumerates the entries of the collection url (lazily, i.e. page by page for paged playlists) and yields every
+        entry that has to be downloaded as soon as it is known, i.e. every entry whose status is ``ADDED_TO_SOURCE`` or
+        ``NOT_DOWNLOADED`` and whose sync action is ``DOWNLOAD``. Afterwards, the entries of the info are listed and the
+        info is stored in the extraction cache.
+
+        :return: Iterator over tuples of (entry, url, occurrence index, playlist index, status, info of the collection
+            url)
+        """
+        collection = self.collection
 
+        extractor = self.extractor_key(collection_url.url)
+        info = self.extraction_cache.get(collection_url.url, extractor)
+        cached = info is not None
+        if not cached:
             info = self.extract_info(collection_url.url, process=False)
-            if not collection_url.name:
-                collection_url.name = self.evaluate_outtmpl(
-                    collection.url_name_format or lib.Collection.DEFAULT_URL_NAME_FORMAT,
-                    info)
-
-            is_playlist = info.get('_type') == 'playlist'
-            collection_url.is_playlist = is_playlist
-            if is_playlist:
-                entries = list(info['entries'])
-                videos = pd.DataFrame({
-                    'url': [e['url'] for e in entries],
-                    'title': [e['title'] for e in entries],
-                    'playlist_index': list(range(1, len(entries) + 1)),
-                    'occurrence_index': 1,
-                })
-
-                # count number of occurrences of every url
-                occurrences = {}
-                for row in videos.itertuples():
-                    occurrences[row.url] = occurrences.get(row.url, 0) + 1
-                    videos.loc[row.Index, 'occurrence_index'] = occurrences[row.url]
-
-                info['entries'] = entries
+
+        self.update_url_info(collection_url, info)
+        existing_files = self.folder_snapshot.files(collection.get_real_path(collection_url))
+
+        tracks = collection_url.tracks
+        local_files = {}
+        if not tracks.empty:
+            local_files = dict(zip(zip(tracks['url'], occurrence_index(tracks['url']).tolist()), tracks['filename']))
+
+        entries = info['entries'] if collection_url.is_playlist else [info]
+
+        enumerated = []
+        occurrences: dict[str, int] = {}
+        for playlist_index, entry in enumerate(entries, start=1):
+            enumerated.append(entry)
+            url = entry['url'] if collection_url.is_playlist else entry['original_url']
+            occurrences[url] = occurrence = occurrences.get(url, 0) + 1
+
+            if (url, occurrence) not in local_files:
+                status = lib.TrackSyncStatus.ADDED_TO_SOURCE
+            elif local_files[(url, occurrence)] not in existing_files:
+                status = lib.TrackSyncStatus.NOT_DOWNLOADED
             else:
-                videos = pd.DataFrame({
-                    'url': info['original_url'],
-                    'title': info['title'],
-                    'playlist_index': None,
-                    'occurrence_index': 1,
-                }, index=[0])
+                continue
 
+            if collection.sync_actions[status] == lib.TrackSyncAction.DOWNLOAD:
+                yield dict(entry), url, occurrence, playlist_index if collection_url.is_playlist else None, status, info
 
-            logger.debug(f'Processing URL {collection_url.url} ({collection_url.name})')
-            logger.debug(f'Playlist: {"yes" if collection_url.is_playlist else "no"}')
+        if collection_url.is_playlist:
+            info['entries'] = enumerated
+        if not cached:
+            self.extraction_cache.put(collection_url.url, extractor, info)
 
-            self.partial_ie_results[collection_url.url] = info
+    @staticmethod
+    def shutdown_downloads(executor: HostLimitedExecutor, transcoder: ThreadPoolExecutor, retry_queue: RetryQueue,
+                           futures: Iterable[Future]) -> list[Future]:
+        """
+        Cancels the downloads that haven't started yet or are waiting for a retry and waits until the running downloads
+        and their transcoding have finished.
 
-            url_folder = self.collection.get_real_path(collection_url)
-            url_folder_contents = os.listdir(url_folder) if os.path.isdir(url_folder) else []
+        :return: The futures of ``futures`` that have finished successfully
+        """
+        retry_queue.close()
+        executor.shutdown(cancel_futures=True)
+        transcoder.shutdown()
+        return [future for future in futures if future.done() and not future.cancelled() and future.exception() is None]
+
+    def submit_download(self, executor: HostLimitedExecutor, transcoder: ThreadPoolExecutor, url: str,
+                        collection_url: 'lib.CollectionUrl', info: dict, entry: dict, playlist_index: int | None,
+                        download: bool = True, priority: tuple = ()) -> Future:
+        """
+        Submits the download of an entry (see ``download_entry``) to the download ``executor``. As soon as the file has
+        been downloaded, it is handed over to the ``transcoder``, so that the download thread can continue with the
+        next entry while ffmpeg is running.
 
-            logger.debug(f'Folder: {url_folder}')
-            logger.indent()
+        If another collection of the library has already downloaded the URL with the same output profile, that file is
+        linked into place on the ``transcoder`` instead (see ``link_entry``). Otherwise, if the original download of the
+        entry is in the source media cache, the file is derived from it on the ``transcoder`` (see ``derive_entry``).
+
+        :param priority: See ``download_priority``. Downloads with a lower priority are started first and get the
+            bandwidth first.
+
+        :return: Future resolving to the processed info of the entry once it has been downloaded and transcoded
+        """
+        result = Future()
+
+        def forward(future: Future):
+            if future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result())
+
+        def downloaded(future: Future):
+            if future.cancelled() or future.exception() is not None or not download or self.audio_codec is None:
+                forward(future)
+                return
+
+            try:
+                transcoder.submit(self.transcode, future.result()).add_done_callback(forward)
+            except RuntimeError:
+                # the transcoder has been shut down
+                result.cancel()
+
+        if download:
+            existing_file = self.existing_file(url, collection_url, info, entry, playlist_index)
+            if existing_file is not None:
+                try:
+                    transcoder.submit(self.link_entry, collection_url, entry, playlist_index,
+                                      *existing_file).add_done_callback(forward)
+                except RuntimeError:
+                    # the transcoder has been shut down
+                    result.cancel()
+                return result
+
+            source = self.cached_source(entry)
+            if source is not None:
+                try:
+                    transcoder.submit(self.derive_entry, collection_url, entry, playlist_index,
+                                      source).add_done_callback(forward)
+                except RuntimeError:
+                    # the transcoder has been shut down
+                    result.cancel()
+                return result
+
+        executor.submit_with_priority(url_domain(url), priority, self.download_entry, collection_url, info, entry,
+                                      playlist_index, download=download, priority=priority).add_done_callback(downloaded)
+        return result
+
+    def submit_with_retries(self, retry_queue: RetryQueue, executor: HostLimitedExecutor,
+                            transcoder: ThreadPoolExecutor, url: str, collection_url: 'lib.CollectionUrl', info: dict,
+                            entry: dict, playlist_index: int | None, download: bool = True,
+                            priority: tuple = ()) -> Future:
+        """
+        Submits the download of an entry like ``submit_download``, but downloads that fail with a retryable error (see
+        ``is_retryable_error``) are submitted again by the ``retry_queue`` after a delay, while the other downloads go
+        on.
 
-            occurrences = {}
-            tracks = {}
-            # build mapping from url, occurrence index -> track namedtuple from the tracks dataframe
-            for track in collection_url.tracks.itertuples():
-                occurrences[track.url] = occurrences.get(track.url, 0) + 1
-                tracks[(track.url, occurrences[track.url])] = track
-
-            status_df = pd.DataFrame()
-            for video in videos.itertuples():
-                matched_track = tracks.get((video.url, video.occurrence_index))
-
-                if matched_track:
-                    matched_track_dict = matched_track._asdict() | video._asdict()  # Update track with new video info (name, playlist index)
-                    matched_track_dict.pop('Index')
-
-                    if matched_track.filename not in url_folder_contents:
-                        # 4. NOT_DOWNLOADED: Track is present in source, was also present in previous sync, but corresponding file does not exist
-                        logger.debug(
-                            f'{video.url} ({video.title}): File {matched_track.filename} does not exist. Marked as {lib.TrackSyncStatus.NOT_DOWNLOADED}')
-
-                        matched_track_dict['status'] = lib.TrackSyncStatus.NOT_DOWNLOADED
-                    elif matched_track.status != lib.TrackSyncStatus.PERMANENTLY_DOWNLOADED:
-                        # 5. DOWNLOADED: Track is present in source and the corresponding file exists
-                        logger.debug(f'{video.url} ({video.title}): {lib.TrackSyncStatus.DOWNLOADED}')
-                        matched_track_dict['status'] = lib.TrackSyncStatus.DOWNLOADED
-                    # (Implicit) 6. PERMANENTLY_DOWNLOADED: File is present in the permanently downloaded files
-
-                    new_track = pd.DataFrame(matched_track_dict, index=[0])
-                    tracks.pop((video.url, video.occurrence_index))
-                else:
-                    # 3. ADDED_TO_SOURCE: Track is present in source, but was not present in previous sync
-                    logger.debug(f'{video.url} ({video.title}): {lib.TrackSyncStatus.ADDED_TO_SOURCE}.')
-
-                    new_track = pd.DataFrame({
-                        'url': video.url,
-                        'status': lib.TrackSyncStatus.ADDED_TO_SOURCE,
-                        'title': video.title,
-                        'filename': '',
-                        'playlist_index': video.playlist_index,
-                        'permanently_downloaded': False,
-                        'metadata_status': lib.MetadataStatus.NEW,
-                        'occurrence_index': video.occurrence_index,
-                        'collection_url': collection_url,
-                    }, index=[0])
-
-                status_df = pd.concat([status_df, new_track], ignore_index=True)
-
-            # Determine status for remaining tracks from the collection url
-            for track in tracks.values():
-                track_dict = track._asdict()
-                track_dict.pop('Index')
-                if track.status == lib.TrackSyncStatus.DOWNLOADED:
-                    # 1. REMOVED_FROM_SOURCE: Track is not present in source, but was present in previous sync
-                    track_dict['status'] = lib.TrackSyncStatus.REMOVED_FROM_SOURCE
-                elif track.status != lib.TrackSyncStatus.PERMANENTLY_DOWNLOADED:
-                    # 2. LOCAL_FILE: File is not in the permanently downloaded files, and does not correspond to a source track
-                    track_dict['status'] = lib.TrackSyncStatus.LOCAL_FILE
-
-                logger.debug(
-                    f'{track.url} ({track.filename}): Not in URL tracks and marked as {track_dict["status"]}')
-
-                new_track = pd.DataFrame(track_dict, index=[0])
-                status_df = pd.concat([status_df, new_track], ignore_index=True)
-
-            df = pd.concat([df, status_df], ignore_index=True)
-
-        return df
+        :return: Future resolving to the processed info of the entry, or to the error of the last attempt
+        """
+        def start() -> Future:
+            # every attempt gets a fresh copy, as yt-dlp modifies the entry
+            return self.submit_download(executor, transcoder, url, collection_url, info, dict(entry), playlist_index,
+                                        download=download, priority=priority)
+
+        return retry_queue.submit(start, description=f'Download of {url}')
+
+    @staticmethod
+    def is_retryable_error(error: BaseException) -> bool:
+        """
+        :return: Whether downloading again might succeed, i.e. the error is neither an interruption nor caused by the
+            video itself (e.g. unavailable, private or geo-blocked videos)
+        """
+        cause = error.exc_info[1] if isinstance(error, DownloadError) and error.exc_info else error
+        if isinstance(error, (InterruptedError, CancelledError)) or isinstance(cause, (InterruptedError, CancelledError)):
+            return False
+        if isinstance(cause, (GeoRestrictedError, UnsupportedError)):
+            return False
+        if isinstance(cause, ExtractorError) and cause.expected:
+            # expected errors are reported by the extractor for the video, except for rate limits
+            return 'HTTP Error 429' in str(cause)
+        return isinstance(error, Exception)
+
+    def index_library_files(self) -> dict[str, list[tuple[str, str]]]:
+        """
+        :return: Mapping from track URL to the (path, title) of every file of a track with that URL in the collections
+            of the library with the same output profile as this collection
+        """
+        library = self.collection.library
+        if library is None:
+            return {}
+
+        files: dict[str, list[tuple[str, str]]] = {}
+        profile = self.collection.output_profile()
+        for collection in library.iter_collections():
+            if collection.output_profile() != profile:
+                continue
 
+            for collection_url in collection.urls:
+                tracks = collection_url.tracks
+                if tracks.empty:
+                    continue
+
+                folder = collection.get_real_path(collection_url)
+                for url, filename, title in zip(tracks['url'], tracks['filename'], tracks['title']):
+                    if isinstance(filename, str) and filename:
+                        files.setdefault(url, []).append((os.path.join(folder, filename), title))
+        return files
+
+    def existing_file(self, url: str, collection_url: 'lib.CollectionUrl', info: dict, entry: dict,
+                      playlist_index: int | None) -> tuple[str, str, str] | None:
+        """
+        :return: The (path, title) of a file in ``library_files`` for the URL that can be linked into the folder of the
+            collection url and the destination it will be linked to (see ``link_destination``), or None if there is no
+            such file
+        """
+        for path, title in self.library_files.get(url, []):
+            if os.path.isfile(path):
+                return path, title, self.link_destination(collection_url, info, entry, playlist_index, path)
+        return None
+
+    def link_destination(self, collection_url: 'lib.CollectionUrl', info: dict, entry: dict,
+                         playlist_index: int | None, path: str) -> str:
+        """
+        The name of the linked file follows the filename format of this collection, like a download of the entry
+        would. If the format can't be applied, the name of the existing file is used. The destination is reserved, so
+        if a file with that name exists or is going to be linked already (e.g. another occurrence of the URL in the
+        same folder), the name gets a number.
+
+        :return: The path in the folder of the collection url that the file at ``path`` is linked to
+        """
+        folder = self.collection.get_real_path(collection_url)
+        ext = os.path.splitext(path)[1][1:]
+        extra_info = self.playlist_extra_info(info, playlist_index) if playlist_index is not None else {}
+        try:
+            filename = os.path.basename(self.worker().prepare_filename({**entry, **extra_info, 'ext': ext}))
+        except Exception:
+            filename = ''
+        if not filename:
+            filename = os.path.basename(path)
+
+        stem, extension = os.path.splitext(filename)
+        destination = os.path.join(folder, filename)
+        number = 1
+        while os.path.exists(destination) or destination in self.link_destinations:
+            number += 1
+            destination = os.path.join(folder, f'{stem} ({number}){extension}')
+
+        self.link_destinations.add(destination)
+        return destination
+
+    def link_entry(self, collection_url: 'lib.CollectionUrl', entry: dict, playlist_index: int | None,
+                   path: str, title: str, destination: str) -> dict:
+        """
+        Links the existing file at ``path`` to ``destination`` in the folder of the collection url (see ``link_file``)
+        instead of downloading the entry.
+
+        :return: The entry, updated as if it had been downloaded to the linked file
+        """
+        self.params['logger'].check_interruption_callback()
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        method = link_file(path, destination)
+        self.logger.info(f'Reusing {path} for {entry.get("title") or title} ({method})')
+
+        if not entry.get('title'):
+            entry['title'] = title
+        entry.update(playlist_index=playlist_index, filepath=destination,
+                     requested_downloads=[{'filename': destination, 'filepath': destination}])
+        return entry
+
+    def cached_source(self, entry: dict) -> str | None:
+        """
+        :return: The path of the original download of the entry in the source media cache, or None if it isn't cached
+            or the collection doesn't use the cache
+        """
+        if self.source_cache is None or self.audio_codec is None:
+            return None
+
+        key = SourceMediaCache.key(entry)
+        return self.source_cache.get(*key) if key is not None else None
+
+    def cache_source(self, entry: dict, path: str, hardlink: bool = True):
+        """
+        Adds the original download of an entry to the source media cache. Errors are only logged, as the cache is
+        optional.
+
+        :param hardlink: See ``SourceMediaCache.put``
+        """
+        key = SourceMediaCache.key(entry)
+        if key is None:
+            return
+
+        try:
+            self.source_cache.put(*key, url=entry.get('original_url') or entry.get('webpage_url') or '', path=path,
+                                  hardlink=hardlink)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f'Could not add {path} to the source media cache: {e}')
+
+    def derive_entry(self, collection_url: 'lib.CollectionUrl', entry: dict, playlist_index: int | None,
+                     source: str) -> dict:
+        """
+        Creates the file of an entry from its original download in the source media cache instead of downloading it.
+
+        :return: The entry, updated as if it had been downloaded and transcoded
+        """
+        self.params['logger'].check_interruption_callback()
+
+        folder = self.collection.get_real_path(collection_url)
+        os.makedirs(folder, exist_ok=True)
+        ext = os.path.splitext(source)[1][1:]
+        filename = self.worker().prepare_filename({**entry, 'ext': ext, 'playlist_index': playlist_index})
+        destination = os.path.join(folder, os.path.basename(filename or f'{entry["id"]}.{ext}'))
+        if os.path.isfile(destination):
+            # like a download, deriving replaces the file. It's removed instead of being overwritten, as it might be
+            # linked into other collections.
+            os.remove(destination)
+        link_file(source, destination)
+        self.logger.info(f'Deriving {destination} from the source media cache')
+
+        entry.update(playlist_index=playlist_index, filepath=destination, ext=ext,
+                     requested_downloads=[{'filename': destination, 'filepath': destination, 'ext': ext}])
+        entry = self.transcode(entry, cache=False)
+
+        if entry['filepath'] == destination:
+            # the file is already in the target format, so it would still be a hardlink of the cached file
+            os.remove(destination)
+            link_file(source, destination, hardlink=False)
+        return entry
+
+    def extract_audio(self, info: dict) -> dict:
+        """
+        Extracts the audio of the file ``info['filepath']`` (with the extension ``info['ext']``) to ``audio_codec``
+        with ffmpeg, like yt-dlp's ``--extract-audio``. The original file is deleted.
+
+        :return: The info with the new ``filepath`` and ``ext``
+        """
+        postprocessor = FFmpegExtractAudioPP(self.worker(), preferredcodec=self.audio_codec, preferredquality='5',
+                                             nopostoverwrites=False)
+        files_to_delete, info = postprocessor.run(info)
+
+        for path in files_to_delete:
+            if path != info['filepath'] and os.path.isfile(path):
+                os.remove(path)
+        return info
+
+    def transcode(self, entry: dict, cache: bool = True) -> dict:
+        """
+        Extracts the audio of the downloaded file of an entry (see ``extract_audio``) and updates the entry with the
+        new file. The calling thread only waits for the ffmpeg process, so that one thread per CPU core keeps all cores
+        busy.
+
+        :param cache: Add the downloaded file to the source media cache (if the collection uses it) before
+        :return: The updated entry
+        """
+        self.params['logger'].check_interruption_callback()
+
+        requested_download = entry['requested_downloads'][0]
+        source = requested_download['filepath']
+        if cache and self.source_cache is not None:
+            self.cache_source(entry, source)
+
+        info = self.extract_audio({**entry, **requested_download})
+        if cache and self.source_cache is not None and info['filepath'] == source:
+            # the file is already in the target format and kept, so the cached file must not be a hardlink of it
+            self.cache_source(entry, source, hardlink=False)
+
+        requested_download.update(filepath=info['filepath'], filename=info['filepath'], ext=info['ext'])
+        entry.update(filepath=info['filepath'], ext=info['ext'])
+        return entry
+
+    def retranscode(self, progress_callback: Callable[[float, str], None] | None = None,
+                    interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame:
+        """
+        Derives the files of all tracks of the collection again from their original downloads in the source media
+        cache, using the current output profile (e.g. after ``Collection.file_extension`` has been changed). Nothing is
+        downloaded; tracks whose original download isn't cached are left as they are.
+
+        :return: Dataframe with the columns ``collection_url``, ``url``, ``occurrence_index``, ``old_filename``,
+            ``filename`` and ``retranscoded`` (False if the original download isn't cached or the file is already in
+            the target format)
+        """
+        self.pull_params_from_collection()
+        if self.audio_codec is None:
+            raise ValueError('Only collections with an audio file extension can be transcoded from the source media cache')
+
+        if self.folder_snapshot is None:
+            self.folder_snapshot = FolderSnapshot.scan(self.collection.folder_path)
+
+        logger = self.logger
+        logger.prefix = 'retranscode'
+        logger.reset_indent()
+        self.params['logger'].reset(interruption_callback)
+
+        source_cache = self.source_cache if self.source_cache is not None else SourceMediaCache()
+        results = []
+        tasks = []
+        for collection_url in self.collection.urls:
+            tracks = collection_url.tracks
+            if tracks.empty:
+                continue
+
+            for url, occurrence, filename in zip(tracks['url'], tracks['occurrence_index'], tracks['filename']):
+                if not isinstance(filename, str) or not filename:
+                    continue
+
+                result = {'collection_url': collection_url, 'url': url, 'occurrence_index': int(occurrence),
+                          'old_filename': filename, 'filename': filename, 'retranscoded': False}
+                results.append(result)
+
+                ext = os.path.splitext(filename)[1][1:]
+                # the cache is keyed by the extracted id, the URL is only stored as it was passed to yt-dlp
+                key = self.source_key(url)
+                source = source_cache.get(*key) if key is not None else None
+                if source is None:
+                    source = source_cache.get_by_url(url)
+                if source is None or ext == self.audio_codec or (self.audio_codec == 'best'
+                                                                 and ext == os.path.splitext(source)[1][1:]):
+                    continue
+                tasks.append((result, source))
+
+        logger.info(f'Transcoding {len(tasks)} of {len(results)} tracks from the source media cache')
+        self.begin_journal(SyncPlan(self.collection, []))
+
+        executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='transcode')
+        futures = {executor.submit(self.rederive_file, result['collection_url'], result['old_filename'], source): result
+                   for result, source in tasks}
+        finished = 0
+
+        def apply(future: Future):
+            nonlocal finished
+            result = futures[future]
+            result.update(filename=future.result(), retranscoded=True)
+            result['collection_url'].update_track(result['url'], result['occurrence_index'], filename=result['filename'])
+            self.record_file(result['collection_url'], result['filename'])
+            self.record_action(result['collection_url'], result['url'], result['occurrence_index'],
+                               lib.TrackSyncAction.DOWNLOAD, filename=result['filename'])
+
+            finished += 1
+            if progress_callback is not None:
+                progress_callback(finished / len(futures), f'Transcoded {result["filename"]} [{finished}/{len(futures)}]')
+
+        try:
+            for future in self.params['logger'].as_completed(futures):
+                apply(future)
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            for future in futures:
+                if future.done() and not future.cancelled() and future.exception() is None \
+                        and not futures[future]['retranscoded']:
+                    apply(future)
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        self.end_journal()
+        return pd.DataFrame(results, columns=['collection_url', 'url', 'occurrence_index', 'old_filename', 'filename',
+                                              'retranscoded'])
+
+    def rederive_file(self, collection_url: 'lib.CollectionUrl', filename: str, source: str) -> str:
+        """
+        Replaces the file of a track with one derived from the original download at ``source``.
+
+        :return: The new filename
+        """
+        self.params['logger'].check_interruption_callback()
+
+        folder = self.collection.get_real_path(collection_url)
+        stem = os.path.splitext(filename)[0]
+        source_ext = os.path.splitext(source)[1]
+        # the intermediate file must not have the name of the current or the new file
+        intermediate = os.path.join(folder, f'{stem}.source{source_ext}')
+        if os.path.isfile(intermediate):
+            # left over from an interrupted run, link_file doesn't overwrite files
+            os.remove(intermediate)
+        link_file(source, intermediate)
+
+        try:
+            info = self.extract_audio({'filepath': intermediate, 'ext': source_ext[1:]})
+        except BaseException:
+            if os.path.isfile(intermediate):
+                os.remove(intermediate)
+            raise
+
+        new_filename = f'{stem}.{info["ext"]}'
+        os.replace(info['filepath'], os.path.join(folder, new_filename))
+        if new_filename != filename and os.path.isfile(os.path.join(folder, filename)):
+            os.remove(os.path.join(folder, filename))
+            self.folder_snapshot.discard(os.path.join(folder, filename))
+        return new_filename
+
+    def download_entry(self, collection_url: 'lib.CollectionUrl', info: dict, entry: dict,
+                       playlist_index: int | None, download: bool = True, priority: tuple = ()) -> dict:
+        """
+        Downloads a single entry of the info of a collection url using the downloader of the current thread.
+
+        :param playlist_index: The playlist index of the entry, or None if the collection url is not a playlist
+        :param download: If false, only the metadata of the entry is downloaded
+        :param priority: Priority of the download for the ``bandwidth_limiter``
+        :return: The processed info of the entry
+        """
+        worker = self.worker()
+        worker.current_url = collection_url
+        worker.current_priority = priority
+
+        if playlist_index is None:
+            return worker.process_ie_result(entry, download=download)
+
+        return worker.process_ie_result(entry, download=download, extra_info=self.playlist_extra_info(info, playlist_index))
+
+    def playlist_extra_info(self, info: dict, playlist_index: int) -> dict:
+        """
+        :return: The playlist fields yt-dlp adds to the entry at ``playlist_index`` of the playlist ``info``
+        """
+        return {**self._playlist_infodict(info), 'playlist_index': playlist_index, 'playlist_autonumber': playlist_index}
+
+    def submit_metadata_refresh(self, retry_queue: RetryQueue, extractor: ThreadPoolExecutor, url: str,
+                                collection_url: 'lib.CollectionUrl', info: dict, entry: dict,
+                                playlist_index: int | None) -> Future:
+        """
+        Submits the metadata refresh of an entry (see ``refresh_entry``) to the ``extractor``, retrying it like
+        ``submit_with_retries``. Refreshes don't take a download slot, so they run alongside the downloads.
+
+        :return: Future resolving to the refreshed info of the entry, or to the error of the last attempt
+        """
+        def start() -> Future:
+            return extractor.submit(self.refresh_entry, collection_url, info, dict(entry), playlist_index)
+
+        return retry_queue.submit(start, description=f'Metadata refresh of {url}')
+
+    def refresh_entry(self, collection_url: 'lib.CollectionUrl', info: dict, entry: dict,
+                      playlist_index: int | None) -> dict:
+        """
+        Extracts the metadata of a single entry again for ``REDOWNLOAD_METADATA``, using the downloader of the current
+        thread. Only the extractor is run (yt-dlp's ``process=False``), so there is no format selection, no
+        postprocessing and nothing is downloaded.
+
+        :param info: The flat info of the collection url. If the collection url is not a playlist, it already is the
+            extracted info of the entry and is used as it is.
+        :param playlist_index: The playlist index of the entry, or None if the collection url is not a playlist
+        :return: The info of the entry, including the playlist fields if the collection url is a playlist
+        """
+        self.params['logger'].check_interruption_callback()
+
+        if playlist_index is None:
+            return dict(info)
+
+        worker = self.worker()
+        worker.current_url = collection_url
+
+        result = entry
+        # flat playlist entries are references to the video, which might be redirects again
+        for _ in range(self.MAX_METADATA_REDIRECTS):
+            if result.get('_type', 'video') not in ('url', 'url_transparent'):
+                break
+
+            reference = result
+            result = worker.extract_info(reference['url'], download=False, process=False, ie_key=reference.get('ie_key'))
+            if reference.get('_type') == 'url_transparent':
+                result = {**result, **{key: value for key, value in reference.items()
+                                       if key not in ('_type', 'url', 'ie_key') and value is not None}}
+
+        if not result.get('title'):
+            result['title'] = entry.get('title')
+        return {**result, **self.playlist_extra_info(info, playlist_index)}
+
+    def download_priority(self, entry: dict, status: 'lib.TrackSyncStatus | None') -> tuple:
+        """
+        :return: The priority of the download of an entry, lower values first. It consists of the criteria of
+            ``MusicSyncLibrary.download_priority`` in their order:
+
+            - ``pinned``: entries of pinned collections first
+            - ``new``: entries that have been added to the source before entries that are downloaded again
+            - ``duration``: short entries first (by ``duration`` of the flat entry)
+            - ``filesize``: small entries first (by ``filesize_approx`` of the flat entry)
+
+            Entries with an unknown duration or file size come last for that criterion.
+        """
+        library = self.collection.library
+        criteria = library.download_priority_criteria() if library is not None else \
+            lib.MusicSyncLibrary.parse_download_priority(lib.MusicSyncLibrary.DEFAULT_DOWNLOAD_PRIORITY)
+
+        duration = entry.get('duration')
+        filesize = entry.get('filesize_approx')
+        values = {'pinned': not self.collection.pinned,
+                  'new': status != lib.TrackSyncStatus.ADDED_TO_SOURCE,
+                  'duration': duration if duration is not None else math.inf,
+                  'filesize': filesize if filesize is not None else math.inf}
+        return tuple(values[criterion] for criterion in criteria)
+
+    def limit_bandwidth(self, progress: dict):
+        """
+        Progress hook which blocks the download until the ``bandwidth_limiter`` allows the bytes downloaded since the
+        last call.
+        """
+        # yt-dlp doesn't log while downloading, so running downloads are stopped here when the sync is interrupted
+        self.params['logger'].check_interruption_callback()
+
+        if progress['status'] != 'downloading':
+            self._downloaded_bytes = 0
+            return
+
+        downloaded_bytes = progress.get('downloaded_bytes') or 0
+        self.bandwidth_limiter.consume(downloaded_bytes - self._downloaded_bytes, self.current_priority,
+                                       interrupted=self.params['logger'].interrupted)
+        self._downloaded_bytes = downloaded_bytes
+
+    def download_tracks(self, plan: SyncPlan, metadata_sink: MetadataSink,
+                        progress_callback: Callable[[float, str], None] | None = None):
+        """
+        Downloads all tracks of the plan with an action of ``DOWNLOAD`` concurrently, using at most
+        ``Collection.max_concurrent_downloads`` threads and at most ``MAX_DOWNLOADS_PER_HOST`` threads per host. The
+        metadata of the tracks with an action of ``REDOWNLOAD_METADATA`` is refreshed at the same time by up to
+        ``Collection.max_concurrent_extractions`` threads (see ``refresh_entry``). The tracks are updated in the calling
+        thread as soon as they have finished, and their metadata is added to the ``metadata_sink``.
+
+        Failed downloads are retried in the background (see ``submit_with_retries``) without holding up the others.
+        Tracks that still fail are left unchanged and added to the ``metadata_sink`` as errors.
+        """
+        logger = self.logger
+        actions = (lib.TrackSyncAction.DOWNLOAD, lib.TrackSyncAction.REDOWNLOAD_METADATA)
+        executor = HostLimitedExecutor(max_workers=self.collection.max_concurrent_downloads,
+                                       max_per_host=self.MAX_DOWNLOADS_PER_HOST, thread_name_prefix='download')
+        transcoder = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='transcode')
+        extractor = ThreadPoolExecutor(max_workers=max(1, self.collection.max_concurrent_extractions),
+                                       thread_name_prefix='refresh')
+        retry_queue = RetryQueue(self.is_retryable_error)
+        futures: dict[Future, PlannedTrack] = {}
+        applied: set[Future] = set()
+        self.library_files = self.index_library_files()
+        self.link_destinations = set()
+
+        def finish(future: Future):
+            track = futures[future]
+            try:
+                entry = future.result()
+            except (InterruptedError, CancelledError):
+                raise
+            except Exception as e:
+                verb = 'download' if track.action == lib.TrackSyncAction.DOWNLOAD else 'refresh the metadata of'
+                logger.error(f'Could not {verb} {track.url}: {e}')
+                metadata_sink.add_error(track.url, e, attempts=retry_queue.attempts(future), title=track.title,
+                                        playlist_index=track.playlist_index)
+                message = f'Could not {verb} "{track.title or track.url}"'
+            else:
+                self.apply_download(track.collection_url, track.url, track.occurrence_index, entry, track.action,
+                                    metadata_sink, filename=track.filename)
+                verb = 'Downloaded' if track.action == lib.TrackSyncAction.DOWNLOAD else 'Refreshed the metadata of'
+                message = f'{verb} "{entry["title"]}"'
+            applied.add(future)
+
+            if progress_callback is not None:
+                progress_callback(len(applied) / len(futures), f'{message} [{len(applied)}/{len(futures)}]')
+
+        try:
+            for collection_url in plan.collection_urls(*actions):
+                tracks = plan.of(collection_url, *actions)
+
+                info = self.partial_ie_results.pop(collection_url.url, None)
+                if info is None:
+                    # e.g. when resuming an interrupted sync, the collection url might not have been compared yet
+                    info = self.extract_flat_info(collection_url)
+                    self.update_url_info(collection_url, info)
+
+                logger.debug(f'Downloading {len(tracks)} tracks of URL {collection_url.url}')
+
+                for track in tracks:
+                    if collection_url.is_playlist:
+                        playlist_index = track.playlist_index
+                        entry = dict(info['entries'][playlist_index - 1])
+                    else:
+                        entry, playlist_index = dict(info), None
+
+                    if track.action == lib.TrackSyncAction.REDOWNLOAD_METADATA:
+                        future = self.submit_metadata_refresh(retry_queue, extractor, track.url, collection_url, info,
+                                                              entry, playlist_index)
+                    else:
+                        future = self.submit_with_retries(retry_queue, executor, transcoder, track.url, collection_url,
+                                                          info, entry, playlist_index,
+                                                          priority=self.download_priority(entry, track.status))
+                    futures[future] = track
+
+            for future in self.params['logger'].as_completed(futures):
+                finish(future)
+        except BaseException:
+            # downloads that have finished in the meantime are applied as well, so that they aren't repeated
+            extractor.shutdown(cancel_futures=True)
+            for future in self.shutdown_downloads(executor, transcoder, retry_queue, futures):
+                if future not in applied:
+                    finish(future)
+            raise
+        finally:
+            retry_queue.close()
+            executor.shutdown(cancel_futures=True)
+            transcoder.shutdown(cancel_futures=True)
+            extractor.shutdown(cancel_futures=True)
+
+        # the downloads finish in any order
+        for collection_url in plan.collection_urls(*actions):
+            if collection_url.is_playlist:
+                collection_url.tracks = collection_url.tracks.sort_values('playlist_index', kind='stable',
+                                                                          ignore_index=True)
+
+    def apply_download(self, collection_url: 'lib.CollectionUrl', url: str, occurrence: int, entry: dict,
+                       action: 'lib.TrackSyncAction', metadata_sink: MetadataSink, filename: str = ''):
+        """
+        Updates the track of a downloaded entry (or an entry whose metadata has been downloaded again) and adds the
+        entry to the ``metadata_sink``. Tracks aren't thread-safe, so this has to be called from the thread that owns
+        the collection.
+
+        :param filename: The current filename of the track, kept for ``REDOWNLOAD_METADATA``
+        """
+        if action == lib.TrackSyncAction.DOWNLOAD:
+            filename = os.path.basename(entry['requested_downloads'][0]['filename'])
+            metadata_status = lib.MetadataStatus.NEW
+        else:
+            metadata_status = lib.MetadataStatus.REDOWNLOADED
+
+        changes = dict(title=entry['title'],
+                       filename=filename,
+                       playlist_index=entry.get('playlist_index') if collection_url.is_playlist else None,
+                       metadata_status=metadata_status)
+        adds_track = not collection_url.has_track(url, occurrence)
+        collection_url.update_track(url, occurrence, **changes)
+        self.record_file(collection_url, filename)
+        self.record_action(collection_url, url, occurrence, action, adds_track=adds_track, **changes)
+        metadata_sink.add(entry)
+
+    def begin_journal(self, plan: SyncPlan):
+        """
+        Writes the plan of a sync to the sync journal of the library (if the library has been saved, see
+        ``Collection.journal``). All performed actions are recorded with ``record_action`` until ``end_journal`` is
+        called.
+        """
+        self.journal = self.collection.journal()
+        self.sync_id = self.journal.begin(self.collection, plan) if self.journal is not None else None
+
+    def record_action(self, collection_url: 'lib.CollectionUrl', url: str, occurrence: int,
+                      action: 'lib.TrackSyncAction', adds_track: bool = False, **changes):
+        if self.sync_id is not None:
+            self.journal.record(self.sync_id, self.collection, collection_url, url, occurrence, action,
+                                adds_track=adds_track, **changes)
+
+    def end_journal(self):
+        if self.sync_id is not None:
+            self.journal.end(self.sync_id)
+        self.sync_id = None
 
     def sync(self, info_df: pd.DataFrame, progress_callback: Callable[[float, str], None] | None = None,
-             interruption_callback: Callable[[], bool] | None = None) -> pd.DataFrame:
+             interruption_callback: Callable[[], bool] | None = None, dry_run: bool = False,
+             metadata_sink: MetadataSink | None = None) -> pd.DataFrame:
         """
         Changes the linked collection in-place, depending on the given ``info_df``.
         :param info_df: Info DataFrame. Has to contain the following columns:
@@ -314,6 +1402,9 @@ class MusicSyncDownloader(yt_dlp.YoutubeDL):
             url: The video URL
             occurrence_index: The video occurrence index in that Collection URL
             action: The selected TrackSyncAction for this video
+        :param dry_run: If true, only the summary of the ``SyncPlan`` is logged and nothing is changed
+        :param metadata_sink: Sink the metadata of the downloaded tracks is added to. Defaults to a new sink of the
+            collection (see ``Collection.metadata_sink``), which is closed at the end.
 
         This function
 
@@ -323,156 +1414,102 @@ class MusicSyncDownloader(yt_dlp.YoutubeDL):
         - Downloads all tracks with an action of ``DOWNLOAD`` and
             - adds playlist information to the ``Track`` object
 
-        :return: A dataframe containing all metadata from all downloaded tracks.
+        Tracks whose download still fails after being retried don't abort the sync; they are left unchanged, so that
+        they are downloaded by the next sync.
+
+        :return: A dataframe containing the retained metadata of all tracks in the metadata sink, followed by a row per
+            track that could not be downloaded, with the error in ``MetadataSink.ERROR_COLUMN`` and the number of
+            attempts in ``MetadataSink.ATTEMPTS_COLUMN``.
         """
         self.pull_params_from_collection()
 
+        if self.folder_snapshot is None:
+            self.folder_snapshot = FolderSnapshot.scan(self.collection.folder_path)
+
         logger = self.logger
         logger.prefix = 'sync'
         logger.reset_indent()
 
-        # 1. KEEP_PERMANENTLY: mark files as permanently downloaded
-        keep_permanently = info_df[info_df['action'] == lib.TrackSyncAction.KEEP_PERMANENTLY]
+        plan = SyncPlan.compile(self.collection, info_df)
 
-        if len(keep_permanently) > 0:
-            logger.debug(f'KEEP_PERMANENTLY: {len(keep_permanently)} tracks.')
-            logger.indent()
-
-            for collection_url in keep_permanently['collection_url'].unique():
-                modified = collection_url.broadcast_update_tracks(keep_permanently, status=lib.TrackSyncStatus.PERMANENTLY_DOWNLOADED)
+        if dry_run:
+            logger.info(plan.summary())
+            return pd.DataFrame()
 
-                for track in modified.itertuples():
-                    logger.debug(f'{track.url} ({track.filename}) marked as {track.status}')
-
-        logger.reset_indent()
+        self.begin_journal(plan)
 
+        # 1. KEEP_PERMANENTLY: mark files as permanently downloaded
         # 2. REMOVE_FROM_PERMANENTLY_DOWNLOADED: unmark as permanently downloaded
-        remove_from_permanently_downloaded = info_df[
-            info_df['action'] == lib.TrackSyncAction.REMOVE_FROM_PERMANENTLY_DOWNLOADED]
+        for action, status in ((lib.TrackSyncAction.KEEP_PERMANENTLY, lib.TrackSyncStatus.PERMANENTLY_DOWNLOADED),
+                               (lib.TrackSyncAction.REMOVE_FROM_PERMANENTLY_DOWNLOADED, lib.TrackSyncStatus.DOWNLOADED)):
+            if plan.count(action) > 0:
+                logger.debug(f'{action.name}: {plan.count(action)} tracks.')
+                logger.indent()
 
-        if len(remove_from_permanently_downloaded) > 0:
-            logger.debug(f'REMOVE_FROM_PERMANENTLY_DOWNLOADED: {len(remove_from_permanently_downloaded)} tracks.')
-            logger.indent()
-
-            for collection_url in remove_from_permanently_downloaded['collection_url'].unique():
-                modified = collection_url.broadcast_update_tracks(remove_from_permanently_downloaded,
-                                                        status=lib.TrackSyncStatus.DOWNLOADED)
+                for collection_url in plan.collection_urls(action):
+                    tracks = [track for track in plan.of(collection_url, action) if track.track_label is not None]
+                    collection_url.update_tracks_at([track.track_label for track in tracks], status=status)
 
-                for track in modified.itertuples():
-                    logger.debug(f'{track.url} ({track.filename}) marked as {track.status}')
+                    for track in tracks:
+                        logger.debug(f'{track.url} ({track.filename}) marked as {status}')
+                        self.record_action(collection_url, track.url, track.occurrence_index, action, status=status)
 
-        logger.reset_indent()
+            logger.reset_indent()
 
         # 3. DELETE: delete files
-        delete = info_df[info_df['action'] == lib.TrackSyncAction.DELETE]
-
-        if len(delete) > 0:
-            logger.info(f'DELETE: {len(delete)} tracks.')
+        if plan.count(lib.TrackSyncAction.DELETE) > 0:
+            logger.info(f'DELETE: {plan.count(lib.TrackSyncAction.DELETE)} tracks.')
             logger.indent()
             self.params['logger'].indent(2)
 
-            for collection_url in delete['collection_url'].unique():
-                for row in collection_url.get_tracks(delete).itertuples():
-                    track = row.track
-                    path = self.collection.get_real_path(collection_url, track)
+            for collection_url in plan.collection_urls(lib.TrackSyncAction.DELETE):
+                tracks = plan.of(collection_url, lib.TrackSyncAction.DELETE)
 
-                    if os.path.isfile(path):
-                        os.remove(path)
-                        logger.info(f'Deleting {track.filename} ({track.url})')
-                    else:
+                for track in tracks:
+                    if track.track_label is None:
+                        logger.info(f'Could not delete {track.url} because it is not a track of {collection_url.url}')
+                    elif not track.path:
                         logger.info(f'Could not delete file {track.filename} ({track.url}) because it does not exist')
+                    else:
+                        # the file is removed directly instead of checking the folder snapshot, which might be outdated
+                        try:
+                            os.remove(track.path)
+                            logger.info(f'Deleting {track.filename} ({track.url})')
+                        except FileNotFoundError:
+                            logger.info(f'Could not delete file {track.filename} ({track.url}) because it does not exist')
+                        self.folder_snapshot.discard(track.path)
+
+                    self.record_action(collection_url, track.url, track.occurrence_index, lib.TrackSyncAction.DELETE)
 
-                collection_url.remove_tracks(delete)
+                collection_url.remove_tracks_at([track.track_label for track in tracks if track.track_label is not None])
 
         logger.reset_indent()
 
         # 4. REDOWNLOAD_METADATA and DOWNLOAD
-        def filter_redownloaded(info_dict, url: lib.CollectionUrl, actions_df: pd.DataFrame, *args, **kwargs) -> str | None:
-            # print(args, kwargs)
-            # print(info_dict)
-            # print(actions_df)
-
-            if 'playlist_index' not in info_dict:
-                return None
-
-            playlist_index = info_dict.get('playlist_index')
-
-            if progress_callback is not None:
-                progress_num = num_downloads + ((playlist_index - 1) if url.is_playlist else 0)
-                progress_callback(progress_num / len(download),
-                                  f'Downloading "{info_dict['title']}" [{progress_num + 1}/{len(download)}]')
+        num_downloads = plan.count(lib.TrackSyncAction.DOWNLOAD, lib.TrackSyncAction.REDOWNLOAD_METADATA)
 
-            playlist_index = playlist_index if playlist_index is not None else ''
+        owns_metadata_sink = metadata_sink is None
+        if owns_metadata_sink:
+            metadata_sink = self.collection.metadata_sink()
 
-            if actions_df[playlist_index] == lib.TrackSyncAction.REDOWNLOAD_METADATA:
-                return "Skipping download since sync action is set to REDOWNLOAD_METADATA"
-
-            return None
-
-        download = info_df[(info_df['action'] == lib.TrackSyncAction.REDOWNLOAD_METADATA) | (
-                    info_df['action'] == lib.TrackSyncAction.DOWNLOAD)]
-
-        info_dicts = []
-        num_downloads = 0
-
-        if len(download) > 0:
-            logger.debug(f'DOWNLOAD or REDOWNLOAD_METADATA: {len(download)} tracks.')
+        if num_downloads > 0:
+            logger.debug(f'DOWNLOAD or REDOWNLOAD_METADATA: {num_downloads} tracks.')
             logger.indent()
             self.params['logger'].indent(2)
-            self.params['logger'].interruption_callback = interruption_callback
-
-            for collection_url in download['collection_url'].unique():
-                self.current_url = collection_url
-
-                tracks = download[download['collection_url'].apply(lambda x: x is collection_url)]
-                actions = pd.Series(tracks['action'], index=pd.Index(tracks['playlist_index'], name='playlist_index'))
-
-                if collection_url.is_playlist:
-                    self.params['playlist_items'] = ','.join([str(i) for i in actions.index.tolist()])
+            self.params['logger'].reset(interruption_callback)
 
-                self.params['match_filter'] = partial(filter_redownloaded, url=collection_url, actions_df=actions)
-
-                if collection_url.url in self.partial_ie_results:
-                    logger.debug(f'Processing IE result for URL {collection_url.url}')
-                    info = self.process_ie_result(self.partial_ie_results[collection_url.url])
-                    self.partial_ie_results.pop(collection_url.url)
-                else:
-                    logger.debug(f'Extracting URL {collection_url.url}')
-                    info = self.extract_info(collection_url.url)
-
-                if collection_url.is_playlist:
-                    occurrences = {}
-                    entries = info.pop('entries')
-                    for entry in entries:
-                        url = entry['original_url']
-                        occurrences[url] = occurrences.get(url, 0) + 1
-                        metadata_status = lib.MetadataStatus.NEW if actions[entry['playlist_index']] == lib.TrackSyncAction.DOWNLOAD else lib.MetadataStatus.REDOWNLOADED
-
-                        collection_url.update_track(url, occurrences[url],
-                                                    title=entry['title'],
-                                                    filename=os.path.basename(entry['requested_downloads'][0]['filename']),
-                                                    playlist_index=entry['playlist_index'],
-                                                    metadata_status=metadata_status)
-
-                        info_dicts.append(entry)
-                    collection_url.tracks.sort_values('playlist_index')
-                else:
-                    metadata_status = lib.MetadataStatus.NEW if tracks.iloc[0]['action'] == lib.TrackSyncAction.DOWNLOAD else lib.MetadataStatus.REDOWNLOADED
-                    collection_url.update_track(info['original_url'],
-                                                title=info['title'],
-                                                filename=os.path.basename(info['requested_downloads'][0]['filename']),
-                                                metadata_status=metadata_status)
-
-                info_dicts.append(info)
-
-                num_downloads += len(tracks)
-
-        metadata_df = pd.DataFrame.from_records(info_dicts)
-        metadata_df.to_csv('test.csv')
+            try:
+                self.download_tracks(plan, metadata_sink, progress_callback=progress_callback)
+            finally:
+                metadata_sink.flush()
 
         # 5. DO_NOTHING and DECIDE_INDIVIDUALLY are ignored
 
-        return metadata_df
+        self.end_journal()
+
+        if owns_metadata_sink:
+            metadata_sink.close()
+        return metadata_sink.to_df()
 
 if __name__ == '__main__':
     library = lib.MusicSyncLibrary.read_xml('../a.xml')
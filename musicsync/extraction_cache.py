@@ -0,0 +1,130 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import ClassVar
+
+from .utils import user_cache_dir
+
+
+class ExtractionCache:
+    """
+    Persistent cache for the results of ``YoutubeDL.extract_info(..., process=False)``, stored in an SQLite database.
+    Entries are identified by URL and extractor key, expire after ``ttl`` seconds and the least recently used entries
+    are evicted as soon as all entries together take up more than ``max_size`` bytes. Every thread keeps its own
+    connection to the database open, so that the many lookups of a compare don't have to reconnect.
+    """
+    DEFAULT_TTL: ClassVar[float] = 24 * 60 * 60
+    DEFAULT_MAX_SIZE: ClassVar[int] = 256 * 1024 * 1024
+
+    def __init__(self, path: str | None = None, ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE):
+        if path is None:
+            path = os.path.join(user_cache_dir(), 'extraction_cache.sqlite')
+
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._connections = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        :return: The connection of the current thread. SQLite connections can't be shared between threads.
+        """
+        connection = getattr(self._connections, 'connection', None)
+        if connection is not None:
+            return connection
+
+        connection = self._connections.connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            connection.execute('CREATE TABLE IF NOT EXISTS ie_results (url TEXT NOT NULL, extractor TEXT NOT NULL, '
+                               'info BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, '
+                               'accessed REAL NOT NULL, PRIMARY KEY (url, extractor))')
+            connection.commit()
+            self._initialized = True
+        return connection
+
+    def get(self, url: str, extractor: str, max_age: float | None = None) -> dict | None:
+        """
+        :param max_age: Only return the entry if it is younger than this many seconds. Defaults to the TTL of the cache
+        :return: The cached info or None if there is no fresh entry
+        """
+        if max_age is None:
+            max_age = self.ttl
+
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT info, created FROM ie_results WHERE url = ? AND extractor = ?',
+                                     (url, extractor)).fetchone()
+            if row is None or time.time() - row[1] > max_age:
+                return None
+
+            connection.execute('UPDATE ie_results SET accessed = ? WHERE url = ? AND extractor = ?',
+                               (time.time(), url, extractor))
+            connection.commit()
+
+        return pickle.loads(row[0])
+
+    def age(self, url: str, extractor: str) -> float | None:
+        """
+        :return: Seconds since the entry has been stored or None if there is no entry
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT created FROM ie_results WHERE url = ? AND extractor = ?',
+                                     (url, extractor)).fetchone()
+
+        return None if row is None else time.time() - row[0]
+
+    def put(self, url: str, extractor: str, info: dict):
+        # private fields may contain functions, which can't be pickled
+        info = {k: v for k, v in info.items() if not k.startswith('__')}
+        try:
+            blob = pickle.dumps(info)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO ie_results VALUES (?, ?, ?, ?, ?, ?)',
+                               (url, extractor, blob, len(blob), now, now))
+            self._evict(connection, now)
+            connection.commit()
+
+    def remove(self, url: str, extractor: str):
+        with self._lock:
+            connection = self._connect()
+            connection.execute('DELETE FROM ie_results WHERE url = ? AND extractor = ?', (url, extractor))
+            connection.commit()
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute('DELETE FROM ie_results')
+            connection.commit()
+
+    def close(self):
+        """
+        Closes the connection of the current thread. The connections of other threads are closed when they end.
+        """
+        connection = getattr(self._connections, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._connections.connection = None
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute('DELETE FROM ie_results WHERE created < ?', (now - self.ttl,))
+
+        size = 0
+        evicted = []
+        for url, extractor, entry_size in connection.execute(
+                'SELECT url, extractor, size FROM ie_results ORDER BY accessed DESC'):
+            size += entry_size
+            if size > self.max_size:
+                evicted.append((url, extractor))
+
+        connection.executemany('DELETE FROM ie_results WHERE url = ? AND extractor = ?', evicted)
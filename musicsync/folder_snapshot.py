@@ -0,0 +1,86 @@
+import os
+from collections import namedtuple
+from dataclasses import dataclass, field
+from typing import KeysView
+
+FileStat = namedtuple('FileStat', ['size', 'mtime'])
+
+
+@dataclass
+class FolderSnapshot:
+    """
+    Snapshot of the files in a collection folder and its direct subfolders (which contain the playlists that are saved
+    to subfolders). Every folder is listed once with ``os.scandir`` and the files are stored in hash maps, so that
+    existence checks don't have to access the file system.
+    """
+    root: str
+    folders: dict[str, dict[str, FileStat]] = field(default_factory=dict)
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        return os.path.normpath(os.path.abspath(path))
+
+    @classmethod
+    def scan(cls, root: str) -> 'FolderSnapshot':
+        snapshot = cls(root=cls.normalize(root))
+
+        for subfolder in snapshot._scan_folder(snapshot.root):
+            snapshot._scan_folder(subfolder)
+
+        return snapshot
+
+    def _scan_folder(self, folder: str) -> list[str]:
+        """
+        Stores the files of the given folder.
+
+        :return: Paths of all subfolders
+        """
+        files = {}
+        subfolders = []
+        if os.path.isdir(folder):
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = FileStat(stat.st_size, stat.st_mtime)
+                    elif entry.is_dir():
+                        subfolders.append(entry.path)
+
+        self.folders[self.normalize(folder)] = files
+        return subfolders
+
+    def _folder(self, folder: str) -> dict[str, FileStat]:
+        folder = self.normalize(folder)
+        if folder not in self.folders:
+            # folders outside the scanned tree are scanned when they are first needed
+            self._scan_folder(folder)
+        return self.folders[folder]
+
+    def files(self, folder: str) -> KeysView[str]:
+        """
+        :return: Names of all files in the given folder
+        """
+        return self._folder(folder).keys()
+
+    def stat(self, path: str) -> FileStat | None:
+        folder, filename = os.path.split(path)
+        return self._folder(folder).get(filename)
+
+    def contains(self, path: str) -> bool:
+        folder, filename = os.path.split(path)
+        return filename in self._folder(folder)
+
+    def add(self, path: str):
+        """
+        Adds a file that has been created after the snapshot was taken.
+        """
+        folder, filename = os.path.split(path)
+        stat = os.stat(path)
+        self._folder(folder)[filename] = FileStat(stat.st_size, stat.st_mtime)
+
+    def discard(self, path: str):
+        """
+        Removes a file that has been deleted after the snapshot was taken.
+        """
+        folder, filename = os.path.split(path)
+        self._folder(folder).pop(filename, None)
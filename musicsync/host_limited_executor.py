@@ -0,0 +1,130 @@
+import heapq
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait as wait_futures
+from typing import Any, Callable
+
+
+class HostLimitedExecutor:
+    """
+    Thread pool which runs at most ``max_per_host`` tasks for the same host at once. Tasks for a host that has reached
+    its limit wait in a queue until one of the running tasks for that host has finished, so they don't block a worker
+    thread in the meantime.
+
+    Whenever a worker thread is free, the queued task with the lowest priority value (see ``submit_with_priority``) whose
+    host is below its limit is started. Tasks with the same priority are started in order of submission.
+    """
+
+    def __init__(self, max_workers: int, max_per_host: int, thread_name_prefix: str = ''):
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._running: Counter[str] = Counter()
+        # heap of (priority, submission number, future, fn, args, kwargs) per host
+        self._pending: dict[str, list[tuple[Any, int, Future, Callable, tuple, dict]]] = {}
+        self._counter = itertools.count()
+        self._shutdown = False
+
+    def submit(self, host: str, fn: Callable, /, *args, **kwargs) -> Future:
+        """
+        Schedules ``fn(*args, **kwargs)`` to be run as soon as a worker thread is free and less than ``max_per_host``
+        tasks for the given host are running.
+        """
+        return self.submit_with_priority(host, 0, fn, *args, **kwargs)
+
+    def submit_with_priority(self, host: str, priority: Any, fn: Callable, /, *args, **kwargs) -> Future:
+        """
+        Like ``submit``, but tasks with a lower ``priority`` value are started first. All priorities have to be
+        comparable with each other.
+        """
+        future = Future()
+
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+
+            heapq.heappush(self._pending.setdefault(host, []), (priority, next(self._counter), future, fn, args, kwargs))
+            tasks = self._next_tasks()
+
+        for task in tasks:
+            self._start(*task)
+        return future
+
+    def _next_tasks(self) -> list[tuple[str, Future, Callable, tuple, dict]]:
+        """
+        Takes the tasks to start next from the queues. Has to be called with the lock held.
+        """
+        tasks = []
+        while sum(self._running.values()) < self.max_workers:
+            hosts = [host for host, pending in self._pending.items() if self._running[host] < self.max_per_host]
+            if not hosts:
+                break
+
+            host = min(hosts, key=lambda h: self._pending[h][0][:2])
+            _, _, future, fn, args, kwargs = heapq.heappop(self._pending[host])
+            if not self._pending[host]:
+                del self._pending[host]
+
+            self._running[host] += 1
+            tasks.append((host, future, fn, args, kwargs))
+        return tasks
+
+    def _start(self, host: str, future: Future, fn: Callable, args: tuple, kwargs: dict):
+        if not future.set_running_or_notify_cancel():
+            self._finished(host)
+            return
+
+        def run():
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                self._finished(host)
+                future.set_exception(e)
+            else:
+                self._finished(host)
+                future.set_result(result)
+
+        def cancelled(inner: Future):
+            # the thread pool has been shut down before the task could start
+            if inner.cancelled():
+                self._finished(host)
+                future.set_exception(CancelledError())
+
+        self._executor.submit(run).add_done_callback(cancelled)
+
+    def _finished(self, host: str):
+        with self._lock:
+            self._running[host] -= 1
+
+            if self._shutdown:
+                # the executor is shut down without waiting, so the queued tasks can't be started anymore
+                for pending in self._pending.values():
+                    for _, _, future, *_ in pending:
+                        future.cancel()
+                self._pending.clear()
+                return
+
+            tasks = self._next_tasks()
+
+        for task in tasks:
+            self._start(*task)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        with self._lock:
+            if cancel_futures:
+                for pending in self._pending.values():
+                    for _, _, future, *_ in pending:
+                        future.cancel()
+                self._pending.clear()
+            queued = [future for pending in self._pending.values() for _, _, future, *_ in pending]
+
+        if wait:
+            wait_futures(queued)
+
+        with self._lock:
+            self._shutdown = True
+
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
@@ -0,0 +1,375 @@
+import json
+import sqlite3
+from collections import Counter
+from contextlib import closing
+from dataclasses import fields
+from typing import Any, ClassVar, Union
+
+import pandas as pd
+
+import musicsync.music_sync_library as lib
+from musicsync.scripting.script_types import Script, ScriptType
+from .sync_plan import SyncPlan
+from .utils import Logger, occurrence_index
+
+
+class LibraryStore:
+    """
+    Library file backed by an SQLite database, as an alternative to the XML file and the CSV file of the metadata table
+    (see ``MusicSyncLibrary.write_xml``), which have to be rewritten completely on every save.
+
+    The library is stored in the tables ``folders``, ``collections``, ``collection_urls``, ``tracks``, ``scripts`` and
+    ``metadata``, and its settings in ``library``. ``write`` compares the rows of the library with the rows in the
+    database and only upserts the rows that have changed and deletes the rows that have been removed, all in one
+    transaction.
+
+    Like in the ``SyncJournal``, collections are identified by their name and its occurrence index in the library,
+    collection urls by their URL and its occurrence index in the collection, and tracks by their URL and occurrence
+    index. Folders only make up the tree, so they are identified by their position in it.
+
+    With ``changed_only``, ``write`` only compares the urls and tracks of the collections that have changed since the
+    library was last read from or written to the database (see ``Revisioned``), and the metadata table only if it has
+    changed.
+    """
+    SCHEMA: ClassVar[tuple[str, ...]] = (
+        'CREATE TABLE IF NOT EXISTS library (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, parent TEXT NOT NULL, position INTEGER NOT NULL, '
+        'name TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS collections (id INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+        'occurrence INTEGER NOT NULL, parent TEXT NOT NULL, position INTEGER NOT NULL, settings TEXT NOT NULL, '
+        'UNIQUE (name, occurrence))',
+        'CREATE TABLE IF NOT EXISTS collection_urls (id INTEGER PRIMARY KEY, '
+        'collection_id INTEGER NOT NULL REFERENCES collections (id) ON DELETE CASCADE, url TEXT NOT NULL, '
+        'occurrence INTEGER NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL, excluded INTEGER NOT NULL, '
+        'concat INTEGER NOT NULL, save_to_subfolder INTEGER NOT NULL, is_playlist INTEGER, '
+        'UNIQUE (collection_id, url, occurrence))',
+        'CREATE TABLE IF NOT EXISTS tracks ('
+        'collection_url_id INTEGER NOT NULL REFERENCES collection_urls (id) ON DELETE CASCADE, url TEXT NOT NULL, '
+        'occurrence_index INTEGER NOT NULL, position INTEGER NOT NULL, status TEXT NOT NULL, title TEXT NOT NULL, '
+        'filename TEXT NOT NULL, playlist_index INTEGER, permanently_downloaded INTEGER NOT NULL, '
+        'metadata_status TEXT NOT NULL, extra TEXT NOT NULL DEFAULT \'{}\', '
+        'PRIMARY KEY (collection_url_id, url, occurrence_index))',
+        'CREATE TABLE IF NOT EXISTS scripts (name TEXT PRIMARY KEY, type TEXT NOT NULL, attributes TEXT NOT NULL, '
+        'script TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS metadata (label TEXT PRIMARY KEY, position INTEGER NOT NULL, row TEXT NOT NULL)',
+    )
+    # fields of a collection that aren't stored in its settings
+    UNSTORED_COLLECTION_FIELDS: ClassVar[tuple[str, ...]] = ('name', 'urls', 'downloader', 'library')
+    # extra holds the values of all other track columns as JSON
+    TRACK_FIELDS: ClassVar[tuple[str, ...]] = ('status', 'title', 'filename', 'playlist_index',
+                                               'permanently_downloaded', 'metadata_status', 'extra')
+    URL_FIELDS: ClassVar[tuple[str, ...]] = ('name', 'excluded', 'concat', 'save_to_subfolder', 'is_playlist')
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def path_for_library(library_path: str) -> str:
+        if library_path.endswith('.xml') or library_path.endswith('.pkl'):
+            library_path = library_path[:-4]
+        return library_path if library_path.endswith('.sqlite') else library_path + '.sqlite'
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA foreign_keys = ON')
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            # databases written by older versions don't have the extra column yet
+            if 'extra' not in [column[1] for column in connection.execute('PRAGMA table_info(tracks)')]:
+                connection.execute("ALTER TABLE tracks ADD COLUMN extra TEXT NOT NULL DEFAULT '{}'")
+        return connection
+
+    # -------
+    # Writing
+    # -------
+    def write(self, library: 'lib.MusicSyncLibrary', changed_only: bool = False) -> dict[str, tuple[int, int]]:
+        """
+        Writes the changes of the library to the database in one transaction.
+
+        :param changed_only: Whether the library has last been read from or written to this database, so that the
+                             collections which haven't changed since then can be skipped
+        :return: The number of (upserted, deleted) rows per table
+        """
+        folder_rows: dict[tuple, tuple] = {}
+        collection_rows: dict[tuple, tuple] = {}
+        collections: dict[tuple[str, int], lib.Collection] = {}
+        self._tree_rows(library.children, '', folder_rows, collection_rows, collections, Counter())
+
+        with closing(self._connect()) as connection, connection:
+            counts = {
+                'library': self._sync_rows(connection, 'library', ('key',), ('value',),
+                                           {('max_download_rate',): (str(library.max_download_rate),),
+                                            ('download_priority',): (library.download_priority,),
+                                            ('metadata_retention_days',): (str(library.metadata_retention_days),)}),
+                'folders': self._sync_rows(connection, 'folders', ('path',), ('parent', 'position', 'name'),
+                                           folder_rows),
+                'collections': self._sync_rows(connection, 'collections', ('name', 'occurrence'),
+                                               ('parent', 'position', 'settings'), collection_rows),
+                'scripts': self._sync_rows(connection, 'scripts', ('name',), ('type', 'attributes', 'script'),
+                                           {(script.name,): self.script_row(script) for script in library.scripts}),
+            }
+            counts['metadata'] = self._sync_rows(connection, 'metadata', ('label',), ('position', 'row'),
+                                                 self.metadata_rows(library.metadata_table)) \
+                if not changed_only or library.metadata_table_has_changed() else (0, 0)
+
+            collection_ids = {(name, occurrence): collection_id for collection_id, name, occurrence
+                              in connection.execute('SELECT id, name, occurrence FROM collections')}
+            # a collection can only be skipped if its rows are still stored under the same key
+            written = {key: collection for key, collection in collections.items()
+                       if not changed_only or collection.has_changed() or collection._store_key != (self.path, key)}
+            scope = self._scope('collection_id', [collection_ids[key] for key in written]) \
+                if len(written) < len(collections) else ('', ())
+
+            url_rows: dict[tuple, tuple] = {}
+            collection_urls: dict[tuple[int, str, int], lib.CollectionUrl] = {}
+            for key, collection in written.items():
+                collection._store_key = (self.path, key)
+                collection_id = collection_ids[key]
+                occurrences = occurrence_index(collection_url.url for collection_url in collection.urls).tolist()
+                for position, (collection_url, occurrence) in enumerate(zip(collection.urls, occurrences)):
+                    url_key = (collection_id, collection_url.url, occurrence)
+                    url_rows[url_key] = (position, *self.url_values(collection_url))
+                    collection_urls[url_key] = collection_url
+
+            counts['collection_urls'] = self._sync_rows(connection, 'collection_urls',
+                                                        ('collection_id', 'url', 'occurrence'),
+                                                        ('position', *self.URL_FIELDS), url_rows, scope)
+
+            url_ids = {(collection_id, url, occurrence): url_id for url_id, collection_id, url, occurrence
+                       in connection.execute('SELECT id, collection_id, url, occurrence FROM collection_urls')}
+            track_rows: dict[tuple, tuple] = {}
+            for key, collection_url in collection_urls.items():
+                track_rows.update(self.track_rows(url_ids[key], collection_url.tracks))
+
+            if scope[0]:
+                scope = (f'WHERE collection_url_id IN (SELECT id FROM collection_urls {scope[0]})', scope[1])
+            counts['tracks'] = self._sync_rows(connection, 'tracks', ('collection_url_id', 'url', 'occurrence_index'),
+                                               ('position', *self.TRACK_FIELDS), track_rows, scope)
+
+        return counts
+
+    @staticmethod
+    def _scope(column: str, values: list) -> tuple[str, tuple]:
+        """
+        :return: A WHERE clause restricting ``column`` to the values, and its parameters
+        """
+        return f'WHERE {column} IN ({", ".join("?" * len(values))})', tuple(values)
+
+    @staticmethod
+    def _sync_rows(connection: sqlite3.Connection, table: str, key_columns: tuple[str, ...],
+                   value_columns: tuple[str, ...], rows: dict[tuple, tuple],
+                   scope: tuple[str, tuple] = ('', ())) -> tuple[int, int]:
+        """
+        Upserts the rows (mapping from key to values) that differ from the rows in the table and deletes the rows of
+        the table that aren't in ``rows``.
+
+        :param scope: WHERE clause and its parameters, which restricts the rows of the table that are compared
+        :return: The number of upserted and deleted rows
+        """
+        columns = key_columns + value_columns
+        where, parameters = scope
+        existing = {row[:len(key_columns)]: row[len(key_columns):]
+                    for row in connection.execute(f'SELECT {", ".join(columns)} FROM {table} {where}', parameters)}
+
+        changed = [key + values for key, values in rows.items() if existing.get(key) != values]
+        removed = [key for key in existing if key not in rows]
+
+        if changed:
+            updates = ', '.join(f'{column} = excluded.{column}' for column in value_columns)
+            connection.executemany(f'INSERT INTO {table} ({", ".join(columns)}) '
+                                   f'VALUES ({", ".join("?" * len(columns))}) '
+                                   f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET {updates}', changed)
+        if removed:
+            condition = ' AND '.join(f'{column} = ?' for column in key_columns)
+            connection.executemany(f'DELETE FROM {table} WHERE {condition}', removed)
+
+        return len(changed), len(removed)
+
+    def _tree_rows(self, children: list[Union['lib.Folder', 'lib.Collection']], parent: str,
+                   folder_rows: dict[tuple, tuple], collection_rows: dict[tuple, tuple],
+                   collections: dict[tuple[str, int], 'lib.Collection'], name_counts: Counter[str]):
+        """
+        Collects the rows of the folders and collections in ``children``.
+
+        :param name_counts: Number of collections per name so far, to determine the occurrence index of a collection
+        """
+        for position, child in enumerate(children):
+            if isinstance(child, lib.Folder):
+                path = f'{parent}/{position}' if parent else str(position)
+                folder_rows[(path,)] = (parent, position, child.name)
+                self._tree_rows(child.children, path, folder_rows, collection_rows, collections, name_counts)
+            else:
+                name_counts[child.name] += 1
+                occurrence = name_counts[child.name]
+                collection_rows[(child.name, occurrence)] = (parent, position, self.collection_settings(child))
+                collections[(child.name, occurrence)] = child
+
+    def collection_settings(self, collection: 'lib.Collection') -> str:
+        """
+        :return: All fields of the collection except for its name and urls, as JSON
+        """
+        settings: dict[str, Any] = {}
+        for collection_field in fields(lib.Collection):
+            if collection_field.name in self.UNSTORED_COLLECTION_FIELDS:
+                continue
+
+            value = getattr(collection, collection_field.name)
+            if collection_field.name == 'sync_actions':
+                value = {str(status): str(action) for status, action in value.items()}
+            elif collection_field.name in ('sync_bookmark_path', 'script_settings'):
+                value = [list(item) for item in value]
+            settings[collection_field.name] = value
+
+        return json.dumps(settings, sort_keys=True)
+
+    @staticmethod
+    def url_values(collection_url: 'lib.CollectionUrl') -> tuple:
+        is_playlist = None if collection_url.is_playlist is None else int(collection_url.is_playlist)
+        return (collection_url.name, int(collection_url.excluded), int(collection_url.concat),
+                int(collection_url.save_to_subfolder), is_playlist)
+
+    @staticmethod
+    def track_rows(collection_url_id: int, tracks: pd.DataFrame) -> dict[tuple, tuple]:
+        """
+        :return: The rows of the tracks keyed by (collection url id, URL, occurrence index). If the occurrence indices of
+            the tracks aren't unique per URL (e.g. in libraries written by older versions), all tracks are numbered
+            again with ``occurrence_index``, so that no track overwrites another one.
+        """
+        if tracks.empty:
+            return {}
+
+        if tracks['occurrence_index'].isna().any() or tracks.duplicated(['url', 'occurrence_index']).any():
+            Logger(prefix='library store').warning(f'Renumbering the tracks of collection url {collection_url_id} '
+                                                   f'because they have duplicate occurrence indices')
+            tracks = tracks.assign(occurrence_index=occurrence_index(tracks['url']).tolist())
+
+        # columns other than the track columns (e.g. attributes of track elements read from XML), without missing values
+        extra: list[dict[str, Any]] = [{} for _ in range(len(tracks))]
+        for column in tracks.columns:
+            if column not in lib.CollectionUrl.TRACK_COLUMNS:
+                for values, value, is_missing in zip(extra, tracks[column].tolist(), tracks[column].isna().tolist()):
+                    if not is_missing:
+                        values[column] = value
+
+        rows = {}
+        for position, (url, occurrence, status, title, filename, playlist_index, permanently_downloaded,
+                       metadata_status, extra_values) in enumerate(zip(tracks['url'], tracks['occurrence_index'],
+                                                                       tracks['status'], tracks['title'],
+                                                                       tracks['filename'], tracks['playlist_index'],
+                                                                       tracks['permanently_downloaded'],
+                                                                       tracks['metadata_status'], extra)):
+            rows[(collection_url_id, url, int(occurrence))] = (
+                position, str(status), title if isinstance(title, str) else '',
+                filename if isinstance(filename, str) else '', SyncPlan.to_playlist_index(playlist_index),
+                int(bool(permanently_downloaded)), str(metadata_status),
+                json.dumps(extra_values, sort_keys=True, default=str))
+        return rows
+
+    @staticmethod
+    def script_row(script: Script) -> tuple:
+        attributes = script.to_xml().attrib
+        attributes.pop('name')
+        return str(script.script_type), json.dumps(attributes, sort_keys=True), script.script
+
+    @staticmethod
+    def metadata_rows(metadata_table: pd.DataFrame) -> dict[tuple, tuple]:
+        rows = {}
+        for position, (label, row) in enumerate(zip(metadata_table.index.tolist(),
+                                                    metadata_table.to_dict('records'))):
+            rows[(json.dumps(label, default=str),)] = (position, json.dumps(row, default=str))
+        return rows
+
+    # -------
+    # Reading
+    # -------
+    def read(self) -> 'lib.MusicSyncLibrary':
+        """
+        :return: The library stored in the database. Its path is the path of the database.
+        """
+        with closing(self._connect()) as connection:
+            settings = dict(connection.execute('SELECT key, value FROM library'))
+
+            # children of every folder path ('' is the root), with their position
+            children: dict[str, list[tuple[int, lib.Folder | lib.Collection]]] = {}
+            folders: dict[str, lib.Folder] = {}
+            for path, parent, position, name in connection.execute(
+                    'SELECT path, parent, position, name FROM folders ORDER BY length(path)'):
+                folders[path] = lib.Folder(name=name)
+                children.setdefault(parent, []).append((position, folders[path]))
+
+            collections: dict[int, lib.Collection] = {}
+            for collection_id, name, occurrence, parent, position, collection_settings in connection.execute(
+                    'SELECT id, name, occurrence, parent, position, settings FROM collections'):
+                collections[collection_id] = self.collection_from_settings(name, collection_settings)
+                collections[collection_id]._store_key = (self.path, (name, occurrence))
+                children.setdefault(parent, []).append((position, collections[collection_id]))
+
+            collection_urls: dict[int, lib.CollectionUrl] = {}
+            for url_id, collection_id, url, name, excluded, concat, save_to_subfolder, is_playlist in connection.execute(
+                    'SELECT id, collection_id, url, name, excluded, concat, save_to_subfolder, is_playlist '
+                    'FROM collection_urls ORDER BY collection_id, position'):
+                collection_url = lib.CollectionUrl(url=url, name=name, excluded=bool(excluded), concat=bool(concat),
+                                                   save_to_subfolder=bool(save_to_subfolder),
+                                                   is_playlist=None if is_playlist is None else bool(is_playlist))
+                collection_urls[url_id] = collection_url
+                collections[collection_id].adopt(collection_url)
+                collections[collection_id].urls.append(collection_url)
+
+            tracks: dict[int, list[tuple]] = {}
+            for url_id, *track in connection.execute(
+                    'SELECT collection_url_id, url, status, title, filename, playlist_index, permanently_downloaded, '
+                    'metadata_status, occurrence_index, extra FROM tracks ORDER BY collection_url_id, position'):
+                tracks.setdefault(url_id, []).append(track)
+
+            for url_id, collection_url in collection_urls.items():
+                if url_id in tracks:
+                    url, status, title, filename, playlist_index, permanently_downloaded, metadata_status, \
+                        occurrence, extra = zip(*tracks[url_id])
+                    extra = [json.loads(values) for values in extra]
+                    extra_names = sorted(set().union(*extra).difference(lib.CollectionUrl.TRACK_COLUMNS))
+                    collection_url.tracks = lib.CollectionUrl.tracks_from_columns(
+                        url=list(url), status=list(status), title=list(title), filename=list(filename),
+                        playlist_index=list(playlist_index),
+                        permanently_downloaded=[bool(value) for value in permanently_downloaded],
+                        metadata_status=list(metadata_status), occurrence_index=list(occurrence),
+                        **{name: [values.get(name) for values in extra] for name in extra_names})
+                else:
+                    collection_url.tracks = pd.DataFrame()
+                collection_url.tracks['collection_url'] = collection_url
+
+            scripts = {ScriptType(script_type).cls(name=name, script=script, **json.loads(attributes))
+                       for name, script_type, attributes, script
+                       in connection.execute('SELECT name, type, attributes, script FROM scripts')}
+
+            metadata = connection.execute('SELECT label, row FROM metadata ORDER BY position').fetchall()
+            metadata_table = pd.DataFrame([json.loads(row) for _, row in metadata],
+                                          index=[json.loads(label) for label, _ in metadata]) if metadata \
+                else pd.DataFrame()
+
+        for path, folder in folders.items():
+            folder.children = [child for _, child in sorted(children.get(path, []), key=lambda item: item[0])]
+
+        return lib.MusicSyncLibrary(path=self.path, max_download_rate=int(settings.get('max_download_rate', 0)),
+                                    download_priority=settings.get('download_priority',
+                                                                   lib.MusicSyncLibrary.DEFAULT_DOWNLOAD_PRIORITY),
+                                    metadata_retention_days=int(settings.get('metadata_retention_days', 0)),
+                                    scripts=scripts, metadata_table=metadata_table,
+                                    children=[child for _, child in sorted(children.get('', []),
+                                                                           key=lambda item: item[0])])
+
+    def collection_from_settings(self, name: str, settings: str) -> 'lib.Collection':
+        names = {collection_field.name for collection_field in fields(lib.Collection)}
+        # settings of newer versions are ignored
+        kwargs = {key: value for key, value in json.loads(settings).items()
+                  if key in names and key not in self.UNSTORED_COLLECTION_FIELDS}
+
+        if 'sync_actions' in kwargs:
+            kwargs['sync_actions'] = {lib.TrackSyncStatus(status): lib.TrackSyncAction(action)
+                                      for status, action in kwargs['sync_actions'].items()}
+        if 'sync_bookmark_path' in kwargs:
+            kwargs['sync_bookmark_path'] = [lib.PathComponent(*item) for item in kwargs['sync_bookmark_path']]
+        if 'script_settings' in kwargs:
+            kwargs['script_settings'] = [lib.ScriptReference(*item) for item in kwargs['script_settings']]
+
+        return lib.Collection(name=name, urls=[], **kwargs)
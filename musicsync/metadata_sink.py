@@ -0,0 +1,167 @@
+import json
+import os
+import time
+import uuid
+from typing import Any, ClassVar
+
+import pandas as pd
+
+try:
+    import pyarrow  # type: ignore[unresolved-import]
+except ImportError:
+    pyarrow = None
+
+
+class MetadataSink:
+    """
+    Collects the metadata of the entries downloaded during a sync. The fields excluded by the collection (see
+    ``Collection.excluded_yt_dlp_fields``) are removed from every entry as soon as it has been downloaded, so that only
+    the retained fields are kept in memory.
+
+    If a directory is given, the rows are also streamed to it in batches of ``BATCH_SIZE``: as Parquet files if pyarrow
+    is installed, otherwise appended to a JSON lines file. Every sink writes its own files, so files are never
+    rewritten. The files are kept forever unless a ``retention`` is given: then, before a sink writes its first file, the
+    files of previous syncs which are older than the retention are deleted (see ``prune``). ``read`` returns the rows of
+    all files that are still there.
+
+    Tracks that could not be downloaded are added with ``add_error``. They are only kept in memory and returned by
+    ``to_df`` with their error in the ``ERROR_COLUMN``.
+    """
+    BATCH_SIZE: ClassVar[int] = 100
+    COLLECTION_COLUMN: ClassVar[str] = 'musicsync_collection'
+    ERROR_COLUMN: ClassVar[str] = 'musicsync_error'
+    ATTEMPTS_COLUMN: ClassVar[str] = 'musicsync_attempts'
+
+    def __init__(self, directory: str | None = None, excluded_fields: str = '', collection_name: str = '',
+                 retention: float | None = None):
+        """
+        :param directory: Directory the rows are written to, or None to only keep them in memory
+        :param excluded_fields: Comma-separated names of the fields to remove from every entry
+        :param collection_name: Written to the ``COLLECTION_COLUMN`` of every row in the files
+        :param retention: Seconds the files of previous syncs are kept in the directory, or None to keep them forever
+        """
+        self.directory = directory
+        self.retention = retention
+        self.excluded_fields = {name.strip() for name in excluded_fields.split(',') if name.strip()}
+        self.collection_name = collection_name
+
+        self.rows: list[dict[str, Any]] = []
+        self.errors: list[dict[str, Any]] = []
+        self._pending: list[dict[str, Any]] = []
+        self._batches = 0
+        self._id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+
+    @staticmethod
+    def directory_for_library(library_path: str) -> str:
+        if library_path.endswith('.xml') or library_path.endswith('.pkl'):
+            library_path = library_path[:-4]
+        elif library_path.endswith('.sqlite'):
+            library_path = library_path[:-7]
+        return library_path + '.metadata'
+
+    def add(self, entry: dict) -> dict:
+        """
+        Removes the excluded fields from the entry (in-place, so that references to the entry elsewhere don't keep them
+        alive) and adds it as a row.
+
+        :return: The pruned entry
+        """
+        for name in self.excluded_fields:
+            entry.pop(name, None)
+
+        self.rows.append(entry)
+        if self.directory is not None:
+            self._pending.append(entry)
+            if len(self._pending) >= self.BATCH_SIZE:
+                self.flush()
+
+        return entry
+
+    def add_error(self, url: str, error: BaseException, attempts: int = 1, **fields):
+        """
+        Adds a row for a track that could not be downloaded.
+
+        :param attempts: Number of times the download has been attempted
+        :param fields: Further fields of the row, e.g. ``title`` and ``playlist_index``
+        """
+        self.errors.append({'url': url, 'original_url': url, **fields,
+                            self.ERROR_COLUMN: str(error) or type(error).__name__, self.ATTEMPTS_COLUMN: attempts})
+
+    def flush(self):
+        """
+        Writes all rows that haven't been written yet.
+        """
+        if self.directory is None or not self._pending:
+            return
+
+        if self._batches == 0 and self.retention is not None:
+            self.prune(self.directory, self.retention)
+        os.makedirs(self.directory, exist_ok=True)
+        rows = [{**self.serializable(row), self.COLLECTION_COLUMN: self.collection_name} for row in self._pending]
+
+        if pyarrow is not None:
+            path = os.path.join(self.directory, f'{self._id}-{self._batches:05d}.parquet')
+            pd.DataFrame.from_records(rows).to_parquet(path, index=False)
+        else:
+            with open(os.path.join(self.directory, f'{self._id}.jsonl'), 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+
+        self._batches += 1
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+    def to_df(self) -> pd.DataFrame:
+        """
+        :return: Dataframe containing the retained fields of all added entries, followed by the rows of all errors. The
+            ``ERROR_COLUMN`` is missing if there are no errors.
+        """
+        return pd.DataFrame.from_records(self.rows + self.errors)
+
+    @staticmethod
+    def serializable(row: dict[str, Any]) -> dict[str, Any]:
+        """
+        Converts all values that aren't strings, numbers or None to JSON strings, so that every column has one type.
+        """
+        return {key: value if value is None or isinstance(value, (str, int, float, bool))
+                else json.dumps(value, default=str)
+                for key, value in row.items()}
+
+    @staticmethod
+    def read(directory: str) -> pd.DataFrame:
+        """
+        :return: The rows of all files in the directory, in the order they were written
+        """
+        if not os.path.isdir(directory):
+            return pd.DataFrame()
+
+        frames = []
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if filename.endswith('.parquet'):
+                frames.append(pd.read_parquet(path))
+            elif filename.endswith('.jsonl'):
+                frames.append(pd.read_json(path, lines=True))
+
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    @staticmethod
+    def prune(directory: str, max_age: float):
+        """
+        Deletes the files of the directory which have been written more than ``max_age`` seconds ago.
+        """
+        if not os.path.isdir(directory):
+            return
+
+        now = time.time()
+        for entry in os.scandir(directory):
+            if not entry.is_file() or not entry.name.endswith(('.parquet', '.jsonl')):
+                continue
+            try:
+                if now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # already deleted by another sink
+                pass
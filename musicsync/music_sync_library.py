@@ -4,17 +4,23 @@ import xml.etree.ElementTree as et
 from collections import namedtuple
 from dataclasses import dataclass, field
 from enum import auto
-from typing import Any, ClassVar, Union, Callable
+from typing import Any, ClassVar, Union, Callable, Iterator
 from xml.etree.ElementTree import Element
 
 import pandas as pd
 from yt_dlp.postprocessor.common import PostProcessor
 
 import musicsync.downloader as dl
+import musicsync.scheduler as sched
 from musicsync.bookmark_library import Bookmark
 from musicsync.scripting.script_types import Script
-from .utils import classproperty, GuiStrEnum
-from .xml_object import XmlObject
+from .bandwidth_limiter import BandwidthLimiter
+from .library_store import LibraryStore
+from .metadata_sink import MetadataSink
+from .revisioned import Revisioned
+from .sync_journal import SyncJournal
+from .utils import classproperty, GuiStrEnum, occurrence_index
+from .xml_object import XmlObject, XmlStreamWriter
 
 
 class TrackSyncStatus(GuiStrEnum):
@@ -101,73 +107,279 @@ class MetadataStatus(GuiStrEnum):
 
 
 @dataclass
-class MusicSyncLibrary:
+class MusicSyncLibrary(Revisioned):
+    UNTRACKED_ATTRIBUTES: ClassVar[tuple[str, ...]] = ('path',)
+    # criteria the downloads can be ordered by, see MusicSyncDownloader.download_priority
+    DOWNLOAD_PRIORITY_CRITERIA: ClassVar[tuple[str, ...]] = ('pinned', 'new', 'duration', 'filesize')
+    DEFAULT_DOWNLOAD_PRIORITY: ClassVar[str] = 'pinned,new,duration,filesize'
+
     path: str = ''
+    # maximum total download rate of all collections in bytes per second, 0 for no limit
+    max_download_rate: int = 0
+    # comma-separated criteria the downloads of all collections are ordered by, see download_priority_criteria
+    download_priority: str = DEFAULT_DOWNLOAD_PRIORITY
+    # days the metadata files of previous syncs are kept (see MetadataSink), 0 to keep them forever
+    metadata_retention_days: int = 0
     scripts: set['Script'] = field(default_factory=set)
     metadata_table: pd.DataFrame = field(default_factory=pd.DataFrame)
     children: list[Union['Folder', 'Collection']] = field(default_factory=list)
 
+    # incremented on every change of the metadata table, which is saved separately
+    _metadata_revision = 0
+    _saved_metadata_revision = 0
+    # path of the SQLite library file that is in the saved state, see write_sqlite
+    _store_path = None
+    # shared by the downloads of all collections of the library, see bandwidth_limiter
+    _bandwidth_limiter = None
+
+    def __post_init__(self):
+        self.link_collections()
+
+    def __setattr__(self, name: str, value: Any):
+        if name == 'metadata_table' and value is not getattr(self, name, None):
+            self.touch_metadata_table()
+        super().__setattr__(name, value)
+
+    def touch_metadata_table(self):
+        """
+        Counts an in-place change of the metadata table.
+        """
+        self._metadata_revision += 1
+        self.touch()
+
+    @classmethod
+    def parse_download_priority(cls, value: str) -> list[str]:
+        """
+        :return: The criteria of a ``download_priority`` value, in order
+        :raise ValueError: If a criterion is not one of ``DOWNLOAD_PRIORITY_CRITERIA``
+        """
+        criteria = [criterion.strip() for criterion in value.split(',') if criterion.strip()]
+        for criterion in criteria:
+            if criterion not in cls.DOWNLOAD_PRIORITY_CRITERIA:
+                raise ValueError(f'Unknown download priority criterion "{criterion}", expected one of '
+                                 f'{", ".join(cls.DOWNLOAD_PRIORITY_CRITERIA)}')
+        return criteria
+
+    def download_priority_criteria(self) -> list[str]:
+        return self.parse_download_priority(self.download_priority)
+
+    def bandwidth_limiter(self) -> BandwidthLimiter:
+        """
+        :return: The limiter shared by the downloads of all collections of the library, limited to ``max_download_rate``
+        """
+        if self._bandwidth_limiter is None:
+            self._bandwidth_limiter = BandwidthLimiter()
+        self._bandwidth_limiter.rate = self.max_download_rate
+        return self._bandwidth_limiter
+
+    def metadata_table_has_changed(self) -> bool:
+        """
+        :return: Whether the metadata table has changed since the library was last read or saved
+        """
+        return self._metadata_revision != self._saved_metadata_revision
+
+    def mark_saved(self):
+        """
+        Marks the library, its metadata table and all its collections as saved.
+        """
+        super().mark_saved()
+        self._saved_metadata_revision = self._metadata_revision
+        for collection in self.iter_collections():
+            collection.mark_saved()
+
     @classmethod
     def read_pickle(cls, path: str):
         if path.endswith('.xml'):
             path = path[:-4] + '.pkl'
         with open(path, 'rb') as f:
-            return pickle.load(f)
+            library = pickle.load(f)
+
+        library.mark_saved()
+        library._store_path = None
+        # changes from the journal aren't saved yet
+        SyncJournal.for_library(path).replay(library)
+        return library
 
     def write_pickle(self, path: str):
         if path.endswith('.xml'):
             path = path[:-4] + '.pkl'
+        journal = SyncJournal.for_library(path)
+        saved_size = journal.size()
         with open(path, 'wb') as f:
             pickle.dump(self, f)
 
+        self.mark_saved()
+        self._store_path = None
+        journal.compact(saved_size)
+
     @classmethod
     def read_xml(cls, xml_path: str) -> 'MusicSyncLibrary':
         if xml_path.endswith('.pkl'):
             xml_path = xml_path[:-4] + '.xml'
 
-        tree = et.parse(xml_path)
-        root = tree.getroot()
+        # the file is parsed incrementally, and every top-level element is dropped as soon as it has been read, so
+        # the whole tree is never kept in memory. The tracks of the collection urls are only built on first access
+        # (see CollectionUrl.defer_tracks).
+        root = None
         children = []
         scripts = set()
-        for child in root:
-            if child.tag == 'Folder':
-                children.append(Folder.from_xml(child))
-            elif child.tag == 'Collection':
-                children.append(Collection.from_xml(child))
-            elif child.tag == 'Scripts':
-                for script in child:
+        for event, el in et.iterparse(xml_path, events=('start', 'end')):
+            if root is None:
+                root = el
+                continue
+            if event != 'end' or el not in root:
+                continue
+
+            if el.tag == 'Folder':
+                children.append(Folder.from_xml(el))
+            elif el.tag == 'Collection':
+                children.append(Collection.from_xml(el))
+            elif el.tag == 'Scripts':
+                for script in el:
                     scripts.add(Script.from_xml(script))
+            root.remove(el)
 
         csv_path = xml_path[:-4] + '.csv'
         metadata_table = pd.read_csv(csv_path) if os.path.isfile(csv_path) else pd.DataFrame()
 
-        return cls(path=xml_path, children=children, scripts=scripts, metadata_table=metadata_table)
+        library = cls(path=xml_path, children=children, scripts=scripts, metadata_table=metadata_table,
+                      max_download_rate=int(root.attrib.get('max_download_rate', 0)),
+                      download_priority=root.attrib.get('download_priority', cls.DEFAULT_DOWNLOAD_PRIORITY),
+                      metadata_retention_days=int(root.attrib.get('metadata_retention_days', 0)))
+        library.mark_saved()
+        # changes from the journal aren't saved yet
+        SyncJournal.for_library(xml_path).replay(library)
+        return library
 
     def write_xml(self, xml_path: str):
         if xml_path.endswith('.pkl'):
             xml_path = xml_path[:-4] + '.xml'
 
-        root = et.Element('MusicSyncLibrary')
-        scripts = et.Element('Scripts')
-        for script in self.scripts:
-            scripts.append(script.to_xml())
-        root.append(scripts)
-        for child in self.children:
-            root.append(child.to_xml())
-
         if not xml_path.endswith('.xml'):
             xml_path += '.xml'
 
-        et.ElementTree(root).write(xml_path)
+        journal = SyncJournal.for_library(xml_path)
+        saved_size = journal.size()
+
+        # the elements are written one by one, so the tree of the whole library is never built. The library is written
+        # to a temporary file first, so that a failure can't leave a truncated library behind.
+        temp_path = xml_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='us-ascii', errors='xmlcharrefreplace') as f:
+                writer = XmlStreamWriter(f)
+                attributes = {}
+                if self.max_download_rate:
+                    attributes['max_download_rate'] = str(self.max_download_rate)
+                if self.download_priority != self.DEFAULT_DOWNLOAD_PRIORITY:
+                    attributes['download_priority'] = self.download_priority
+                if self.metadata_retention_days:
+                    attributes['metadata_retention_days'] = str(self.metadata_retention_days)
+                writer.start('MusicSyncLibrary', attributes)
+                writer.start('Scripts', {})
+                for script in self.scripts:
+                    writer.element(script.to_xml())
+                writer.end('Scripts')
+                for child in self.children:
+                    child.stream_xml(writer)
+                writer.end('MusicSyncLibrary')
+            os.replace(temp_path, xml_path)
+        except BaseException:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
 
         if not self.metadata_table.empty:
             self.metadata_table.to_csv(xml_path[:-4] + '.csv')
 
+        self.mark_saved()
+        self._store_path = None
+        journal.compact(saved_size)
+
+    @classmethod
+    def read_sqlite(cls, path: str) -> 'MusicSyncLibrary':
+        """
+        Reads a library from its SQLite library file, see ``LibraryStore``.
+        """
+        path = LibraryStore.path_for_library(path)
+        library = LibraryStore(path).read()
+        library.mark_saved()
+        library._store_path = path
+        # changes from the journal aren't saved yet
+        SyncJournal.for_library(path).replay(library)
+        return library
+
+    def write_sqlite(self, path: str) -> dict[str, tuple[int, int]]:
+        """
+        Writes the changes of the library to its SQLite library file, see ``LibraryStore.write``. If the library has
+        been read from or written to the same file before, only the collections that have changed since then are
+        written.
+
+        :return: The number of (upserted, deleted) rows per table
+        """
+        path = LibraryStore.path_for_library(path)
+        journal = SyncJournal.for_library(path)
+        saved_size = journal.size()
+        counts = LibraryStore(path).write(self, changed_only=path == self._store_path)
+        self.mark_saved()
+        self._store_path = path
+        journal.compact(saved_size)
+        return counts
+
+    @classmethod
+    def migrate_to_sqlite(cls, xml_path: str, path: str | None = None) -> 'MusicSyncLibrary':
+        """
+        Imports a library from its XML file and the CSV file of its metadata table (see ``read_xml``) into an SQLite
+        library file. The XML and CSV files are kept.
+
+        :param path: Path of the SQLite library file, defaults to the path of the XML file with the extension
+            ``.sqlite``
+        :return: The library, with the path of the SQLite library file
+        """
+        library = cls.read_xml(xml_path)
+        library.path = LibraryStore.path_for_library(path if path is not None else xml_path)
+        library.write_sqlite(library.path)
+        return library
+
+    def link_collections(self):
+        """
+        Sets ``Collection.library`` of all collections to this library. Has to be called whenever collections are added.
+        """
+        for collection in self.iter_collections():
+            collection.library = self
+
+    def iter_collections(self) -> Iterator['Collection']:
+        """
+        :return: Iterator over all collections of the library, including those in (nested) folders
+        """
+        for child in self.children:
+            if isinstance(child, Folder):
+                yield from child.iter_collections()
+            else:
+                yield child
+
+    def compare(self, delete_files: bool = False, force_refresh: bool = False, max_workers: int = sched.CompareScheduler.DEFAULT_MAX_WORKERS,
+                max_per_domain: int = sched.CompareScheduler.DEFAULT_MAX_PER_DOMAIN,
+                domain_limits: dict[str, int] | None = None,
+                progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None,
+                chunk_callback: Callable[['Collection', pd.DataFrame], None] | None=None) -> list[pd.DataFrame | Exception] | Exception:
+        """
+        Compares all collections of the library concurrently, see ``CompareScheduler``.
+
+        :return: The compare result of every collection, in the order of ``iter_collections``
+        """
+        scheduler = sched.CompareScheduler(list(self.iter_collections()), max_workers=max_workers,
+                                           max_per_domain=max_per_domain, domain_limits=domain_limits)
+        try:
+            return scheduler.compare(delete_files=delete_files, force_refresh=force_refresh, progress_callback=progress_callback,
+                                     interruption_callback=interruption_callback, chunk_callback=chunk_callback)
+        except Exception as e:
+            return e
+
     def __eq__(self, other: MusicSyncLibrary):
-        return self.scripts == other.scripts and self.children == other.children and (self.metadata_table == other.metadata_table).all(axis=None)
+        return self.scripts == other.scripts and self.max_download_rate == other.max_download_rate and self.download_priority == other.download_priority and self.metadata_retention_days == other.metadata_retention_days and self.children == other.children and (self.metadata_table == other.metadata_table).all(axis=None)
 
 @dataclass
-class Folder(XmlObject):
+class Folder(XmlObject, Revisioned):
     name: str
     children: list[Union['Folder', 'Collection']] = field(default_factory=list)
 
@@ -182,21 +394,36 @@ class Folder(XmlObject):
 
         return cls(children=children, **el.attrib)
 
-    def to_xml(self) -> Element:
-        attrs = vars(self).copy()
+    def iter_collections(self) -> Iterator['Collection']:
+        for child in self.children:
+            if isinstance(child, Folder):
+                yield from child.iter_collections()
+            else:
+                yield child
+
+    def to_xml(self, include_children: bool = True) -> Element:
+        attrs = self.public_attributes()
         attrs.pop('children')
 
         el = et.Element('Folder', **attrs)
-        for child in self.children:
-            el.append(child.to_xml())
+        if include_children:
+            for child in self.children:
+                el.append(child.to_xml())
         return el
 
+    def stream_xml(self, writer: XmlStreamWriter):
+        el = self.to_xml(include_children=False)
+        writer.start(el.tag, el.attrib)
+        for child in self.children:
+            child.stream_xml(writer)
+        writer.end(el.tag)
+
 
 PathComponent = namedtuple('PathComponent', ['id', 'name'])
 ScriptReference = namedtuple('ScriptReference', ['name', 'enabled', 'priority'])
 
 @dataclass
-class Collection(XmlObject):
+class Collection(XmlObject, Revisioned):
     @classproperty
     def DEFAULT_SYNC_ACTIONS(self) -> dict[TrackSyncStatus, TrackSyncAction]:
         return {
@@ -264,6 +491,11 @@ class Collection(XmlObject):
     DEFAULT_EXCLUDED_YT_DLP_FIELDS: ClassVar[str] = ('formats, thumbnails, automatic_captions, subtitles, heatmap, '
                                                      'chapters, entries, tags, protocol, http_headers, '
                                                      '_format_sort_fields, _version')
+    DEFAULT_MAX_CONCURRENT_EXTRACTIONS: ClassVar[int] = 4
+    DEFAULT_MAX_CONCURRENT_DOWNLOADS: ClassVar[int] = 4
+    UNTRACKED_ATTRIBUTES: ClassVar[tuple[str, ...]] = ('downloader', 'library')
+    # (database path, key) under which the collection is stored by a LibraryStore
+    _store_key = None
 
     name: str
 
@@ -276,6 +508,12 @@ class Collection(XmlObject):
     auto_concat_urls: bool = False
     excluded_yt_dlp_fields: str = DEFAULT_EXCLUDED_YT_DLP_FIELDS
     yt_dlp_options: str = ''
+    max_concurrent_extractions: int = DEFAULT_MAX_CONCURRENT_EXTRACTIONS
+    max_concurrent_downloads: int = DEFAULT_MAX_CONCURRENT_DOWNLOADS
+    # downloads of pinned collections are started first and get the bandwidth first
+    pinned: bool = False
+    # keep the original downloads in the source media cache, so that the files can be transcoded again locally
+    cache_source_media: bool = False
 
     sync_bookmark_file: str = ''
     sync_bookmark_path: list[PathComponent] = field(default_factory=list)
@@ -290,15 +528,23 @@ class Collection(XmlObject):
 
     downloader: 'dl.MusicSyncDownloader | None' = None
 
+    # the library this collection belongs to, not saved
+    library: 'MusicSyncLibrary | None' = field(default=None, compare=False, repr=False)
+
     @classmethod
     def from_xml(cls, el: Element) -> 'Collection':
         kwargs: dict[str, Any] = el.attrib.copy()
         kwargs['urls'] = []
 
         for bool_var in ('save_playlists_to_subfolders', 'sync_bookmark_title_as_url_name', 'sync_delete_files',
-                         'exclude_after_download', 'auto_concat_urls'):
+                         'exclude_after_download', 'auto_concat_urls', 'pinned', 'cache_source_media'):
             kwargs[bool_var] = kwargs.get(bool_var) == 'True'
 
+        kwargs['max_concurrent_extractions'] = int(kwargs.get('max_concurrent_extractions',
+                                                              cls.DEFAULT_MAX_CONCURRENT_EXTRACTIONS))
+        kwargs['max_concurrent_downloads'] = int(kwargs.get('max_concurrent_downloads',
+                                                            cls.DEFAULT_MAX_CONCURRENT_DOWNLOADS))
+
         for child in el:
             if child.tag == 'BookmarkSync':
                 kwargs['sync_bookmark_file'] = child.attrib['file']
@@ -319,13 +565,15 @@ class Collection(XmlObject):
 
         return cls(**kwargs)
 
-    def to_xml(self) -> Element:
-        attrs = vars(self).copy()
+    def to_xml(self, include_urls: bool = True) -> Element:
+        attrs = self.public_attributes()
         for pop_var in ('urls', 'sync_bookmark_file', 'sync_bookmark_path', 'sync_bookmark_title_as_url_name',
-                        'sync_delete_files', 'sync_actions', 'script_settings', 'downloader', 'excluded_yt_dlp_fields'):
+                        'sync_delete_files', 'sync_actions', 'script_settings', 'downloader', 'excluded_yt_dlp_fields',
+                        'library'):
             attrs.pop(pop_var)
 
-        for str_var in ('save_playlists_to_subfolders', 'exclude_after_download', 'auto_concat_urls'):
+        for str_var in ('save_playlists_to_subfolders', 'exclude_after_download', 'auto_concat_urls',
+                        'max_concurrent_extractions', 'max_concurrent_downloads', 'pinned', 'cache_source_media'):
             attrs[str_var] = str(attrs[str_var])
 
         el = et.Element('Collection', **attrs)
@@ -349,54 +597,160 @@ class Collection(XmlObject):
                 script_settings.append(et.Element('ScriptReference', name=ref.name, enabled=str(ref.enabled), priority=str(ref.priority)))
             el.append(script_settings)
 
-        for url in self.urls:
-            el.append(url.to_xml())
+        if include_urls:
+            for url in self.urls:
+                el.append(url.to_xml())
         return el
 
+    def stream_xml(self, writer: XmlStreamWriter):
+        el = self.to_xml(include_urls=False)
+        writer.start(el.tag, el.attrib)
+        for child in el:
+            writer.element(child)
+        for url in self.urls:
+            url.stream_xml(writer)
+        writer.end(el.tag)
+
     def add_url(self, url, name, *args, **kwargs):
-        self.urls.append(CollectionUrl(url=url, name=name, concat=self.auto_concat_urls, save_to_subfolder=self.save_playlists_to_subfolders, *args, **kwargs))
+        new_url = CollectionUrl(url=url, name=name, concat=self.auto_concat_urls, save_to_subfolder=self.save_playlists_to_subfolders, *args, **kwargs)
+        self.adopt(new_url)
+        self.urls.append(new_url)
+        self.touch()
 
     def bookmark_sync(self, bookmarks: list[Bookmark]) -> tuple[list, list]:
-        occurrences = {}
-        local_urls: dict[tuple[str, int], CollectionUrl] = {}
-
         # build mapping from url, occurrence index -> collection url object
-        for url in self.urls:
-            occurrences[url.url] = occurrences.get(url.url, 0) + 1
-            local_urls[(url.url, occurrences[url.url])] = url
+        local_urls: dict[tuple[str, int], CollectionUrl] = dict(zip(
+            zip([url.url for url in self.urls], occurrence_index(url.url for url in self.urls).tolist()), self.urls))
 
-        occurrences = {}
         self.urls = []
         added_urls = []
-        for bookmark in bookmarks:
-            occurrences[bookmark.url] = occurrences.get(bookmark.url, 0) + 1
-            if (bookmark.url, occurrences[bookmark.url]) in local_urls:
-                self.urls.append(local_urls.pop((bookmark.url, occurrences[bookmark.url])))
+        bookmark_occurrences = occurrence_index(bookmark.url for bookmark in bookmarks).tolist()
+        for bookmark, occurrence in zip(bookmarks, bookmark_occurrences):
+            if (bookmark.url, occurrence) in local_urls:
+                self.urls.append(local_urls.pop((bookmark.url, occurrence)))
             else:
                 self.add_url(url=bookmark.url, name=bookmark.bookmark_title if self.sync_bookmark_title_as_url_name else '')
                 added_urls.append((bookmark.url, bookmark.bookmark_title))
 
         return added_urls, list(local_urls.values())
 
-    def compare(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+    def compare(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None,
+                chunk_callback: Callable[[pd.DataFrame], None] | None=None, force_refresh: bool = False) -> pd.DataFrame | Exception:
         self.downloader = dl.MusicSyncDownloader(self)
         assert isinstance(self.downloader, dl.MusicSyncDownloader)  # make ide happy
 
         try:
-            return self.downloader.compare(progress_callback=progress_callback, interruption_callback=interruption_callback)
+            return self.downloader.compare(force_refresh=force_refresh, progress_callback=progress_callback,
+                                           interruption_callback=interruption_callback, chunk_callback=chunk_callback)
         except Exception as e:
             return e
 
-    def sync(self, info_df: pd.DataFrame, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+    def compare_incremental(self, previous_result: pd.DataFrame | None, selected_urls: list['CollectionUrl'] | None = None,
+                            max_age: float | None = None,
+                            progress_callback: Callable[[float, str], None] | None=None,
+                            interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+        # the downloader is kept, so that the infos of the urls which aren't compared again can still be used for sync
         if self.downloader is None:
             self.downloader = dl.MusicSyncDownloader(self)
         assert isinstance(self.downloader, dl.MusicSyncDownloader)  # make ide happy
 
         try:
+            return self.downloader.compare_incremental(previous_result, selected_urls=selected_urls, max_age=max_age,
+                                                       progress_callback=progress_callback,
+                                                       interruption_callback=interruption_callback)
+        except Exception as e:
+            return e
+
+    def compare_and_sync(self, progress_callback: Callable[[float, str], None] | None=None,
+                         interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+        self.downloader = dl.MusicSyncDownloader(self)
+        assert isinstance(self.downloader, dl.MusicSyncDownloader)  # make ide happy
+
+        try:
+            return self.downloader.compare_and_sync(delete_files=self.sync_delete_files,
+                                                    progress_callback=progress_callback,
+                                                    interruption_callback=interruption_callback)
+        except Exception as e:
+            return e
+
+    def sync(self, info_df: pd.DataFrame, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None,
+             dry_run: bool = False) -> pd.DataFrame | Exception:
+        if self.downloader is None:
+            self.downloader = dl.MusicSyncDownloader(self)
+        assert isinstance(self.downloader, dl.MusicSyncDownloader)  # make ide happy
+
+        try:
+            return self.downloader.sync(info_df, progress_callback=progress_callback, interruption_callback=interruption_callback,
+                                        dry_run=dry_run)
+        except Exception as e:
+            return e
+
+    def retranscode(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+        if self.downloader is None:
+            self.downloader = dl.MusicSyncDownloader(self)
+        assert isinstance(self.downloader, dl.MusicSyncDownloader)  # make ide happy
+
+        try:
+            return self.downloader.retranscode(progress_callback=progress_callback, interruption_callback=interruption_callback)
+        except Exception as e:
+            return e
+
+    def journal(self) -> SyncJournal | None:
+        """
+        :return: The sync journal of the library of this collection, or None if the library hasn't been saved yet
+        """
+        if self.library is None or not self.library.path:
+            return None
+        return SyncJournal.for_library(self.library.path)
+
+    def metadata_sink(self) -> MetadataSink:
+        """
+        :return: A new sink for the metadata downloaded during a sync. Its rows are written next to the library file,
+            or only kept in memory if the library hasn't been saved yet. Files of previous syncs are pruned if the
+            library has a ``metadata_retention_days``.
+        """
+        directory = None
+        retention = None
+        if self.library is not None and self.library.path:
+            directory = MetadataSink.directory_for_library(self.library.path)
+            if self.library.metadata_retention_days:
+                retention = self.library.metadata_retention_days * 24 * 60 * 60
+        return MetadataSink(directory, excluded_fields=self.excluded_yt_dlp_fields, collection_name=self.name,
+                            retention=retention)
+
+    def has_unfinished_sync(self) -> bool:
+        journal = self.journal()
+        return journal is not None and any(journal.unfinished(self).values())
+
+    def resume_sync(self, progress_callback: Callable[[float, str], None] | None=None, interruption_callback: Callable[[], bool] | None=None) -> pd.DataFrame | Exception:
+        """
+        Performs the remaining actions of all interrupted syncs of this collection, see ``SyncJournal``.
+        """
+        if self.downloader is None:
+            self.downloader = dl.MusicSyncDownloader(self)
+        assert isinstance(self.downloader, dl.MusicSyncDownloader)  # make ide happy
+
+        journal = self.journal()
+        if journal is None:
+            return pd.DataFrame()
+
+        try:
+            sync_ids, info_df = journal.remaining_actions(self)
+            # the remaining actions are planned again by the new sync
+            for sync_id in sync_ids:
+                journal.end(sync_id)
+
             return self.downloader.sync(info_df, progress_callback=progress_callback, interruption_callback=interruption_callback)
         except Exception as e:
             return e
 
+    def output_profile(self) -> tuple[str, str]:
+        """
+        :return: The settings that determine the content of the downloaded files. Collections with the same output
+            profile get the same file for the same URL.
+        """
+        return self.file_extension, self.yt_dlp_options.strip()
+
     def get_real_path(self, url: 'CollectionUrl', track=None):
         folder = self.folder_path
         if self.save_playlists_to_subfolders and url.is_playlist:
@@ -418,7 +772,11 @@ class YTMusicAlbumCover(PostProcessor):
 
 
 @dataclass(order=True)
-class CollectionUrl(XmlObject):
+class CollectionUrl(XmlObject, Revisioned):
+    TRACK_COLUMNS: ClassVar[list[str]] = ['url', 'status', 'title', 'filename', 'playlist_index',
+                                          'permanently_downloaded', 'metadata_status', 'occurrence_index',
+                                          'collection_url']
+
     url: str
     name: str = ''
     excluded: bool = False
@@ -442,21 +800,26 @@ class CollectionUrl(XmlObject):
             'collection_url': self
         }, index=[0])
 
-        self.tracks = pd.concat([self.tracks, new_track], ignore_index=True)
+        # concatenating with an empty dataframe (e.g. without tracks, read from xml) would turn integers into floats
+        self.tracks = pd.concat([self.tracks, new_track], ignore_index=True) if not self.tracks.empty else new_track
         self.tracks['occurrence_index'] = self.tracks['occurrence_index'].astype(int)
 
     def get_tracks(self, filter_df: pd.DataFrame) -> pd.DataFrame:
         """
         Filters the given ``filter_df`` dataframe by which tracks of it belong to this collection url. Then filters its own
-        tracks dataframe by the tracks present in the ``filter_df`` and returns the result.
+        tracks dataframe by the tracks present in the ``filter_df`` and returns the result, keeping the index of the
+        tracks dataframe.
         :param filter_df: has to contain the columns ``collection_url``, ``url``, and ``occurrence_index``
         """
+        if self.tracks.empty:
+            return self.tracks
 
-        filter_df = filter_df[filter_df['collection_url'].apply(lambda x: x is self)]
+        filter_df = filter_df[[collection_url is self for collection_url in filter_df['collection_url']]]
 
-        filtered_tracks = self.tracks.merge(filter_df, how='inner', on=['url', 'occurrence_index'], suffixes=(None, '_filter'))
+        filtered_tracks = self.tracks.rename_axis('_label').reset_index().merge(
+            filter_df, how='inner', on=['url', 'occurrence_index'], suffixes=(None, '_filter'))
 
-        return filtered_tracks
+        return filtered_tracks.set_index('_label').rename_axis(self.tracks.index.name)
 
     def broadcast_update_tracks(self, filter_df: pd.DataFrame, **kwargs) -> pd.DataFrame:
         """
@@ -465,12 +828,23 @@ class CollectionUrl(XmlObject):
         to all tracks.
         :returns: dataframe containing only modified tracks
         """
-        filtered_tracks = self.get_tracks(filter_df)
+        return self.update_tracks_at(self.get_tracks(filter_df).index, **kwargs)
 
+    def update_tracks_at(self, labels, **kwargs) -> pd.DataFrame:
+        """
+        Updates the key value pairs specified in ``kwargs`` of the tracks with the given index labels.
+        :returns: dataframe containing only modified tracks
+        """
         for k, v in kwargs.items():
-            self.tracks.loc[filtered_tracks.index, k] = v
+            self.tracks.loc[labels, k] = v
+        self.touch()
 
-        return self.tracks.loc[filtered_tracks.index, :]
+        return self.tracks.loc[labels, :]
+
+    def has_track(self, track_url: str, track_occurrence_index: int = 1) -> bool:
+        tracks = self.tracks
+        return not tracks.empty and bool(((tracks['url'] == track_url)
+                                          & (tracks['occurrence_index'] == track_occurrence_index)).any())
 
     def update_track(self, track_url, track_occurrence_index=1, **kwargs):
         if self.tracks.empty:
@@ -486,20 +860,75 @@ class CollectionUrl(XmlObject):
         track_index = track_index[0]
         for k, v in kwargs.items():
             self.tracks.loc[track_index, k] = v
+        self.touch()
 
     def remove_tracks(self, filter_df: pd.DataFrame, **kwargs):
-        filtered_tracks = self.get_tracks(filter_df)
+        self.remove_tracks_at(self.get_tracks(filter_df).index)
 
-        self.tracks = self.tracks[~self.tracks.index.isin(filtered_tracks.index)]
+    def remove_tracks_at(self, labels):
+        """
+        Removes the tracks with the given index labels.
+        """
+        self.tracks = self.tracks[~self.tracks.index.isin(labels)]
+
+    def compare_tracks(self, videos: pd.DataFrame, existing_files: set[str]) -> pd.DataFrame:
+        """
+        Determines the sync status of all tracks of this collection url in one pass. Videos and tracks are matched by
+        their url and occurrence index.
+
+        :param videos: The videos currently present online. Has to contain the columns ``url``, ``title``,
+            ``playlist_index`` and ``occurrence_index``
+        :param existing_files: Names of the files that exist in the folder of this collection url
+        :return: One row per video (in the order of ``videos``) followed by one row per track that doesn't correspond
+            to a video anymore (in the order of the tracks dataframe)
+        """
+        tracks = self.tracks.reset_index(drop=True)
+        tracks = tracks.reindex(columns=list(dict.fromkeys(CollectionUrl.TRACK_COLUMNS + tracks.columns.tolist())))
+
+        # tracks are matched by the number of times their url occurred up to them, not by their stored occurrence index
+        track_occurrences = occurrence_index(tracks['url'])
+
+        # the video info (title, playlist index, occurrence index) replaces the info of the matched track
+        local = tracks.drop(columns=['title', 'playlist_index', 'occurrence_index']).assign(
+            occurrence_index=track_occurrences, _local_index=tracks.index)
+        online = videos[['url', 'title', 'playlist_index', 'occurrence_index']].reset_index(drop=True)
+        online = online.astype({'occurrence_index': int})
+
+        matched = online.merge(local, how='left', on=['url', 'occurrence_index'])
+        is_matched = matched['_local_index'].notna()
+        file_exists = matched['filename'].isin(existing_files)
+
+        status = matched['status'].astype(object)
+        # 3. ADDED_TO_SOURCE: Track is present in source, but was not present in previous sync
+        status[~is_matched] = TrackSyncStatus.ADDED_TO_SOURCE
+        # 4. NOT_DOWNLOADED: Track is present in source, was also present in previous sync, but corresponding file does not exist
+        status[is_matched & ~file_exists] = TrackSyncStatus.NOT_DOWNLOADED
+        # 5. DOWNLOADED: Track is present in source and the corresponding file exists
+        # (Implicit) 6. PERMANENTLY_DOWNLOADED: File is present in the permanently downloaded files
+        status[is_matched & file_exists & (status != TrackSyncStatus.PERMANENTLY_DOWNLOADED)] = TrackSyncStatus.DOWNLOADED
+        matched['status'] = status
+
+        matched = matched.astype({'filename': object, 'permanently_downloaded': object, 'metadata_status': object})
+        matched.loc[~is_matched, 'filename'] = ''
+        matched.loc[~is_matched, 'permanently_downloaded'] = False
+        matched.loc[~is_matched, 'metadata_status'] = MetadataStatus.NEW
+
+        # Determine status for remaining tracks from the collection url
+        remaining = tracks[~tracks.index.isin(matched.loc[is_matched, '_local_index'])]
+        remaining_status = remaining['status'].astype(object)
+        # 1. REMOVED_FROM_SOURCE: Track is not present in source, but was present in previous sync
+        remaining_status[remaining['status'] == TrackSyncStatus.DOWNLOADED] = TrackSyncStatus.REMOVED_FROM_SOURCE
+        # 2. LOCAL_FILE: File is not in the permanently downloaded files, and does not correspond to a source track
+        remaining_status[~remaining['status'].isin([TrackSyncStatus.DOWNLOADED,
+                                                    TrackSyncStatus.PERMANENTLY_DOWNLOADED])] = TrackSyncStatus.LOCAL_FILE
+        remaining = remaining.assign(status=remaining_status)
+
+        status_df = pd.concat([matched.drop(columns='_local_index')[tracks.columns], remaining], ignore_index=True)
+        status_df['collection_url'] = [self] * len(status_df)
+        return status_df
 
     @classmethod
     def from_xml(cls, el: Element) -> 'CollectionUrl':
-        track_series: list[pd.Series] = []
-        for child in el:
-            if child.tag == 'Track':
-                track = cls.track_from_xml(child)
-                track_series.append(track)
-
         attrib: dict[str, Any] = el.attrib.copy()
 
         for bool_var in ('excluded', 'concat', 'save_to_subfolder'):
@@ -511,29 +940,155 @@ class CollectionUrl(XmlObject):
             attrib['is_playlist'] = attrib.get('is_playlist') == 'True'
 
         new_collection_url = cls(**attrib)
-        tracks = pd.DataFrame(track_series)
-        tracks['collection_url'] = new_collection_url
-        new_collection_url.tracks = tracks
+        new_collection_url.defer_tracks([child.attrib for child in el if child.tag == 'Track'])
         return new_collection_url
 
-    def to_xml(self) -> Element:
-        attrs = vars(self).copy()
-        attrs.pop('tracks')
+    def defer_tracks(self, track_attributes: list[dict[str, str]]):
+        """
+        Replaces ``tracks`` by the attributes of the track elements, which are only turned into a dataframe when
+        ``tracks`` is accessed for the first time. This doesn't count as a change.
+        """
+        self.__dict__.pop('tracks', None)
+        self._track_attributes = track_attributes
+
+    @property
+    def tracks_loaded(self) -> bool:
+        return 'tracks' in self.__dict__
+
+    def __getattr__(self, name: str):
+        # only called if the attribute isn't set, i.e. for deferred tracks
+        if name == 'tracks' and '_track_attributes' in self.__dict__:
+            track_attributes = self.__dict__.pop('_track_attributes')
+            tracks = self.tracks_from_attributes(track_attributes)
+            tracks['collection_url'] = self
+            object.__setattr__(self, 'tracks', tracks)
+            return tracks
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __setattr__(self, name: str, value: Any):
+        if name == 'tracks':
+            # the deferred tracks are replaced without building them first
+            self.__dict__.pop('_track_attributes', None)
+        super().__setattr__(name, value)
+
+    def to_xml(self, include_tracks: bool = True) -> Element:
+        attrs = self.public_attributes()
+        attrs.pop('tracks', None)
 
         for string_var in ('excluded', 'concat', 'is_playlist', 'save_to_subfolder'):
             attrs[string_var] = str(attrs[string_var])
 
         el = et.Element('CollectionUrl', **attrs)
-        for index, track in self.tracks.iterrows():
-            el.append(self.track_to_xml(track))
+        if include_tracks:
+            for track_attributes in self.track_attributes():
+                el.append(Element('Track', track_attributes))
         return el
 
-    @staticmethod
-    def track_from_xml(el: Element) -> pd.Series:
+    def stream_xml(self, writer: XmlStreamWriter):
+        el = self.to_xml(include_tracks=False)
+        writer.start(el.tag, el.attrib)
+        for track_attributes in self.track_attributes():
+            writer.empty('Track', track_attributes)
+        writer.end(el.tag)
+
+    def track_attributes(self) -> Iterator[dict[str, str]]:
+        """
+        :return: The attributes of the track elements (like ``track_to_xml``), converted column by column instead of
+            row by row. Missing values are left out. Deferred tracks are returned as they have been read.
+        """
+        if not self.tracks_loaded:
+            yield from self._track_attributes
+            return
+
+        columns = [column for column in self.tracks.columns if column != 'collection_url']
+        values = []
+        for column in columns:
+            missing = self.tracks[column].isna().tolist()
+            if column in ('playlist_index', 'occurrence_index'):
+                # float columns would be written as e.g. '3.0'
+                values.append([None if is_missing else str(int(value))
+                               for value, is_missing in zip(self.tracks[column].tolist(), missing)])
+            else:
+                values.append([None if is_missing else str(value)
+                               for value, is_missing in zip(self.tracks[column].tolist(), missing)])
+
+        for track in zip(*values):
+            yield {column: value for column, value in zip(columns, track) if value is not None}
+
+    @classproperty
+    def STATUS_DTYPE(self) -> pd.CategoricalDtype:
+        # the categories have to be kept as enum members, a string index would turn them into plain strings
+        return pd.CategoricalDtype(pd.Index(list(TrackSyncStatus), dtype=object))
+
+    @classproperty
+    def METADATA_STATUS_DTYPE(self) -> pd.CategoricalDtype:
+        return pd.CategoricalDtype(pd.Index(list(MetadataStatus), dtype=object))
+
+    @classmethod
+    def tracks_from_columns(cls, url: list[str], status: list[str], title: list[str], filename: list[str],
+                            playlist_index: list[int | None], permanently_downloaded: list[bool],
+                            metadata_status: list[str], occurrence_index: list[int],
+                            **other_columns: list) -> pd.DataFrame:
+        """
+        Builds a tracks dataframe (without the ``collection_url`` column) from one list per column at once. The status
+        columns are categorical, ``playlist_index`` is a nullable integer column.
+
+        :param status: Values of ``TrackSyncStatus``
+        :param metadata_status: Values of ``MetadataStatus``
+        """
+        status_codes = {s.value: code for code, s in enumerate(TrackSyncStatus)}
+        metadata_status_codes = {s.value: code for code, s in enumerate(MetadataStatus)}
+
+        return pd.DataFrame({
+            'url': url,
+            'status': pd.Categorical.from_codes([status_codes[s] for s in status], dtype=cls.STATUS_DTYPE),
+            'title': title,
+            'filename': filename,
+            'playlist_index': pd.array(playlist_index, dtype='Int64'),
+            'permanently_downloaded': pd.array(permanently_downloaded, dtype=bool),
+            'metadata_status': pd.Categorical.from_codes([metadata_status_codes[s] for s in metadata_status],
+                                                         dtype=cls.METADATA_STATUS_DTYPE),
+            'occurrence_index': pd.array(occurrence_index, dtype='int64'),
+            **other_columns,
+        })
+
+    @classmethod
+    def tracks_from_attributes(cls, track_attributes: list[dict[str, str]]) -> pd.DataFrame:
+        """
+        Builds a tracks dataframe (without the ``collection_url`` column) from the attributes of track elements, see
+        ``tracks_from_columns``. Attributes that aren't track columns are kept as additional columns.
+        """
+        if not track_attributes:
+            return pd.DataFrame()
+
+        other_names = set().union(*track_attributes).difference(cls.TRACK_COLUMNS)
+        return cls.tracks_from_columns(
+            url=[attrib['url'] for attrib in track_attributes],
+            status=[attrib['status'] for attrib in track_attributes],
+            title=[attrib.get('title', '') for attrib in track_attributes],
+            filename=[attrib.get('filename', '') for attrib in track_attributes],
+            # files written by older versions can contain missing playlist indices as 'nan'
+            playlist_index=[None if attrib.get('playlist_index', 'None') in ('None', 'nan', '') else
+                            int(attrib['playlist_index']) for attrib in track_attributes],
+            permanently_downloaded=[attrib.get('permanently_downloaded') == 'True' for attrib in track_attributes],
+            metadata_status=[attrib.get('metadata_status', MetadataStatus.NEW) for attrib in track_attributes],
+            occurrence_index=[int(attrib.get('occurrence_index', 1)) for attrib in track_attributes],
+            **{name: [attrib.get(name) for attrib in track_attributes] for name in sorted(other_names)},
+        )
+
+    @classmethod
+    def track_from_xml(cls, el: Element) -> pd.Series:
         """
         A track Series has to have all attributes defined in Track
         """
-        attrib: dict[str, Any] = el.attrib.copy()
+        return cls.track_from_attributes(el.attrib)
+
+    @staticmethod
+    def track_from_attributes(attributes: dict[str, str]) -> pd.Series:
+        """
+        :param attributes: Attributes of a track element
+        """
+        attrib: dict[str, Any] = attributes.copy()
         attrib.setdefault('permanently_downloaded', False)
         attrib.setdefault('metadata_status', MetadataStatus.NEW)
         attrib.setdefault('occurrence_index', 1)
@@ -557,7 +1112,7 @@ class CollectionUrl(XmlObject):
         attrs.pop('collection_url')
         attrs['permanently_downloaded'] = str(attrs['permanently_downloaded'])
         attrs['occurrence_index'] = str(attrs['occurrence_index'])
-        if attrs['playlist_index'] is None:
+        if attrs['playlist_index'] is None or pd.isna(attrs['playlist_index']):
             attrs.pop('playlist_index')
         else:
             attrs['playlist_index'] = str(attrs['playlist_index'])
@@ -568,11 +1123,11 @@ class CollectionUrl(XmlObject):
         return hash(id(self))
 
     def __eq__(self, other: 'CollectionUrl'):
-        attrs = vars(self).copy()
-        attrs.pop('tracks')
+        attrs = self.public_attributes()
+        attrs.pop('tracks', None)
 
-        other_attrs = vars(other).copy()
-        other_attrs.pop('tracks')
+        other_attrs = other.public_attributes()
+        other_attrs.pop('tracks', None)
 
         return attrs == other_attrs and (self.tracks.drop(columns=['collection_url']) == other.tracks.drop(columns=['collection_url'])).all(axis=None)
 
@@ -0,0 +1,117 @@
+import random
+import threading
+from concurrent.futures import Future
+from typing import Callable, ClassVar
+
+from .utils import Logger
+
+
+class RetryQueue:
+    """
+    Retries failed tasks in the background. A task is started with ``submit``; if it fails with an error that
+    ``is_retryable`` accepts, it's put aside and started again after an exponential backoff with full jitter (a random
+    delay between 0 and ``base_delay * 2 ** (attempt - 1)``, at most ``max_delay`` seconds). Other tasks aren't blocked
+    in the meantime, and the future returned by ``submit`` only fails once ``max_attempts`` attempts have failed.
+    """
+    DEFAULT_MAX_ATTEMPTS: ClassVar[int] = 4
+    DEFAULT_BASE_DELAY: ClassVar[float] = 2.0
+    DEFAULT_MAX_DELAY: ClassVar[float] = 60.0
+
+    logger = Logger(prefix='retry')
+
+    def __init__(self, is_retryable: Callable[[BaseException], bool] = lambda e: isinstance(e, Exception),
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        :param is_retryable: Whether a task that failed with the given error should be tried again
+        :param max_attempts: Maximum number of attempts per task, including the first one
+        """
+        self.is_retryable = is_retryable
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._attempts: dict[Future, int] = {}
+        self._timers: dict[Future, threading.Timer] = {}
+        self._closed = False
+
+    def delay(self, attempt: int) -> float:
+        """
+        :return: The number of seconds to wait before starting the task again after its ``attempt``-th attempt failed
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def submit(self, start: Callable[[], Future], description: str = '') -> Future:
+        """
+        Starts a task by calling ``start``, which has to submit one attempt of the task (e.g. to an executor) and return
+        its future. ``start`` is called again for every retry.
+
+        :param description: Describes the task in log messages
+        :return: Future resolving to the result of the first successful attempt, or to the error of the last attempt
+        """
+        result = Future()
+        with self._lock:
+            self._attempts[result] = 0
+        self._start(result, start, description)
+        return result
+
+    def attempts(self, future: Future) -> int:
+        """
+        :return: The number of attempts that have been started for a future returned by ``submit``
+        """
+        return self._attempts.get(future, 0)
+
+    def _start(self, result: Future, start: Callable[[], Future], description: str):
+        with self._lock:
+            self._timers.pop(result, None)
+            if self._closed:
+                result.cancel()
+                return
+            self._attempts[result] += 1
+
+        try:
+            future = start()
+        except RuntimeError:
+            # the executor has been shut down
+            result.cancel()
+            return
+
+        future.add_done_callback(lambda f: self._finished(result, start, description, f))
+
+    def _finished(self, result: Future, start: Callable[[], Future], description: str, future: Future):
+        if future.cancelled():
+            result.cancel()
+            return
+
+        error = future.exception()
+        if error is None:
+            result.set_result(future.result())
+            return
+
+        with self._lock:
+            attempt = self._attempts[result]
+            if not self._closed and attempt < self.max_attempts and self.is_retryable(error):
+                delay = self.delay(attempt)
+                self.logger.warning(f'{description or "Task"} failed ({error}), retrying in {delay:.1f} s '
+                                    f'[attempt {attempt}/{self.max_attempts}]')
+                timer = threading.Timer(delay, self._start, (result, start, description))
+                timer.daemon = True
+                self._timers[result] = timer
+                timer.start()
+                return
+
+        result.set_exception(error)
+
+    def close(self):
+        """
+        Cancels all retries that are waiting for their delay and doesn't retry any failures anymore.
+        """
+        with self._lock:
+            self._closed = True
+            timers = list(self._timers.items())
+            self._timers.clear()
+
+        for result, timer in timers:
+            timer.cancel()
+            result.cancel()
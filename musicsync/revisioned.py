@@ -0,0 +1,91 @@
+from typing import Any, ClassVar
+
+import pandas as pd
+
+_MISSING = object()
+
+
+class Revisioned:
+    """
+    Counts the changes of an object in ``revision``. Assigning a different value to a public attribute counts as a
+    change; in-place changes (e.g. of a dataframe) have to call ``touch``. Every change is passed on to the
+    ``revision_parent``, which is set when the object is assigned to a list attribute of another ``Revisioned`` object
+    (e.g. to ``Collection.urls``) or with ``adopt``. This way, the root (the library) knows whether anything has
+    changed since it was saved in O(1).
+
+    The revision state is kept in private attributes, which aren't part of the saved object.
+    """
+    # attributes whose changes don't count, e.g. because they aren't saved
+    UNTRACKED_ATTRIBUTES: ClassVar[tuple[str, ...]] = ()
+
+    _revision = 0
+    _saved_revision = 0
+    _revision_parent: 'Revisioned | None' = None
+
+    def __setattr__(self, name: str, value: Any):
+        if name.startswith('_') or name in self.UNTRACKED_ATTRIBUTES:
+            object.__setattr__(self, name, value)
+            return
+
+        changed = not self._same_value(getattr(self, name, _MISSING), value)
+        object.__setattr__(self, name, value)
+
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, Revisioned):
+                    self.adopt(item)
+        if changed:
+            self.touch()
+
+    @staticmethod
+    def _same_value(old: Any, new: Any) -> bool:
+        """
+        Compares cheaply: dataframes are always different unless they are the same object, and ``Revisioned``
+        objects in lists are compared by identity.
+        """
+        if old is new:
+            return True
+        if old is _MISSING or isinstance(old, pd.DataFrame) or isinstance(new, pd.DataFrame):
+            return False
+        if isinstance(old, list) and isinstance(new, list):
+            return len(old) == len(new) and all(
+                a is b or (not isinstance(a, Revisioned) and not isinstance(b, Revisioned) and a == b)
+                for a, b in zip(old, new))
+
+        try:
+            return bool(old == new)
+        except (TypeError, ValueError):
+            return False
+
+    @property
+    def revision(self) -> int:
+        return self._revision
+
+    def touch(self):
+        """
+        Counts a change of this object (and of all its ``revision_parent``\\ s).
+        """
+        self._revision += 1
+        if self._revision_parent is not None:
+            self._revision_parent.touch()
+
+    def adopt(self, child: 'Revisioned'):
+        """
+        Makes this object the ``revision_parent`` of ``child``.
+        """
+        child._revision_parent = self
+
+    def public_attributes(self) -> dict[str, Any]:
+        """
+        :return: A copy of ``vars(self)`` without the private attributes, i.e. without the revision state
+        """
+        return {name: value for name, value in vars(self).items() if not name.startswith('_')}
+
+    def has_changed(self) -> bool:
+        """
+        :return: Whether the object has changed since the last call of ``mark_saved``
+        """
+        return self._revision != self._saved_revision
+
+    def mark_saved(self):
+        self._saved_revision = self._revision
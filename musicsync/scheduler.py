@@ -0,0 +1,198 @@
+import copy
+import threading
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, ClassVar
+
+import pandas as pd
+
+import musicsync.downloader as dl
+import musicsync.music_sync_library as lib
+from .extraction_cache import ExtractionCache
+from .utils import Logger, url_domain
+
+
+class CompareScheduler:
+    """
+    Compares several collections at once. The infos of the collection urls of all collections are downloaded by one
+    shared thread pool, whose number of concurrent extractions is limited globally and per domain. That way, every site
+    is queried in parallel to the others, but no site gets more than its limit of concurrent requests.
+
+    Collection urls with the same URL (e.g. a playlist that is part of several collections) are only extracted once for
+    all collections with the same yt-dlp options, which can change the extracted info (e.g. cookies or extractor
+    arguments). All of them are subscribed to the single extraction, and every collection classifies its own copy of the result.
+    Like ``MusicSyncDownloader.compare``, cached infos are only reused if they are younger than
+    ``MusicSyncDownloader.COMPARE_MAX_AGE``.
+    Every worker thread uses one downloader for the extractions of all collections with the same yt-dlp options (see
+    ``MusicSyncDownloader.extraction_worker``).
+    """
+    DEFAULT_MAX_WORKERS: ClassVar[int] = 16
+    DEFAULT_MAX_PER_DOMAIN: ClassVar[int] = 4
+
+    def __init__(self, collections: list['lib.Collection'], max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_per_domain: int = DEFAULT_MAX_PER_DOMAIN, domain_limits: dict[str, int] | None = None,
+                 extraction_cache: ExtractionCache | None = None):
+        """
+        :param max_workers: Maximum number of concurrent extractions over all domains
+        :param max_per_domain: Maximum number of concurrent extractions per domain
+        :param domain_limits: Overrides ``max_per_domain`` for single domains (see ``url_domain``), e.g.
+            ``{'youtube.com': 2, 'music.youtube.com': 2}``
+        """
+        self.collections = collections
+        self.max_workers = max(1, max_workers)
+        self.max_per_domain = max(1, max_per_domain)
+        self.domain_limits = domain_limits or {}
+        self.extraction_cache = extraction_cache if extraction_cache is not None else ExtractionCache()
+        self.extraction_workers = threading.local()
+        self.logger = Logger(prefix='compare')
+
+    def domain_limit(self, domain: str) -> int:
+        return max(1, self.domain_limits.get(domain, self.max_per_domain))
+
+    def compare(self, delete_files: bool = False, force_refresh: bool = False, progress_callback: Callable[[float, str], None] | None = None,
+                interruption_callback: Callable[[], bool] | None = None,
+                chunk_callback: Callable[['lib.Collection', pd.DataFrame], None] | None = None) -> list[pd.DataFrame | Exception]:
+        """
+        Compares all collections like ``MusicSyncDownloader.compare``. Every collection gets its own downloader (stored in
+        ``Collection.downloader``), so that the collections can be synced afterwards.
+
+        :param force_refresh: If true, the infos of all collection urls are downloaded again, even if they are cached
+        :param chunk_callback: Called with the collection and the status dataframe of every collection url as soon as it
+            is available
+        :return: The compare result of every collection, in the order of ``collections``. If comparing a collection
+            failed, its result is the raised exception.
+        """
+        logger = self.logger
+        results: list[pd.DataFrame | Exception | None] = [None] * len(self.collections)
+        collection_urls: list[list[lib.CollectionUrl]] = [[] for _ in self.collections]
+        status_dfs: list[dict[int, pd.DataFrame]] = [{} for _ in self.collections]
+
+        # queue of (URL, yt-dlp options) keys per domain, every key is extracted once for all its subscribed
+        # (collection index, collection url index) pairs
+        pending: dict[str, deque[tuple[str, str]]] = {}
+        subscribers: dict[tuple[str, str], list[tuple[int, int]]] = {}
+
+        for c, collection in enumerate(self.collections):
+            if interruption_callback is not None and interruption_callback():
+                raise InterruptedError
+
+            downloader = collection.downloader = dl.MusicSyncDownloader(collection, extraction_cache=self.extraction_cache,
+                                                                        extraction_workers=self.extraction_workers)
+            try:
+                downloader.prepare_compare(delete_files=delete_files, interruption_callback=interruption_callback)
+            except InterruptedError:
+                raise
+            except Exception as e:
+                logger.error(f'Could not prepare collection "{collection.name}": {e}')
+                results[c] = e
+                continue
+
+            collection_urls[c] = downloader.urls_to_compare()
+            if not collection_urls[c]:
+                results[c] = pd.DataFrame()
+
+            for i, collection_url in enumerate(collection_urls[c]):
+                key = collection_url.url, collection.yt_dlp_options.strip()
+                if key not in subscribers:
+                    subscribers[key] = []
+                    pending.setdefault(url_domain(collection_url.url), deque()).append(key)
+                subscribers[key].append((c, i))
+
+        total = sum(len(subscribed) for subscribed in subscribers.values())
+        if progress_callback is not None:
+            progress_callback(0, f'Downloading info for {total} URLs ({len(subscribers)} unique) of '
+                                 f'{len(self.collections)} collections')
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='compare')
+        running: dict[Future, tuple[tuple[str, str], str]] = {}
+        running_per_domain: Counter[str] = Counter()
+        done = 0
+
+        try:
+            while pending or running:
+                if interruption_callback is not None and interruption_callback():
+                    # the callback only works in this thread, the running extractions stop at their next check of the
+                    # interruption event
+                    for collection in self.collections:
+                        if collection.downloader is not None:
+                            collection.downloader.params['logger'].interrupted.set()
+                    raise InterruptedError
+
+                # start with the domains that have the most urls left, as they take the longest
+                for domain in sorted(pending, key=lambda d: len(pending[d]), reverse=True):
+                    queue = pending[domain]
+                    while (queue and len(running) < self.max_workers
+                           and running_per_domain[domain] < self.domain_limit(domain)):
+                        key = queue.popleft()
+                        # collections which have already failed don't need the info anymore
+                        subscribed = [(c, i) for c, i in subscribers[key] if results[c] is None]
+                        done += len(subscribers[key]) - len(subscribed)
+                        subscribers[key] = subscribed
+                        if not subscribed:
+                            continue
+
+                        c, i = subscribers[key][0]
+                        future = executor.submit(self.collections[c].downloader.extract_flat_info, collection_urls[c][i],
+                                                 refresh=force_refresh, max_age=dl.MusicSyncDownloader.COMPARE_MAX_AGE)
+                        running[future] = key, domain
+                        running_per_domain[domain] += 1
+
+                    if not queue:
+                        del pending[domain]
+
+                if not running:
+                    continue
+
+                finished, _ = wait(running, timeout=dl.DownloadLogger.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key, domain = running.pop(future)
+                    running_per_domain[domain] -= 1
+
+                    try:
+                        info = future.result()
+                    except InterruptedError:
+                        raise
+                    except Exception as e:
+                        info = e
+
+                    for n, (c, i) in enumerate(subscribers.pop(key)):
+                        done += 1
+                        collection = self.collections[c]
+                        collection_url = collection_urls[c][i]
+
+                        if progress_callback is not None:
+                            if collection_url.name:
+                                progress_text = f'"{collection_url.name}" ({collection_url.url})'
+                            else:
+                                progress_text = f'{collection_url.url}'
+                            progress_callback(done / total, f'Downloaded info for {progress_text} of collection '
+                                                             f'"{collection.name}" [{done}/{total}]')
+
+                        if results[c] is not None:
+                            continue
+
+                        try:
+                            if isinstance(info, Exception):
+                                raise info
+                            # the info is changed during sync, so every subscriber needs its own copy
+                            status_df = collection.downloader.compare_url(collection_url,
+                                                                          info if n == 0 else copy.deepcopy(info))
+                        except InterruptedError:
+                            raise
+                        except Exception as e:
+                            logger.error(f'Could not compare collection "{collection.name}": {e}')
+                            results[c] = e
+                            continue
+
+                        if chunk_callback is not None:
+                            chunk_callback(collection, status_df)
+
+                        status_dfs[c][i] = status_df
+                        if len(status_dfs[c]) == len(collection_urls[c]):
+                            results[c] = pd.concat([status_dfs[c][j] for j in range(len(collection_urls[c]))],
+                                                   ignore_index=True)
+                            status_dfs[c] = {}
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        return results
@@ -0,0 +1,134 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import ClassVar
+
+from .utils import link_file, user_cache_dir
+
+
+class SourceMediaCache:
+    """
+    Cache of the original (not transcoded) downloads of videos, so that the output files of a collection can be derived
+    again with ffmpeg when its output profile changes, instead of downloading everything again. Files are identified by
+    extractor key and video id and stored in a directory, indexed by an SQLite database. The least recently used files
+    are evicted as soon as all files together take up more than ``max_size`` bytes.
+    """
+    DEFAULT_MAX_SIZE: ClassVar[int] = 16 * 1024 * 1024 * 1024
+
+    def __init__(self, directory: str | None = None, max_size: int = DEFAULT_MAX_SIZE):
+        if directory is None:
+            directory = os.path.join(user_cache_dir(), 'source_media')
+
+        self.directory = directory
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=30)
+        if not self._initialized:
+            connection.execute('CREATE TABLE IF NOT EXISTS media (extractor TEXT NOT NULL, id TEXT NOT NULL, '
+                               'url TEXT NOT NULL, filename TEXT NOT NULL, size INTEGER NOT NULL, '
+                               'accessed REAL NOT NULL, PRIMARY KEY (extractor, id))')
+            connection.execute('CREATE INDEX IF NOT EXISTS media_url ON media (url)')
+            connection.commit()
+            self._initialized = True
+        return connection
+
+    @staticmethod
+    def key(info: dict) -> tuple[str, str] | None:
+        """
+        :return: The (extractor key, video id) of a (flat or processed) info dict, or None if it doesn't contain both
+        """
+        extractor = info.get('extractor_key') or info.get('ie_key')
+        video_id = info.get('id')
+        if not extractor or not video_id:
+            return None
+        return extractor, str(video_id)
+
+    def _get(self, connection: sqlite3.Connection, row: tuple | None) -> str | None:
+        if row is None:
+            return None
+
+        extractor, video_id, filename = row
+        path = os.path.join(self.directory, filename)
+        if not os.path.isfile(path):
+            connection.execute('DELETE FROM media WHERE extractor = ? AND id = ?', (extractor, video_id))
+            connection.commit()
+            return None
+
+        connection.execute('UPDATE media SET accessed = ? WHERE extractor = ? AND id = ?',
+                           (time.time(), extractor, video_id))
+        connection.commit()
+        return path
+
+    def get(self, extractor: str, video_id: str) -> str | None:
+        """
+        :return: The path of the cached file or None if the video isn't cached
+        """
+        with self._lock, closing(self._connect()) as connection:
+            row = connection.execute('SELECT extractor, id, filename FROM media WHERE extractor = ? AND id = ?',
+                                     (extractor, video_id)).fetchone()
+            return self._get(connection, row)
+
+    def get_by_url(self, url: str) -> str | None:
+        """
+        :return: The path of the cached file of the video that was downloaded from the URL, or None if it isn't cached
+        """
+        with self._lock, closing(self._connect()) as connection:
+            row = connection.execute('SELECT extractor, id, filename FROM media WHERE url = ? ORDER BY accessed DESC',
+                                     (url,)).fetchone()
+            return self._get(connection, row)
+
+    def put(self, extractor: str, video_id: str, url: str, path: str, hardlink: bool = True) -> str:
+        """
+        Adds the file at ``path`` to the cache. The file is linked if possible (see ``link_file``), so it can be deleted
+        or transcoded afterwards.
+
+        :param hardlink: Must be false if the file at ``path`` is kept and might be changed, as the cached file would
+            change with it
+        :return: The path of the cached file
+        """
+        filename = re.sub(r'[^\w.-]', '_', f'{extractor}-{video_id}') + os.path.splitext(path)[1]
+        cached_path = os.path.join(self.directory, filename)
+
+        with self._lock, closing(self._connect()) as connection:
+            if os.path.exists(cached_path):
+                os.remove(cached_path)
+            link_file(path, cached_path, hardlink=hardlink)
+
+            connection.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)',
+                               (extractor, video_id, url, filename, os.path.getsize(cached_path), time.time()))
+            self._evict(connection)
+            connection.commit()
+
+        return cached_path
+
+    def clear(self):
+        with self._lock, closing(self._connect()) as connection:
+            for (filename,) in connection.execute('SELECT filename FROM media').fetchall():
+                path = os.path.join(self.directory, filename)
+                if os.path.isfile(path):
+                    os.remove(path)
+            connection.execute('DELETE FROM media')
+            connection.commit()
+
+    def _evict(self, connection: sqlite3.Connection):
+        size = 0
+        evicted = []
+        for extractor, video_id, filename, file_size in connection.execute(
+                'SELECT extractor, id, filename, size FROM media ORDER BY accessed DESC'):
+            size += file_size
+            if size > self.max_size:
+                evicted.append((extractor, video_id))
+                path = os.path.join(self.directory, filename)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+        connection.executemany('DELETE FROM media WHERE extractor = ? AND id = ?', evicted)
@@ -0,0 +1,292 @@
+import json
+import os
+import threading
+import uuid
+from typing import Any, ClassVar
+
+import pandas as pd
+
+import musicsync.music_sync_library as lib
+from .sync_plan import SyncPlan
+from .utils import occurrence_index
+
+
+class SyncJournal:
+    """
+    Append-only journal of the changes ``sync`` makes to the tracks of a library, stored as JSON lines next to the
+    library file. Every sync writes
+
+    - a ``plan`` record with all actions it is going to perform,
+    - a ``done`` record for every action as soon as it has been performed (including the changed track fields) and
+    - an ``end`` record when it has finished.
+
+    When the library is loaded, the ``done`` records are replayed into the tracks, so that no change is lost if the
+    program crashes before the library is saved. Syncs without an ``end`` record have been interrupted and can be
+    resumed with their remaining actions. Once the library is saved, only the records of interrupted syncs are kept,
+    and their ``done`` records are marked as applied, so that they aren't replayed on top of the saved library.
+
+    Collections are identified by their name and its occurrence index in the library (like in ``LibraryStore``),
+    collection urls by their URL and its occurrence index in the collection.
+    """
+
+    # every journal file has one lock, as the downloaders and the library use their own instances
+    _locks: ClassVar[dict[str, threading.Lock]] = {}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = self._locks.setdefault(os.path.abspath(path), threading.Lock())
+        # collection key and url keys of the collection of every running sync
+        self._collection_keys: dict[str, tuple[str, int]] = {}
+        self._url_keys: dict[str, dict[lib.CollectionUrl, tuple[str, int]]] = {}
+
+    @classmethod
+    def for_library(cls, library_path: str) -> 'SyncJournal':
+        if library_path.endswith('.xml') or library_path.endswith('.pkl'):
+            library_path = library_path[:-4]
+        elif library_path.endswith('.sqlite'):
+            library_path = library_path[:-7]
+        return cls(library_path + '.journal')
+
+    def read(self) -> list[dict[str, Any]]:
+        if not os.path.isfile(self.path):
+            return []
+
+        with open(self.path, 'rb') as f:
+            return self.parse(f.read())
+
+    @staticmethod
+    def parse(data: bytes) -> list[dict[str, Any]]:
+        records = []
+        for line in data.splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line is incomplete if the program crashed while writing it
+                continue
+        return records
+
+    def size(self) -> int:
+        """
+        :return: The size of the journal file in bytes, see ``compact``
+        """
+        return os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+    def append(self, record: dict[str, Any]):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def url_keys(collection: 'lib.Collection') -> dict['lib.CollectionUrl', tuple[str, int]]:
+        """
+        :return: Mapping from the collection urls of the collection to their (URL, occurrence index) keys
+        """
+        occurrences = occurrence_index(collection_url.url for collection_url in collection.urls).tolist()
+        return {collection_url: (collection_url.url, occurrence)
+                for collection_url, occurrence in zip(collection.urls, occurrences)}
+
+    @staticmethod
+    def collection_key(collection: 'lib.Collection') -> tuple[str, int]:
+        """
+        :return: The (name, occurrence index) key of the collection in its library
+        """
+        occurrence = 0
+        if collection.library is not None:
+            for other in collection.library.iter_collections():
+                if other.name == collection.name:
+                    occurrence += 1
+                if other is collection:
+                    return collection.name, occurrence
+        return collection.name, 1
+
+    @staticmethod
+    def record_collection_key(record: dict[str, Any]) -> tuple[str, int]:
+        key = record['collection']
+        # older journals only contain the name of the collection
+        return (key, 1) if isinstance(key, str) else (key[0], key[1])
+
+    def begin(self, collection: 'lib.Collection', plan: SyncPlan) -> str:
+        """
+        Writes the plan of a sync, i.e. all its actions that change something.
+
+        :return: The id of the sync
+        """
+        sync_id = uuid.uuid4().hex
+        collection_key = self._collection_keys[sync_id] = self.collection_key(collection)
+        url_keys = self._url_keys[sync_id] = self.url_keys(collection)
+
+        actions = [{
+            'collection_url': url_keys[track.collection_url],
+            'url': track.url,
+            'occurrence_index': track.occurrence_index,
+            'playlist_index': track.playlist_index,
+            'filename': track.filename,
+            'action': track.action,
+        } for track in plan.changes()]
+
+        self.append({'type': 'plan', 'sync': sync_id, 'collection': collection_key, 'actions': actions})
+        return sync_id
+
+    def record(self, sync_id: str, collection: 'lib.Collection', collection_url: 'lib.CollectionUrl', url: str,
+               occurrence: int, action: 'lib.TrackSyncAction', adds_track: bool = False, **changes):
+        """
+        Writes that an action has been performed.
+
+        :param adds_track: Whether the action has added the track to the collection url. Replaying only adds tracks
+            that have been added by their action, so that tracks which have been removed in the meantime don't come back.
+        :param changes: The changed track fields. They are applied with ``CollectionUrl.update_track`` when replaying.
+        """
+        if 'playlist_index' in changes:
+            changes['playlist_index'] = SyncPlan.to_playlist_index(changes['playlist_index'])
+
+        self.append({'type': 'done', 'sync': sync_id, 'collection': self._collection_keys[sync_id],
+                     'collection_url': self._url_keys[sync_id][collection_url], 'url': url,
+                     'occurrence_index': int(occurrence), 'action': action, 'adds_track': adds_track,
+                     'changes': changes})
+
+    def end(self, sync_id: str):
+        self.append({'type': 'end', 'sync': sync_id})
+        self._collection_keys.pop(sync_id, None)
+        self._url_keys.pop(sync_id, None)
+
+    @staticmethod
+    def find_collection_url(library: 'lib.MusicSyncLibrary', collection_key: tuple[str, int],
+                            key: list | tuple) -> tuple['lib.Collection | None', 'lib.CollectionUrl | None']:
+        name, occurrence = collection_key
+        for collection in library.iter_collections():
+            if collection.name != name:
+                continue
+            occurrence -= 1
+            if occurrence > 0:
+                continue
+            for collection_url, url_key in SyncJournal.url_keys(collection).items():
+                if url_key == tuple(key):
+                    return collection, collection_url
+            return collection, None
+        return None, None
+
+    def replay(self, library: 'lib.MusicSyncLibrary') -> int:
+        """
+        Applies the changes of all ``done`` records that haven't been saved yet to the tracks of the library.
+
+        :return: The number of applied records
+        """
+        applied = 0
+        for record in self.read():
+            if record['type'] != 'done' or record.get('applied'):
+                continue
+
+            _, collection_url = self.find_collection_url(library, self.record_collection_key(record),
+                                                         record['collection_url'])
+            if collection_url is None:
+                continue
+
+            action = lib.TrackSyncAction(record['action'])
+            url, occurrence = record['url'], record['occurrence_index']
+            filter_df = pd.DataFrame({'collection_url': [collection_url], 'url': [url], 'occurrence_index': [occurrence]})
+
+            if action == lib.TrackSyncAction.DELETE:
+                collection_url.remove_tracks(filter_df)
+            elif not record.get('adds_track') and not collection_url.has_track(url, occurrence):
+                # the track has been removed after the action
+                continue
+            elif 'status' in record['changes']:
+                collection_url.broadcast_update_tracks(filter_df,
+                                                       status=lib.TrackSyncStatus(record['changes']['status']))
+            else:
+                changes = record['changes'].copy()
+                if 'metadata_status' in changes:
+                    changes['metadata_status'] = lib.MetadataStatus(changes['metadata_status'])
+                collection_url.update_track(url, occurrence, **changes)
+
+            applied += 1
+        return applied
+
+    def unfinished(self, collection: 'lib.Collection') -> dict[str, list[dict[str, Any]]]:
+        """
+        :return: The remaining actions of every interrupted sync of the collection, by sync id
+        """
+        collection_key = self.collection_key(collection)
+        plans: dict[str, list[dict[str, Any]]] = {}
+        done: dict[str, set[tuple]] = {}
+        for record in self.read():
+            if record['type'] == 'plan' and self.record_collection_key(record) == collection_key:
+                plans[record['sync']] = record['actions']
+                done[record['sync']] = set()
+            elif record['type'] == 'done' and record['sync'] in done:
+                done[record['sync']].add((tuple(record['collection_url']), record['url'], record['occurrence_index']))
+            elif record['type'] == 'end':
+                plans.pop(record['sync'], None)
+
+        return {sync_id: [action for action in actions
+                          if (tuple(action['collection_url']), action['url'], action['occurrence_index'])
+                          not in done[sync_id]]
+                for sync_id, actions in plans.items()}
+
+    def remaining_actions(self, collection: 'lib.Collection') -> tuple[list[str], pd.DataFrame]:
+        """
+        :return: The ids of the interrupted syncs of the collection and an info dataframe (see ``sync``) containing
+            their remaining actions. Actions of collection urls that don't exist anymore are dropped.
+        """
+        url_objects = {key: collection_url for collection_url, key in self.url_keys(collection).items()}
+        unfinished = self.unfinished(collection)
+
+        rows = {}
+        for actions in unfinished.values():
+            for action in actions:
+                collection_url = url_objects.get(tuple(action['collection_url']))
+                if collection_url is None:
+                    continue
+                rows[(collection_url, action['url'], action['occurrence_index'])] = {
+                    'collection_url': collection_url,
+                    'url': action['url'],
+                    'occurrence_index': action['occurrence_index'],
+                    'playlist_index': action['playlist_index'],
+                    'filename': action['filename'],
+                    'action': lib.TrackSyncAction(action['action']),
+                }
+
+        return list(unfinished), pd.DataFrame(list(rows.values()),
+                                              columns=['collection_url', 'url', 'occurrence_index', 'playlist_index',
+                                                       'filename', 'action'])
+
+    def compact(self, saved_size: int | None = None):
+        """
+        Called after the library has been saved, as the changes of the records are part of the library file now.
+        Removes all records of finished syncs. The ``plan`` and ``done`` records of interrupted syncs are kept, so that
+        they can be resumed, but their ``done`` records are marked as applied and aren't replayed anymore.
+
+        :param saved_size: Size of the journal (see ``size``) when the library was saved. Records that have been written
+            after that are kept unchanged. Defaults to all records.
+        """
+        with self._lock:
+            if not os.path.isfile(self.path):
+                return
+            with open(self.path, 'rb') as f:
+                data = f.read()
+
+            # a record that was being written when the library was saved belongs to the unsaved records
+            saved_size = len(data) if saved_size is None else data.rfind(b'\n', 0, saved_size) + 1
+            saved = self.parse(data[:saved_size])
+            unsaved = self.parse(data[saved_size:])
+            finished = {record['sync'] for record in saved + unsaved if record['type'] == 'end'}
+
+            kept = []
+            for record in saved:
+                if record['sync'] in finished:
+                    continue
+                if record['type'] == 'done':
+                    record = {**record, 'changes': {}, 'applied': True}
+                kept.append(record)
+            kept += unsaved
+
+            if not kept:
+                os.remove(self.path)
+                return
+
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for record in kept:
+                    f.write(json.dumps(record) + '\n')
+            os.replace(temp_path, self.path)
@@ -0,0 +1,169 @@
+import os
+from dataclasses import dataclass
+from typing import Any
+
+import pandas as pd
+
+import musicsync.music_sync_library as lib
+from .utils import classproperty
+
+
+@dataclass
+class PlannedTrack:
+    """
+    A single action of a ``SyncPlan``.
+    """
+    collection_url: 'lib.CollectionUrl'
+    url: str
+    occurrence_index: int
+    action: 'lib.TrackSyncAction'
+    status: 'lib.TrackSyncStatus | None' = None
+    title: str = ''
+    # playlist index of the video in the source, or None if the collection url is not a playlist
+    playlist_index: int | None = None
+    filename: str = ''
+    # full path of the file of the track, or '' if the track has no file
+    path: str = ''
+    # label of the track in ``collection_url.tracks`` when the plan was compiled, or None if there is no such track
+    track_label: Any = None
+
+
+class SyncPlan:
+    """
+    The actions of an info dataframe (see ``MusicSyncDownloader.sync``), compiled once before syncing. Actions are
+    grouped per collection url and can be looked up by (URL, occurrence index) and by playlist index, so that syncing
+    doesn't need to filter the info dataframe again for every action and collection url.
+    """
+    @classproperty
+    def PASSIVE_ACTIONS(self) -> tuple['lib.TrackSyncAction', ...]:
+        # actions that don't change anything
+        return lib.TrackSyncAction.DO_NOTHING, lib.TrackSyncAction.DECIDE_INDIVIDUALLY
+
+    def __init__(self, collection: 'lib.Collection', tracks: list[PlannedTrack]):
+        self.collection = collection
+        self.tracks = tracks
+
+        self.by_collection_url: dict[lib.CollectionUrl, dict[lib.TrackSyncAction, list[PlannedTrack]]] = {}
+        self.by_key: dict[tuple[lib.CollectionUrl, str, int], PlannedTrack] = {}
+        self.by_playlist_index: dict[tuple[lib.CollectionUrl, int], PlannedTrack] = {}
+
+        for track in tracks:
+            self.by_collection_url.setdefault(track.collection_url, {}).setdefault(track.action, []).append(track)
+            self.by_key[(track.collection_url, track.url, track.occurrence_index)] = track
+            if track.playlist_index is not None:
+                self.by_playlist_index[(track.collection_url, track.playlist_index)] = track
+
+    @classmethod
+    def compile(cls, collection: 'lib.Collection', info_df: pd.DataFrame) -> 'SyncPlan':
+        """
+        :param info_df: Has to contain the columns ``collection_url``, ``url``, ``occurrence_index`` and ``action``.
+            ``status``, ``title``, ``playlist_index`` and ``filename`` are used if present.
+        """
+        track_labels: dict[lib.CollectionUrl, dict[tuple[str, int], Any]] = {}
+        folders: dict[lib.CollectionUrl, str] = {}
+        tracks = []
+
+        for row in info_df.itertuples(index=False):
+            collection_url = row.collection_url
+            occurrence = int(row.occurrence_index)
+
+            if collection_url not in track_labels:
+                track_labels[collection_url] = cls.index_tracks(collection_url.tracks)
+                folders[collection_url] = collection.get_real_path(collection_url)
+
+            label = track_labels[collection_url].get((row.url, occurrence))
+            # the filename of the existing track takes precedence, as it's the one that will be deleted or kept
+            filename = collection_url.tracks.at[label, 'filename'] if label is not None else getattr(row, 'filename', '')
+            filename = filename if isinstance(filename, str) else ''
+            title = getattr(row, 'title', '')
+            status = getattr(row, 'status', None)
+
+            tracks.append(PlannedTrack(
+                collection_url=collection_url,
+                url=row.url,
+                occurrence_index=occurrence,
+                action=row.action,
+                status=status if isinstance(status, lib.TrackSyncStatus) else None,
+                title=title if isinstance(title, str) else '',
+                playlist_index=cls.to_playlist_index(getattr(row, 'playlist_index', None)),
+                filename=filename,
+                path=os.path.join(folders[collection_url], filename) if filename else '',
+                track_label=label,
+            ))
+
+        return cls(collection, tracks)
+
+    @staticmethod
+    def index_tracks(tracks: pd.DataFrame) -> dict[tuple[str, int], Any]:
+        """
+        :return: Mapping from (URL, occurrence index) to the label of the first matching track
+        """
+        if tracks.empty:
+            return {}
+
+        index = {}
+        for label, url, occurrence in zip(tracks.index, tracks['url'], tracks['occurrence_index']):
+            index.setdefault((url, int(occurrence)), label)
+        return index
+
+    @staticmethod
+    def to_playlist_index(value) -> int | None:
+        return None if value is None or pd.isna(value) or value == '' else int(value)
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def get(self, collection_url: 'lib.CollectionUrl', url: str, occurrence: int) -> PlannedTrack | None:
+        return self.by_key.get((collection_url, url, occurrence))
+
+    def at_playlist_index(self, collection_url: 'lib.CollectionUrl', playlist_index: int) -> PlannedTrack | None:
+        return self.by_playlist_index.get((collection_url, playlist_index))
+
+    def collection_urls(self, *actions: 'lib.TrackSyncAction') -> list['lib.CollectionUrl']:
+        """
+        :return: The collection urls that have at least one of the given actions, in order of appearance
+        """
+        return [collection_url for collection_url, tracks in self.by_collection_url.items()
+                if any(action in tracks for action in actions)]
+
+    def of(self, collection_url: 'lib.CollectionUrl', *actions: 'lib.TrackSyncAction') -> list[PlannedTrack]:
+        """
+        :return: The tracks of the collection url with one of the given actions, grouped by action
+        """
+        tracks = self.by_collection_url.get(collection_url, {})
+        return [track for action in actions for track in tracks.get(action, [])]
+
+    def count(self, *actions: 'lib.TrackSyncAction') -> int:
+        return sum(len(tracks.get(action, [])) for tracks in self.by_collection_url.values() for action in actions)
+
+    def changes(self) -> list[PlannedTrack]:
+        """
+        :return: All tracks whose action changes something
+        """
+        return [track for track in self.tracks if track.action not in self.PASSIVE_ACTIONS]
+
+    def summary(self) -> str:
+        """
+        :return: A human-readable description of everything a sync of this plan would do, for dry runs
+        """
+        lines = [f'Sync plan for collection "{self.collection.name}": {len(self.changes())} of {len(self)} tracks '
+                 f'will be changed']
+
+        for action in lib.TrackSyncAction:
+            if action in self.PASSIVE_ACTIONS or self.count(action) == 0:
+                continue
+
+            lines.append(f'{action.name}: {self.count(action)} tracks')
+            for collection_url in self.collection_urls(action):
+                lines.append(f'  {collection_url.name or collection_url.url}')
+                for track in self.of(collection_url, action):
+                    description = f'"{track.title}" ({track.url})' if track.title else track.url
+                    if track.path:
+                        description += f' -> {track.path}'
+                    lines.append(f'    {description}')
+
+        for action in self.PASSIVE_ACTIONS:
+            if self.count(action) > 0:
+                lines.append(f'{action.name}: {self.count(action)} tracks (skipped)')
+
+        return '\n'.join(lines)
@@ -1,8 +1,22 @@
 import logging
+import os
+import shutil
 from enum import StrEnum
+from typing import Iterable
+from urllib.parse import urlparse
+
+import pandas as pd
 import yt_dlp
 import yt_dlp.options
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request to clone a file on copy-on-write filesystems (btrfs, xfs, ...), from linux/fs.h
+FICLONE = 0x40049409
+
 
 class classproperty:
     def __init__(self, func):
@@ -32,6 +46,25 @@ class GuiStrEnum(StrEnum):
     def gui_status_tip(self) -> str:
         return self._gui_status_tip
 
+def occurrence_index(values: Iterable) -> pd.Series:
+    """
+    Numbers the occurrences of every value, i.e. the n-th occurrence of a value gets the occurrence index n (starting at
+    1). Used to tell apart repeated URLs in playlists and collections.
+    """
+    values = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    return values.groupby(values, sort=False, dropna=False).cumcount().add(1).astype(int)
+
+
+def url_domain(url: str) -> str:
+    """
+    :return: The hostname of the URL without a leading "www.", so that e.g. www.youtube.com and youtube.com are treated
+        as one site. Other subdomains are kept, because without the public suffix list, subdomains of one site can't be
+        told apart from different sites under a shared suffix like co.uk.
+    """
+    hostname = urlparse(url).hostname or ''
+    return hostname.removeprefix('www.')
+
+
 class Logger:
     logger = logging.getLogger('MusicSync')
 
@@ -105,4 +138,54 @@ def cli_to_api(opts, cli_defaults=False):
     if 'postprocessors' in diff:
         diff['postprocessors'] = [pp for pp in diff['postprocessors']
                                   if pp not in default_opts['postprocessors']]
-    return diff
\ No newline at end of file
+    return diff
+
+
+def user_cache_dir() -> str:
+    """
+    :return: The directory in which MusicSync stores its caches. It is created if it doesn't exist.
+    """
+    cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')), 'musicsync')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def link_file(source: str, destination: str, hardlink: bool = True) -> str:
+    """
+    Makes the file at ``source`` available at ``destination`` without duplicating its data if possible: as a hardlink,
+    as a reflink (copy-on-write clone) if hardlinks aren't supported, or as a copy otherwise (e.g. across filesystems).
+
+    An existing file at ``destination`` is never opened for writing, as it might share its data with other files
+    (e.g. as a hardlink into another collection). ``FileExistsError`` is raised instead.
+
+    :param hardlink: If false, the file isn't hardlinked, so that changes to one of the files (e.g. its tags) don't
+        change the other
+    :return: How the file was linked: ``'hardlink'``, ``'reflink'`` or ``'copy'``
+    """
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return 'hardlink'
+        except FileExistsError:
+            raise
+        except OSError:
+            pass
+
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with open(source, 'rb') as src, open(fd, 'wb') as dst:
+            method = 'copy'
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                    method = 'reflink'
+                except OSError:
+                    pass
+            if method == 'copy':
+                shutil.copyfileobj(src, dst)
+    except BaseException:
+        os.remove(destination)
+        raise
+
+    shutil.copystat(source, destination)
+    return method
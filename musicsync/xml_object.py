@@ -1,5 +1,5 @@
 from abc import abstractmethod, ABC
-from typing import Self
+from typing import Self, TextIO
 from xml.etree.ElementTree import Element
 
 
@@ -12,3 +12,54 @@ class XmlObject(ABC):
     @abstractmethod
     def to_xml(self) -> Element:
         pass
+
+    def stream_xml(self, writer: 'XmlStreamWriter'):
+        """
+        Writes the element of ``to_xml`` to ``writer``. Objects with many children override this to write their
+        children one by one instead of building the whole element first.
+        """
+        writer.element(self.to_xml())
+
+
+class XmlStreamWriter:
+    """
+    Writes XML elements to a text file one by one, so the element tree of the whole document doesn't have to be built
+    first (like for ``ElementTree.write``). Non-ASCII characters are only escaped if the file is opened with
+    ``errors='xmlcharrefreplace'``.
+    """
+    TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+    ATTRIBUTE_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', '\r': '&#13;',
+                                       '\n': '&#10;', '\t': '&#09;'})
+
+    def __init__(self, file: TextIO):
+        self._write = file.write
+
+    def _attributes(self, attrib: dict[str, str]) -> str:
+        return ''.join(f' {name}="{value.translate(self.ATTRIBUTE_ESCAPES)}"' for name, value in attrib.items())
+
+    def start(self, tag: str, attrib: dict[str, str]):
+        self._write(f'<{tag}{self._attributes(attrib)}>')
+
+    def end(self, tag: str):
+        self._write(f'</{tag}>')
+
+    def empty(self, tag: str, attrib: dict[str, str]):
+        self._write(f'<{tag}{self._attributes(attrib)} />')
+
+    def text(self, text: str):
+        self._write(text.translate(self.TEXT_ESCAPES))
+
+    def element(self, el: Element):
+        """
+        Writes an element with all of its children.
+        """
+        if not el.text and not len(el):
+            self.empty(el.tag, el.attrib)
+            return
+
+        self.start(el.tag, el.attrib)
+        if el.text:
+            self.text(el.text)
+        for child in el:
+            self.element(child)
+        self.end(el.tag)